@@ -0,0 +1,489 @@
+# batch.py
+"""
+Run one goal over many locations offline, outside the HTTP API.
+
+Locations (CSV with a header row, or JSONL) are queued in a SQLite job queue,
+so an interrupted run picks up where it stopped. Each job fetches the view
+through GoogleStreetViewService and analyzes it through OpenAIService, and
+results are appended to the output as jobs finish.
+
+Input columns: lat/lng (or latitude/longitude, lon) or pano_id, and optionally
+id, goal, heading, pitch, fov and size. Rows without an id are keyed by file
+name and line number, so re-running with the same file resumes it.
+
+Commands:
+    run      analyze every pending job, writing results as they complete
+    export   write pending jobs as an OpenAI Batch API input file instead of calling the API;
+             they are marked exported, so `run` and later exports skip them
+    import   record the results of exported jobs from an OpenAI Batch API output file
+    status   print job counts
+
+Run from the backend directory:
+    python -m batch run --input corridor.csv --goal "Audit storefronts" --output results.jsonl
+    python -m batch run --output results.parquet        # resume the same queue
+    python -m batch export --input corridor.csv --goal "Audit storefronts" --output batch_input.jsonl
+    python -m batch import batch_output.jsonl --output results.jsonl
+
+Point STREET_VIEW_BASE_URL and OPENAI_BASE_URL at local stand-ins (see
+benchmarks/fake_upstreams.py) to try it without API keys.
+"""
+import argparse
+import asyncio
+import base64
+import csv
+import importlib.util
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from fastapi import HTTPException
+
+from config import Settings
+from main import build_openai_service, build_street_view_service, close_services
+from models.openai import AnalysisOutput, ScreenshotAnalysis
+from models.street_view import StreetViewMetadata
+from services.job_queue import EXPORTED, FAILED, JobQueue
+from services.openai import OpenAIService
+from services.street_view import GoogleStreetViewService
+from services.upstream import error_detail
+
+logger = logging.getLogger("batch")
+
+Job = Tuple[str, Dict[str, Any]]
+
+
+# Input
+
+def _first(row: Dict[str, Any], *names: str) -> Optional[Any]:
+    for name in names:
+        value = row.get(name)
+        if value not in (None, ""):
+            return value
+    return None
+
+
+def _float(value: Optional[Any]) -> Optional[float]:
+    return float(value) if value is not None else None
+
+
+def read_locations(path: str, goal: Optional[str], model: str, size: str) -> List[Job]:
+    """Jobs for every row of a CSV or JSONL file"""
+    with open(path, newline="") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            rows = list(csv.DictReader(f))
+
+    name = os.path.basename(path)
+    jobs = []
+    for line, row in enumerate(rows, start=1):
+        payload = {
+            "goal": _first(row, "goal") or goal,
+            "lat": _float(_first(row, "lat", "latitude")),
+            "lng": _float(_first(row, "lng", "lon", "longitude")),
+            "pano_id": _first(row, "pano_id", "pano"),
+            "heading": _float(_first(row, "heading")),
+            "pitch": _float(_first(row, "pitch")),
+            "fov": _float(_first(row, "fov")),
+            "size": _first(row, "size") or size,
+            "model": model,
+        }
+        if not payload["goal"]:
+            raise ValueError(f"{name}:{line}: no goal (pass --goal or add a goal column)")
+        if not payload["pano_id"] and (payload["lat"] is None or payload["lng"] is None):
+            raise ValueError(f"{name}:{line}: needs lat/lng or pano_id")
+        jobs.append((str(_first(row, "id") or f"{name}:{line}"), payload))
+    return jobs
+
+
+# Output
+
+def result_row(key: str, payload: Dict[str, Any], metadata: StreetViewMetadata, output: Optional[AnalysisOutput]) -> Dict[str, Any]:
+    """Flat result record; the same columns go to JSONL and Parquet"""
+    location = metadata.location or {}
+    row = {
+        "id": key,
+        "status": metadata.status,
+        "goal": payload["goal"],
+        "pano_id": metadata.pano_id,
+        "latitude": location.get("lat", payload["lat"]),
+        "longitude": location.get("lng", payload["lng"]),
+        "date": metadata.date,
+        "heading": payload["heading"],
+        "pitch": payload["pitch"],
+        "fov": payload["fov"],
+    }
+    row.update(output.model_dump() if output is not None else dict.fromkeys(AnalysisOutput.model_fields))
+    return row
+
+
+class JSONLWriter:
+    def __init__(self, path: str):
+        self._file = open(path, "w")
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self._file.write(json.dumps(row) + "\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path: str, row_group_size: int = 1000):
+        """Parquet output written a row group at a time (needs the optional 'pyarrow' package)"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self.row_group_size = row_group_size
+        self.schema = pa.schema([
+            ("id", pa.string()),
+            ("status", pa.string()),
+            ("goal", pa.string()),
+            ("pano_id", pa.string()),
+            ("latitude", pa.float64()),
+            ("longitude", pa.float64()),
+            ("date", pa.string()),
+            ("heading", pa.float64()),
+            ("pitch", pa.float64()),
+            ("fov", pa.float64()),
+            ("next_action", pa.string()),
+            ("next_panorama", pa.string()),
+            ("next_heading", pa.float64()),
+            ("next_pitch", pa.float64()),
+            ("next_zoom", pa.float64()),
+            ("thoughts", pa.string()),
+            ("important_notes", pa.list_(pa.string())),
+            ("goal_response", pa.string()),
+        ])
+        self._writer = pq.ParquetWriter(path, self.schema)
+        self._rows: List[Dict[str, Any]] = []
+
+    def write(self, row: Dict[str, Any]) -> None:
+        self._rows.append(row)
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self.schema))
+            self._rows = []
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+
+def open_writer(path: str, output_format: Optional[str]):
+    """JSONL or Parquet writer, by explicit format or the path's extension"""
+    output_format = output_format or ("parquet" if path.endswith(".parquet") else "jsonl")
+    if output_format == "parquet":
+        if importlib.util.find_spec("pyarrow") is None:
+            raise SystemExit("Parquet output needs the optional 'pyarrow' package (pip install pyarrow)")
+        return ParquetWriter(path)
+    return JSONLWriter(path)
+
+
+def write_existing(writer, queue: JobQueue) -> int:
+    """Write every result already in the queue, so each output file is complete"""
+    count = 0
+    for _, result in queue.results():
+        writer.write(result)
+        count += 1
+    return count
+
+
+# Jobs
+
+async def fetch_view(
+    street_view: GoogleStreetViewService,
+    payload: Dict[str, Any]
+) -> Tuple[StreetViewMetadata, Optional[str]]:
+    """Metadata for a job's location and, when there is imagery, its view as a data URL"""
+    location = (payload["lat"], payload["lng"]) if not payload["pano_id"] else None
+    metadata = await street_view.get_metadata(location=location, pano_id=payload["pano_id"])
+    if metadata.status != "OK" or not metadata.pano_id:
+        return metadata, None
+    image = await street_view.get_image_by_pano(
+        pano_id=metadata.pano_id,
+        size=payload["size"],
+        heading=payload["heading"],
+        pitch=payload["pitch"],
+        fov=payload["fov"]
+    )
+    return metadata, f"data:{image.content_type};base64,{base64.b64encode(image.content).decode('ascii')}"
+
+
+def analysis_request(payload: Dict[str, Any], metadata: StreetViewMetadata, data_url: str) -> ScreenshotAnalysis:
+    return ScreenshotAnalysis(
+        goal=payload["goal"],
+        latitude=metadata.location["lat"],
+        longitude=metadata.location["lng"],
+        heading=payload["heading"] or 0.0,
+        pitch=payload["pitch"] or 0.0,
+        zoom=1.0,
+        images=[data_url],
+        timeline=[],
+        important_notes=[],
+        panoramas=[],
+        model=payload["model"]
+    )
+
+
+async def process_job(
+    key: str,
+    payload: Dict[str, Any],
+    street_view: GoogleStreetViewService,
+    openai_service: OpenAIService
+) -> Dict[str, Any]:
+    metadata, data_url = await fetch_view(street_view, payload)
+    if data_url is None:
+        return result_row(key, payload, metadata, None)
+    result = await openai_service.analyze(analysis_request(payload, metadata, data_url))
+    return result_row(key, payload, metadata, result.output)
+
+
+def job_error(error: Exception) -> str:
+    """Error text stored on a failed job; never includes request URLs (they carry API keys)"""
+    if isinstance(error, HTTPException):
+        return str(error.detail)
+    return error_detail(error)
+
+
+async def drain(
+    queue: JobQueue,
+    concurrency: int,
+    handle,
+    on_result=None
+) -> Dict[str, int]:
+    """Run pending jobs through `handle` with at most `concurrency` in flight"""
+    totals = {"done": 0, "retried": 0, "failed": 0}
+    started = time.monotonic()
+
+    async def worker() -> None:
+        while True:
+            claimed = await queue.claim(1)
+            if not claimed:
+                return
+            key, payload = claimed[0]
+            try:
+                result = await handle(key, payload)
+            except Exception as e:
+                error = job_error(e)
+                if await queue.fail(key, error):
+                    totals["retried"] += 1
+                else:
+                    totals["failed"] += 1
+                    logger.warning(f"Job {key} failed: {error}")
+                continue
+            await queue.complete(key, result)
+            if on_result is not None:
+                on_result(result)
+            totals["done"] += 1
+            if totals["done"] % 50 == 0:
+                rate = totals["done"] / (time.monotonic() - started)
+                logger.info(f"{totals['done']} jobs done ({rate:.1f}/s)")
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return totals
+
+
+# Commands
+
+async def _enqueue_input(args, queue: JobQueue) -> None:
+    if args.input:
+        jobs = read_locations(args.input, args.goal, args.model, args.size)
+        added = await queue.enqueue(jobs)
+        logger.info(f"Queued {added} new jobs from {args.input} ({len(jobs) - added} already queued)")
+    if getattr(args, "retry_failed", False):
+        logger.info(f"Re-queued {await queue.retry_failed()} failed jobs")
+    if getattr(args, "requeue_exported", False):
+        logger.info(f"Re-queued {await queue.requeue_exported()} exported jobs")
+
+
+async def command_run(args) -> None:
+    settings = Settings.from_env()
+    queue = JobQueue(args.db, max_attempts=args.max_attempts)
+    street_view = build_street_view_service(settings)
+    openai_service = build_openai_service(settings, street_view)
+    writer = None
+    try:
+        await _enqueue_input(args, queue)
+        writer = open_writer(args.output, args.format)
+        replayed = write_existing(writer, queue)
+        if replayed:
+            logger.info(f"Wrote {replayed} results from earlier runs")
+        await street_view.start()
+        totals = await drain(
+            queue,
+            args.concurrency,
+            lambda key, payload: process_job(key, payload, street_view, openai_service),
+            on_result=writer.write
+        )
+        logger.info(f"Finished: {totals} -> {args.output}")
+    finally:
+        if writer is not None:
+            writer.close()
+        await close_services(street_view, openai_service)
+        queue.close()
+
+
+async def command_export(args) -> None:
+    """
+    Resolve imagery for pending jobs and write them as Batch API requests
+
+    Jobs with no imagery are completed straight away; the rest are marked
+    exported until their batch results are imported, or until
+    --requeue-exported puts them back (e.g. for a batch that expired).
+    """
+    settings = Settings.from_env()
+    queue = JobQueue(args.db, max_attempts=args.max_attempts)
+    street_view = build_street_view_service(settings)
+    openai_service = build_openai_service(settings, street_view)
+    try:
+        await _enqueue_input(args, queue)
+        await street_view.start()
+        pending = queue.payloads()
+        semaphore = asyncio.Semaphore(args.concurrency)
+        exported = 0
+        with open(args.output, "w") as out:
+            async def export(key: str, payload: Dict[str, Any]) -> None:
+                nonlocal exported
+                async with semaphore:
+                    metadata, data_url = await fetch_view(street_view, payload)
+                    if data_url is None:
+                        await queue.complete(key, result_row(key, payload, metadata, None))
+                        return
+                    line = await openai_service.batch_request(key, analysis_request(payload, metadata, data_url))
+                    await queue.mark_exported(key, {**payload, "metadata": metadata.model_dump()})
+                out.write(json.dumps(line) + "\n")
+                exported += 1
+
+            results = await asyncio.gather(*[export(key, payload) for key, payload in pending], return_exceptions=True)
+        errors = [(key, r) for (key, _), r in zip(pending, results) if isinstance(r, Exception)]
+        for key, error in errors:
+            logger.warning(f"Job {key} could not be exported: {job_error(error)}")
+        logger.info(f"Exported {exported} requests to {args.output} ({len(errors)} errors)")
+    finally:
+        await close_services(street_view, openai_service)
+        queue.close()
+
+
+def _batch_results(path: str) -> Iterable[Dict[str, Any]]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _batch_output(body: Dict[str, Any]) -> AnalysisOutput:
+    """The analysis in a chat completion body; raises ValueError for a refusal or invalid JSON"""
+    message = body["choices"][0]["message"]
+    if message.get("content") is None:
+        raise ValueError(f"Model refused the analysis: {message.get('refusal') or 'no content'}")
+    return AnalysisOutput.model_validate_json(message["content"])
+
+
+async def command_import(args) -> None:
+    queue = JobQueue(args.db, max_attempts=args.max_attempts)
+    try:
+        payloads = dict(queue.payloads(EXPORTED))
+        imported = failed = skipped = 0
+        for item in _batch_results(args.results):
+            key = item.get("custom_id")
+            payload = payloads.get(key)
+            if payload is None:
+                # Not awaiting a batch result: never exported, or already imported
+                skipped += 1
+                continue
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                await queue.fail(key, json.dumps(item.get("error") or response.get("body")))
+                failed += 1
+                continue
+            try:
+                output = _batch_output(response["body"])
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                # One refused or malformed response fails its job, not the whole import
+                await queue.fail(key, str(e))
+                failed += 1
+                continue
+            metadata = StreetViewMetadata(**payload["metadata"])
+            await queue.complete(key, result_row(key, payload, metadata, output))
+            imported += 1
+        logger.info(f"Imported {imported} results ({failed} failed, {skipped} not awaiting a result)")
+        if args.output:
+            writer = open_writer(args.output, args.format)
+            try:
+                written = write_existing(writer, queue)
+            finally:
+                writer.close()
+            logger.info(f"Wrote {written} results to {args.output}")
+    finally:
+        queue.close()
+
+
+async def command_status(args) -> None:
+    queue = JobQueue(args.db)
+    try:
+        counts = await queue.counts()
+        print(json.dumps(counts))
+        for key, payload in queue.payloads(FAILED)[:args.show_failed]:
+            print(f"failed: {key} {payload}")
+    finally:
+        queue.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=".cache/batch.db", help="Job queue database")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Failures before a job is given up on")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_input(command: argparse.ArgumentParser) -> None:
+        command.add_argument("--input", help="CSV or JSONL of locations to queue")
+        command.add_argument("--goal", help="Goal for rows without a goal column")
+        command.add_argument("--model", default="gpt-4o")
+        command.add_argument("--size", default="640x640", help="Image size for rows without a size column")
+        command.add_argument("--concurrency", type=int, default=8, help="Jobs in flight")
+
+    run = commands.add_parser("run", help="Analyze pending jobs")
+    add_input(run)
+    run.add_argument("--output", required=True, help="Results file (.jsonl or .parquet)")
+    run.add_argument("--format", choices=("jsonl", "parquet"), help="Defaults to the output extension")
+    run.add_argument("--retry-failed", action="store_true", help="Give failed jobs another try")
+    run.add_argument("--requeue-exported", action="store_true", help="Analyze exported jobs whose batch never finished")
+
+    export = commands.add_parser("export", help="Write pending jobs as an OpenAI Batch API input file")
+    add_input(export)
+    export.add_argument("--output", required=True, help="Batch API input file (.jsonl)")
+    export.add_argument("--requeue-exported", action="store_true", help="Export earlier exported jobs again")
+
+    import_ = commands.add_parser("import", help="Record results from an OpenAI Batch API output file")
+    import_.add_argument("results", help="Batch API output file")
+    import_.add_argument("--output", help="Also write all results to this file (.jsonl or .parquet)")
+    import_.add_argument("--format", choices=("jsonl", "parquet"))
+
+    status = commands.add_parser("status", help="Print job counts")
+    status.add_argument("--show-failed", type=int, default=10, help="Failed jobs to list")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    handler = {
+        "run": command_run,
+        "export": command_export,
+        "import": command_import,
+        "status": command_status,
+    }[args.command]
+    try:
+        asyncio.run(handler(args))
+    except ValueError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
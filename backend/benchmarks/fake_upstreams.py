@@ -0,0 +1,415 @@
+# benchmarks/fake_upstreams.py
+"""Local stand-ins for the upstream APIs used by the benchmarks"""
+import asyncio
+import io
+import json
+import multiprocessing
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Callable, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from PIL import Image
+
+
+GRID_DEGREES = 0.0001  # roughly 11 m between fake panoramas
+
+
+def fake_pano_at(lat: float, lng: float) -> tuple[str, float, float]:
+    """Snap a point to the fake panorama grid"""
+    i, j = round(lat / GRID_DEGREES), round(lng / GRID_DEGREES)
+    return f"pano_{i}_{j}", i * GRID_DEGREES, j * GRID_DEGREES
+
+
+def fake_pano_location(pano: str) -> tuple[float, float]:
+    _, i, j = pano.rsplit("_", 2)
+    return int(i) * GRID_DEGREES, int(j) * GRID_DEGREES
+
+
+class FaultInjector:
+    def __init__(self, error_rate: float = 0.0, timeout_rate: float = 0.0, timeout: float = 60.0, retry_after: int = 1):
+        """
+        Randomly answer 429 (with Retry-After) or stall past the client's timeout
+
+        Args:
+            error_rate: Fraction of requests rejected with 429
+            timeout_rate: Fraction of requests that hang for `timeout` seconds
+            timeout: How long a stalled request hangs
+            retry_after: Retry-After value sent with 429s
+        """
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.requests = 0
+        self.rejected = 0
+        self.stalled = 0
+
+    async def __call__(self) -> Optional[Response]:
+        self.requests += 1
+        roll = random.random()
+        if roll < self.error_rate:
+            self.rejected += 1
+            return Response(status_code=429, headers={"Retry-After": str(self.retry_after)})
+        if roll < self.error_rate + self.timeout_rate:
+            self.stalled += 1
+            await asyncio.sleep(self.timeout)
+        return None
+
+
+def fake_jpeg(size_bytes: int) -> bytes:
+    """A decodable JPEG padded (after its end marker) to roughly `size_bytes`"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (64, 64), (120, 130, 140)).save(buffer, format="JPEG")
+    image = buffer.getvalue()
+    return image + b"\x00" * max(size_bytes - len(image), 0)
+
+
+def create_street_view_app(
+    latency: float = 0.0,
+    image_bytes: int = 40_000,
+    faults: Optional[FaultInjector] = None
+) -> FastAPI:
+    """
+    Fake Street View Static API
+
+    Images are fixed-size payloads; panoramas sit on a regular grid so metadata
+    probes around a panorama discover distinct neighbours.
+    """
+    app = FastAPI()
+    app.state.faults = faults = faults or FaultInjector()
+    payload = fake_jpeg(image_bytes)
+
+    @app.get("/maps/api/streetview")
+    async def image():
+        if latency:
+            await asyncio.sleep(latency)
+        fault = await faults()
+        if fault is not None:
+            return fault
+        return Response(content=payload, media_type="image/jpeg")
+
+    @app.get("/maps/api/streetview/metadata")
+    async def metadata(location: Optional[str] = None, pano: Optional[str] = None):
+        if latency:
+            await asyncio.sleep(latency)
+        fault = await faults()
+        if fault is not None:
+            return fault
+        if pano:
+            lat, lng = fake_pano_location(pano)
+        else:
+            lat, lng = (float(v) for v in location.split(","))
+            pano, lat, lng = fake_pano_at(lat, lng)
+        return {
+            "copyright": "© Fake",
+            "date": "2024-05",
+            "location": {"lat": lat, "lng": lng},
+            "pano_id": pano,
+            "status": "OK"
+        }
+
+    return app
+
+
+_CONNECTED = re.compile(r"ID: (\S+) Heading: (-?[\d.]+)")
+
+
+def fake_analysis(messages: list) -> dict:
+    """Deterministic AnalysisOutput: move to the first connected panorama, or finish"""
+    text = " ".join(
+        part.get("text", "")
+        for message in messages
+        if isinstance(message.get("content"), list)
+        for part in message["content"]
+        if part.get("type") == "text"
+    )
+    connected = _CONNECTED.findall(text.split("Timeline:")[0])
+    return {
+        "next_action": "new_panorama" if connected else "complete",
+        "next_panorama": connected[0][0] if connected else "",
+        "next_heading": float(connected[0][1]) if connected else 0.0,
+        "next_pitch": 0.0,
+        "next_zoom": 1.0,
+        "thoughts": "The view shows a street with storefronts and parked cars. " * 4,
+        "important_notes": ["A storefront with a green awning is visible on the left."],
+        "goal_response": "Exploring the area; several storefronts observed so far. " * 3,
+    }
+
+
+def create_openai_app(
+    latency: float = 0.0,
+    stream_chunk_delay: float = 0.0,
+    faults: Optional[FaultInjector] = None,
+    thoughts_chars: Optional[int] = None
+) -> FastAPI:
+    """
+    Fake OpenAI chat completions endpoint returning structured AnalysisOutput JSON
+
+    Supports both plain and streamed (`stream: true`) responses; `thoughts_chars`
+    sets the length of the `thoughts` field to vary the completion size.
+    """
+    app = FastAPI()
+    app.state.faults = faults = faults or FaultInjector()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if latency:
+            await asyncio.sleep(latency)
+        fault = await faults()
+        if fault is not None:
+            return fault
+        analysis = fake_analysis(body.get("messages", []))
+        if thoughts_chars is not None:
+            repeats = thoughts_chars // len(analysis["thoughts"]) + 1
+            analysis["thoughts"] = (analysis["thoughts"] * repeats)[:thoughts_chars]
+        content = json.dumps(analysis)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        usage = {"prompt_tokens": 1000, "completion_tokens": len(content) // 4, "total_tokens": 1000 + len(content) // 4}
+
+        if not body.get("stream"):
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": body.get("model", "gpt-4o"),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content, "refusal": None},
+                    "finish_reason": "stop",
+                    "logprobs": None
+                }],
+                "usage": usage
+            }
+
+        async def chunks():
+            def chunk(delta: dict, finish_reason: Optional[str] = None) -> str:
+                return "data: " + json.dumps({
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": body.get("model", "gpt-4o"),
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason, "logprobs": None}]
+                }) + "\n\n"
+
+            yield chunk({"role": "assistant", "content": ""})
+            for i in range(0, len(content), 8):
+                if stream_chunk_delay:
+                    await asyncio.sleep(stream_chunk_delay)
+                yield chunk({"content": content[i:i + 8]})
+            yield chunk({}, "stop")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield "data: " + json.dumps({
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": body.get("model", "gpt-4o"),
+                    "choices": [],
+                    "usage": usage
+                }) + "\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return app
+
+
+class FakeRedisServer:
+    def __init__(self, password: Optional[str] = None, host: str = "127.0.0.1"):
+        """
+        Minimal RESP2 server for the shared-state client, run on the caller's event loop
+
+        Speaks PING, AUTH, SELECT, GET, SET (NX, PX), DEL and EVAL of the lock
+        release script (compare-and-delete); anything else gets an error reply.
+
+        Args:
+            password: Password AUTH must present (None accepts any connection)
+            host: Interface to listen on
+        """
+        self.password = password
+        self.host = host
+        self.port = 0
+        self.values: dict[bytes, tuple[Optional[float], bytes]] = {}
+        self.commands: list[bytes] = []
+        self.connections = 0
+        # Fault injection for the next command received
+        self.drop_next = False
+        self.error_next: Optional[str] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def url(self) -> str:
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}{self.host}:{self.port}/0"
+
+    def _live(self, key: bytes) -> Optional[bytes]:
+        item = self.values.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self.values[key]
+            return None
+        return value
+
+    @staticmethod
+    def _encode(reply: Any) -> bytes:
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, Exception):
+            return f"-{reply}\r\n".encode()
+        if isinstance(reply, int):
+            return b":%d\r\n" % reply
+        if isinstance(reply, str):
+            return f"+{reply}\r\n".encode()
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+
+    @staticmethod
+    async def _read_command(reader: asyncio.StreamReader) -> list[bytes]:
+        count = int((await reader.readuntil(b"\r\n"))[1:-2])
+        args = []
+        for _ in range(count):
+            length = int((await reader.readuntil(b"\r\n"))[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _execute(self, args: list[bytes], authed: bool) -> Any:
+        name = args[0].upper()
+        if name == b"AUTH":
+            return "OK" if args[-1].decode() == self.password else Exception("WRONGPASS invalid username-password pair")
+        if not authed:
+            return Exception("NOAUTH Authentication required.")
+        if name in (b"PING", b"SELECT"):
+            return "PONG" if name == b"PING" else "OK"
+        if name == b"GET":
+            return self._live(args[1])
+        if name == b"SET":
+            options = [arg.upper() for arg in args[3:]]
+            ttl = int(args[3 + options.index(b"PX") + 1]) / 1000 if b"PX" in options else None
+            if b"NX" in options and self._live(args[1]) is not None:
+                return None
+            self.values[args[1]] = (time.monotonic() + ttl if ttl is not None else None, args[2])
+            return "OK"
+        if name == b"DEL":
+            return int(self.values.pop(args[1], None) is not None)
+        if name == b"EVAL" and b"redis.call('get'" in args[1]:
+            key, token = args[3], args[4]
+            if self._live(key) != token:
+                return 0
+            del self.values[key]
+            return 1
+        return Exception(f"ERR unknown command '{name.decode()}'")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        authed = self.password is None
+        try:
+            while True:
+                args = await self._read_command(reader)
+                self.commands.append(args[0].upper())
+                if self.drop_next:
+                    self.drop_next = False
+                    return
+                if self.error_next is not None:
+                    reply, self.error_next = Exception(self.error_next), None
+                else:
+                    reply = self._execute(args, authed)
+                    if args[0].upper() == b"AUTH" and reply == "OK":
+                        authed = True
+                writer.write(self._encode(reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def __aenter__(self) -> "FakeRedisServer":
+        self._server = await asyncio.start_server(self._handle, self.host, 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+
+def _free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread:
+    """Run an ASGI app with uvicorn on a free localhost port in a background thread"""
+
+    def __init__(self, app: FastAPI, host: str = "127.0.0.1"):
+        self.port = _free_port(host)
+        self.host = host
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self) -> "ServerThread":
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.server.should_exit = True
+        self.thread.join()
+
+
+def _serve(factory: Callable[..., FastAPI], kwargs: dict, host: str, port: int) -> None:
+    uvicorn.run(factory(**kwargs), host=host, port=port, log_level="warning")
+
+
+class ServerProcess:
+    """
+    Run an app factory with uvicorn in a child process
+
+    Keeps the stand-in's CPU time and allocations out of the process being
+    measured; fault counters stay in the child.
+    """
+
+    def __init__(self, factory: Callable[..., FastAPI], host: str = "127.0.0.1", **kwargs: Any):
+        self.host = host
+        self.port = _free_port(host)
+        self.process = multiprocessing.get_context("fork").Process(
+            target=_serve,
+            args=(factory, kwargs, host, self.port),
+            daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def __enter__(self) -> "ServerProcess":
+        self.process.start()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                with socket.create_connection((self.host, self.port), timeout=0.1):
+                    return self
+            except OSError:
+                if time.monotonic() > deadline or not self.process.is_alive():
+                    self.process.kill()
+                    raise RuntimeError(f"Stand-in server on port {self.port} did not start")
+                time.sleep(0.02)
+
+    def __exit__(self, *exc) -> None:
+        self.process.terminate()
+        self.process.join(5)
@@ -0,0 +1,67 @@
+# benchmarks/http_client_bench.py
+"""
+Per-request latency of Street View fetches with a fresh client per call
+(the previous behaviour) versus the service's shared keep-alive pool.
+
+Run from the backend directory:
+    python -m benchmarks.http_client_bench --requests 500
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+import httpx
+
+from benchmarks.fake_upstreams import ServerThread, create_street_view_app
+from services.street_view import GoogleStreetViewService
+
+
+def summarize(label: str, samples: List[float]) -> None:
+    ordered = sorted(samples)
+    p95 = ordered[int(len(ordered) * 0.95) - 1]
+    print(
+        f"{label:<22} mean {statistics.mean(ordered) * 1000:7.2f} ms  "
+        f"p50 {statistics.median(ordered) * 1000:7.2f} ms  p95 {p95 * 1000:7.2f} ms"
+    )
+
+
+async def fresh_client_per_request(base_url: str, n: int) -> List[float]:
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        async with httpx.AsyncClient(timeout=30.0) as client:
+            response = await client.get(base_url, params={"pano": f"p{i}", "size": "640x640", "key": "bench"})
+            response.raise_for_status()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+async def shared_client(base_url: str, n: int) -> List[float]:
+    service = GoogleStreetViewService(api_key="bench", base_url=base_url)
+    await service.start()
+    samples = []
+    try:
+        for i in range(n):
+            start = time.perf_counter()
+            await service.get_image_by_pano(f"p{i}")
+            samples.append(time.perf_counter() - start)
+    finally:
+        await service.aclose()
+    return samples
+
+
+async def main(n: int, image_bytes: int) -> None:
+    with ServerThread(create_street_view_app(image_bytes=image_bytes)) as server:
+        base_url = f"{server.url}/maps/api/streetview"
+        summarize("new client per request", await fresh_client_per_request(base_url, n))
+        summarize("shared keep-alive pool", await shared_client(base_url, n))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--image-bytes", type=int, default=40_000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.image_bytes))
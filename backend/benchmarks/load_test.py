@@ -0,0 +1,388 @@
+# benchmarks/load_test.py
+"""
+Drive the FastAPI app in-process through agent-like workloads against local
+stand-ins for Street View and OpenAI, and record throughput, latency
+percentiles and memory per scenario as JSON.
+
+Scenarios:
+    sweep           fetch every heading of a run of panoramas (twice, so the second pass hits caches)
+    metadata_burst  concurrent metadata lookups over a small set of overlapping points
+    analysis        single-shot screenshot analyses
+    long_session    session analyses on top of a large stored timeline and note list
+    explore         server-side exploration runs over SSE
+
+Run from the backend directory:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --scenario sweep --scenario explore --concurrency 32
+    python -m benchmarks.load_test --compare benchmarks/results/<commit>.json
+
+Results are written to benchmarks/results/<commit>.json unless --output is given.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+from PIL import Image
+
+from benchmarks.fake_upstreams import (
+    GRID_DEGREES,
+    FaultInjector,
+    ServerProcess,
+    create_openai_app,
+    create_street_view_app,
+    fake_pano_at
+)
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+SCENARIOS = ("sweep", "metadata_burst", "analysis", "long_session", "explore")
+HEADINGS = (0, 45, 90, 135, 180, 225, 270, 315)
+
+Request = Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    rank = max(1, min(len(ordered), math.ceil(q / 100 * len(ordered))))
+    return ordered[rank - 1]
+
+
+def git_commit() -> Dict[str, Any]:
+    try:
+        sha = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True).stdout.strip())
+        return {"commit": sha, "dirty": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": "unknown", "dirty": None}
+
+
+def sample_image_data_url(size: int = 512) -> str:
+    image = Image.effect_noise((size, size), 64).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+
+def timeline_entry(i: int) -> Dict[str, Any]:
+    pano, _, _ = fake_pano_at(40.0 + i * GRID_DEGREES, -74.0)
+    return {
+        "action": "new_panorama",
+        "panorama": pano,
+        "heading": float(HEADINGS[i % len(HEADINGS)]),
+        "pitch": 0.0,
+        "zoom": 1.0,
+        "timestamp": datetime(2024, 1, 1, tzinfo=timezone.utc).isoformat()
+    }
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class MemoryProbe:
+    def __init__(self, use_tracemalloc: bool = False, interval: float = 0.01):
+        """
+        Memory growth over a scenario
+
+        Resident set size is sampled by default (cheap, Linux only); tracemalloc
+        counts Python allocations exactly but slows the app down several times,
+        so its latency numbers aren't comparable with RSS runs.
+
+        Args:
+            use_tracemalloc: Measure traced Python allocations instead of RSS
+            interval: RSS sampling interval in seconds
+        """
+        self.use_tracemalloc = use_tracemalloc
+        self.interval = interval
+        self._before = 0
+        self._peak = 0
+        self._task: Optional[asyncio.Task] = None
+
+    async def _sample(self) -> None:
+        while True:
+            self._peak = max(self._peak, _rss_bytes() or 0)
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self.use_tracemalloc:
+            tracemalloc.reset_peak()
+            self._before, _ = tracemalloc.get_traced_memory()
+            return
+        self._before = self._peak = _rss_bytes() or 0
+        self._task = asyncio.create_task(self._sample())
+
+    async def stop(self) -> Dict[str, Any]:
+        if self.use_tracemalloc:
+            current, peak = tracemalloc.get_traced_memory()
+            return {"source": "tracemalloc", "peak_bytes": peak - self._before, "retained_bytes": current - self._before}
+        self._task.cancel()
+        current = _rss_bytes()
+        if current is None:
+            return {"source": "unavailable", "peak_bytes": 0, "retained_bytes": 0}
+        self._peak = max(self._peak, current)
+        return {"source": "rss", "peak_bytes": self._peak - self._before, "retained_bytes": current - self._before}
+
+
+async def run_requests(
+    client: httpx.AsyncClient,
+    requests: List[Request],
+    concurrency: int,
+    use_tracemalloc: bool = False
+) -> Dict[str, Any]:
+    """Issue requests with a fixed number of workers; latency, throughput and memory stats"""
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    queue: asyncio.Queue = asyncio.Queue()
+    for request in requests:
+        queue.put_nowait(request)
+
+    async def worker() -> None:
+        while True:
+            try:
+                request = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            started = time.perf_counter()
+            try:
+                response = await request(client)
+                if response.status_code >= 400:
+                    errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+            except Exception as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    memory = MemoryProbe(use_tracemalloc)
+    await memory.start()
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    memory_stats = await memory.stop()
+
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 4),
+        "rps": round(len(ordered) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(ordered) / len(ordered) * 1000, 3) if ordered else 0.0,
+            "p50": round(percentile(ordered, 50) * 1000, 3),
+            "p95": round(percentile(ordered, 95) * 1000, 3),
+            "p99": round(percentile(ordered, 99) * 1000, 3),
+            "max": round(ordered[-1] * 1000, 3) if ordered else 0.0
+        },
+        "memory": memory_stats
+    }
+
+
+def sweep_requests(args: argparse.Namespace) -> List[Request]:
+    panos = [fake_pano_at(40.0 + i * GRID_DEGREES, -74.0)[0] for i in range(max(1, args.requests // (2 * len(HEADINGS))))]
+    requests = []
+    for _ in range(2):
+        for pano in panos:
+            for heading in HEADINGS:
+                requests.append(lambda c, p=pano, h=heading: c.get(f"/streetview/by-pano/{p}", params={"heading": h}))
+    return requests
+
+
+def metadata_burst_requests(args: argparse.Namespace) -> List[Request]:
+    # A handful of distinct points so concurrent lookups overlap
+    points = [(40.0 + (i % 16) * GRID_DEGREES, -74.0) for i in range(args.requests)]
+    return [lambda c, p=p: c.get("/streetview/metadata", params={"lat": p[0], "lng": p[1]}) for p in points]
+
+
+def analysis_requests(args: argparse.Namespace, image: str) -> List[Request]:
+    def body(i: int) -> Dict[str, Any]:
+        return {
+            "goal": "Find a coffee shop",
+            "latitude": 40.0 + i * GRID_DEGREES,
+            "longitude": -74.0,
+            "heading": 0.0,
+            "pitch": 0.0,
+            "zoom": 1.0,
+            "images": [image],
+            "timeline": [timeline_entry(j) for j in range(i % 20)],
+            "important_notes": [],
+            "panoramas": [],
+            "bypass_cache": True
+        }
+    return [lambda c, i=i: c.post("/openai/analyze/screenshot", json=body(i)) for i in range(args.requests)]
+
+
+async def long_session_requests(client: httpx.AsyncClient, args: argparse.Namespace, image: str) -> List[Request]:
+    sessions = []
+    for s in range(args.concurrency):
+        response = await client.post("/sessions", json={"goal": "Map every storefront on the block"})
+        session_id = response.json()["id"]
+        await client.post(f"/sessions/{session_id}/append", json={
+            "timeline": [timeline_entry(i) for i in range(args.timeline_size)],
+            "important_notes": [f"Storefront {i} on the {'north' if i % 2 else 'south'} side sells item {i * 7}" for i in range(args.notes_size)]
+        })
+        sessions.append(session_id)
+
+    def step(session_id: str, i: int) -> Request:
+        return lambda c: c.post(f"/sessions/{session_id}/analyze", json={
+            "latitude": 40.0,
+            "longitude": -74.0,
+            "heading": float(HEADINGS[i % len(HEADINGS)]),
+            "pitch": 0.0,
+            "zoom": 1.0,
+            "images": [image],
+            "panoramas": [],
+            "action": timeline_entry(args.timeline_size + i),
+            "bypass_cache": True
+        })
+
+    return [step(sessions[i % len(sessions)], i) for i in range(args.requests)]
+
+
+def explore_requests(args: argparse.Namespace) -> List[Request]:
+    async def run(client: httpx.AsyncClient, i: int) -> httpx.Response:
+        response = await client.post("/explore/stream", json={
+            "goal": "Find a coffee shop",
+            "latitude": 40.0 + i * 10 * GRID_DEGREES,
+            "longitude": -74.0,
+            "max_steps": args.explore_steps
+        })
+        if b"event: complete" not in response.content:
+            return httpx.Response(500)
+        return response
+    runs = max(1, args.requests // args.explore_steps)
+    return [lambda c, i=i: run(c, i) for i in range(runs)]
+
+
+async def run_scenarios(args: argparse.Namespace) -> Dict[str, Any]:
+    # Imported here so the environment configured in main() is what Settings reads
+    from main import app
+
+    image = sample_image_data_url()
+    results: Dict[str, Any] = {}
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120.0) as client:
+            for name in args.scenario:
+                if name == "sweep":
+                    requests = sweep_requests(args)
+                elif name == "metadata_burst":
+                    requests = metadata_burst_requests(args)
+                elif name == "analysis":
+                    requests = analysis_requests(args, image)
+                elif name == "long_session":
+                    requests = await long_session_requests(client, args, image)
+                else:
+                    requests = explore_requests(args)
+                results[name] = await run_requests(client, requests, args.concurrency, args.tracemalloc)
+                print(format_result(name, results[name]))
+    return results
+
+
+def format_result(name: str, result: Dict[str, Any], baseline: Optional[Dict[str, Any]] = None) -> str:
+    latency = result["latency_ms"]
+    line = (
+        f"{name:<15} {result['requests']:>6} req  {result['rps']:>9.1f} req/s  "
+        f"p50 {latency['p50']:>8.2f}  p95 {latency['p95']:>8.2f}  p99 {latency['p99']:>8.2f} ms  "
+        f"peak {result['memory']['peak_bytes'] / 1e6:>7.1f} MB  errors {sum(result['errors'].values())}"
+    )
+    if baseline is not None:
+        def change(new: float, old: float) -> str:
+            return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+        line += (
+            f"\n{'':<15} vs baseline: req/s {change(result['rps'], baseline['rps'])}, "
+            f"p95 {change(latency['p95'], baseline['latency_ms']['p95'])}, "
+            f"peak memory {change(result['memory']['peak_bytes'], baseline['memory']['peak_bytes'])}"
+        )
+    return line
+
+
+def main(args: argparse.Namespace) -> None:
+    args.scenario = args.scenario or list(SCENARIOS)
+    google_faults = FaultInjector(error_rate=args.error_rate, retry_after=0)
+    openai_faults = FaultInjector(error_rate=args.error_rate, retry_after=0)
+    with tempfile.TemporaryDirectory() as cache_dir, \
+            ServerProcess(create_street_view_app, latency=args.google_latency, image_bytes=args.image_bytes, faults=google_faults) as google, \
+            ServerProcess(create_openai_app, latency=args.openai_latency, faults=openai_faults, thoughts_chars=args.thoughts_chars) as openai:
+        os.environ.update({
+            "GOOGLE_API_KEY": "bench",
+            "OPENAI_API_KEY": "sk-bench",
+            "STREET_VIEW_BASE_URL": f"{google.url}/maps/api/streetview",
+            "OPENAI_BASE_URL": f"{openai.url}/v1",
+            "IMAGE_CACHE_DIR": os.path.join(cache_dir, "images"),
+            "WARM_START_PATH": os.path.join(cache_dir, "warm_start.json.gz"),
+            "SESSION_STORE": "memory",
+            # The stand-ins are local, so let the guards admit the whole workload
+            "GOOGLE_RATE_LIMIT": "100000",
+            "GOOGLE_BURST": "100000",
+            "OPENAI_RATE_LIMIT": "100000",
+            "OPENAI_BURST": "100000",
+            "UPSTREAM_BACKOFF_BASE": "0.01"
+        })
+        if args.tracemalloc:
+            tracemalloc.start()
+        try:
+            results = asyncio.run(run_scenarios(args))
+        finally:
+            tracemalloc.stop()
+
+    report = {
+        **git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "compare")
+        },
+        "scenarios": results
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}{'-dirty' if report['dirty'] else ''}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\ncompared with {baseline.get('commit')} ({args.compare}):")
+        for name, result in results.items():
+            if name in baseline.get("scenarios", {}):
+                print(format_result(name, result, baseline["scenarios"][name]))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="repeatable; defaults to all")
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario (explore: total steps)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--google-latency", type=float, default=0.02)
+    parser.add_argument("--openai-latency", type=float, default=0.2)
+    parser.add_argument("--image-bytes", type=int, default=60_000)
+    parser.add_argument("--thoughts-chars", type=int, default=None, help="size of the fake completion's thoughts field")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls answered with 429")
+    parser.add_argument("--timeline-size", type=int, default=500, help="long_session: stored timeline entries")
+    parser.add_argument("--notes-size", type=int, default=200, help="long_session: stored notes")
+    parser.add_argument("--explore-steps", type=int, default=5)
+    parser.add_argument("--tracemalloc", action="store_true", help="measure Python allocations (slow) instead of RSS")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument("--compare", help="earlier result file to diff against")
+    logging.getLogger("services").setLevel(logging.CRITICAL)
+    logging.getLogger("routes").setLevel(logging.CRITICAL)
+    main(parser.parse_args())
@@ -0,0 +1,70 @@
+# benchmarks/upstream_faults.py
+"""
+Drive GoogleStreetViewService through its UpstreamGuard against a local
+stand-in that injects 429s and timeouts, and report what callers saw.
+
+Run from the backend directory:
+    python -m benchmarks.upstream_faults --requests 400 --error-rate 0.2 --timeout-rate 0.02
+"""
+import argparse
+import asyncio
+import logging
+import time
+from collections import Counter
+
+from benchmarks.fake_upstreams import FaultInjector, ServerThread, create_street_view_app
+from services.street_view import GoogleStreetViewService
+from services.upstream import UpstreamGuard, UpstreamError, classify_httpx_error
+
+
+async def main(args: argparse.Namespace) -> None:
+    faults = FaultInjector(error_rate=args.error_rate, timeout_rate=args.timeout_rate, timeout=5.0, retry_after=0)
+    with ServerThread(create_street_view_app(latency=args.latency, faults=faults)) as server:
+        guard = UpstreamGuard(
+            "google",
+            classify_httpx_error,
+            rate=args.rate,
+            burst=args.rate,
+            base_delay=0.05,
+            max_delay=1.0,
+            max_attempts=args.attempts
+        )
+        service = GoogleStreetViewService(
+            api_key="bench",
+            base_url=f"{server.url}/maps/api/streetview",
+            timeout=args.client_timeout,
+            guard=guard
+        )
+        outcomes: Counter = Counter()
+
+        async def one(i: int) -> None:
+            try:
+                await service.get_image_by_pano(f"p{i}")
+                outcomes["ok"] += 1
+            except UpstreamError as e:
+                outcomes[f"upstream {e.status_code}"] += 1
+            except Exception as e:
+                outcomes[type(e).__name__] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(args.requests)])
+        elapsed = time.perf_counter() - start
+        await service.aclose()
+
+    print(f"{args.requests} requests in {elapsed:.2f}s ({outcomes['ok'] / elapsed:.1f} successful req/s)")
+    print(f"caller outcomes: {dict(outcomes)}")
+    print(f"upstream saw {faults.requests} requests, {faults.rejected} rejected with 429, {faults.stalled} stalled")
+    print(f"guard: {guard.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--rate", type=float, default=200.0, help="guard token bucket rate (req/s)")
+    parser.add_argument("--attempts", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.2)
+    parser.add_argument("--timeout-rate", type=float, default=0.02)
+    parser.add_argument("--client-timeout", type=float, default=0.5)
+    logging.getLogger("services").setLevel(logging.CRITICAL)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,235 @@
+# config.py
+import os
+from typing import Optional
+from dotenv import load_dotenv
+from pydantic import BaseModel
+
+_env_loaded = False
+
+
+def load_env() -> None:
+    """Load the backend .env file once per process; variables already set take precedence"""
+    global _env_loaded
+    if not _env_loaded:
+        load_dotenv()
+        _env_loaded = True
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_optional_float(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+class Settings(BaseModel):
+    google_api_key: Optional[str] = None
+    openai_api_key: Optional[str] = None
+    street_view_base_url: str = "https://maps.googleapis.com/maps/api/streetview"
+    openai_base_url: Optional[str] = None
+
+    # Shared upstream HTTP client
+    http_timeout: float = 30.0
+    http_max_connections: int = 100
+    http_max_keepalive_connections: int = 20
+    http_keepalive_expiry: float = 30.0
+    http2: bool = False
+
+    # Upstream rate limiting, retries and circuit breaking
+    google_rate_limit: float = 50.0
+    google_burst: float = 100.0
+    google_max_concurrency: int = 128
+    openai_rate_limit: float = 10.0
+    openai_burst: float = 20.0
+    openai_max_concurrency: int = 32
+    upstream_max_attempts: int = 3
+    upstream_backoff_base: float = 0.25
+    upstream_backoff_max: float = 8.0
+    upstream_failure_threshold: int = 5
+    upstream_reset_timeout: float = 30.0
+
+    # On-disk Street View image cache
+    image_cache_enabled: bool = True
+    image_cache_dir: str = ".cache/images"
+    image_cache_max_bytes: int = 512 * 1024 * 1024
+    image_cache_heading_step: Optional[float] = None
+    image_cache_pitch_step: Optional[float] = None
+    image_cache_max_age: int = 86400
+
+    # Vision image preprocessing
+    image_preprocess_enabled: bool = True
+    image_max_dimension: int = 1024
+    image_format: str = "JPEG"
+    image_quality: int = 80
+    image_detail: str = "auto"
+    image_workers: int = 4
+
+    # Analysis prompt context
+    prompt_token_budget: int = 2000
+    prompt_recent_timeline: int = 8
+    note_similarity_threshold: float = 0.7
+
+    # Screenshot analysis cache
+    analysis_cache_enabled: bool = True
+    analysis_cache_max_entries: int = 5000
+    analysis_cache_ttl: float = 3600.0
+    analysis_cache_max_distance: int = 6
+
+    # Exploration sessions
+    session_store: str = "memory"
+    session_db_path: str = ".cache/sessions.db"
+
+    # State shared across worker processes (none, memory, sqlite or redis)
+    shared_state: str = "none"
+    shared_state_path: str = ".cache/shared.db"
+    redis_url: str = "redis://localhost:6379/0"
+    shared_lock_ttl: float = 30.0
+    shared_ttl: float = 86400.0
+
+    # Snapshot of the metadata cache and panorama graph, saved at shutdown and loaded at startup
+    warm_start_enabled: bool = True
+    warm_start_path: str = ".cache/warm_start.json.gz"
+    warm_start_max_age: float = 604800.0
+
+    # Batch view fetching
+    batch_concurrency: int = 8
+    batch_max_views: int = 64
+
+    # In-memory metadata cache
+    metadata_cache_enabled: bool = True
+    metadata_cache_max_entries: int = 10000
+    metadata_cache_ttl: float = 86400.0
+    metadata_cache_negative_ttl: float = 3600.0
+    metadata_cache_precision: int = 5
+
+    # Add a Server-Timing header with per-request spans
+    server_timing: bool = False
+
+    # Panorama graph and speculative prefetching during exploration
+    panorama_graph_max_nodes: int = 50000
+    prefetch_enabled: bool = True
+    prefetch_top_k: int = 2
+    prefetch_concurrency: int = 4
+
+    # Persistent spatial index of seen panoramas
+    spatial_index_enabled: bool = True
+    spatial_index_path: str = ".cache/panoramas.json"
+    spatial_index_precision: int = 7
+    spatial_index_tolerance: float = 5.0
+    spatial_index_flush_interval: int = 200
+
+    # Team explorations
+    explore_max_agents: int = 8
+
+    # Multi-heading mosaics
+    mosaic_workers: int = 2
+    mosaic_quality: int = 85
+
+    # Visual novelty filter
+    novelty_filter_enabled: bool = True
+    novelty_threshold: float = 0.1
+    novelty_max_views: int = 256
+
+    # Image format negotiation and transcoded variants
+    transcode_enabled: bool = True
+    transcode_formats: str = "webp,avif"
+    transcode_quality: int = 75
+    transcode_workers: int = 2
+
+    # Model cascade (small model first, escalate to the requested model)
+    cascade_enabled: bool = True
+    cascade_small_model: str = "gpt-4o-mini"
+    cascade_min_confidence: float = 0.8
+    cascade_escalate_on_notes: bool = True
+
+    @classmethod
+    def from_env(cls) -> "Settings":
+        """Build settings from environment variables (and the backend .env file)"""
+        load_env()
+        return cls(
+            google_api_key=os.getenv("GOOGLE_API_KEY"),
+            openai_api_key=os.getenv("OPENAI_API_KEY"),
+            street_view_base_url=os.getenv("STREET_VIEW_BASE_URL", "https://maps.googleapis.com/maps/api/streetview"),
+            openai_base_url=os.getenv("OPENAI_BASE_URL"),
+            http_timeout=float(os.getenv("HTTP_TIMEOUT", 30.0)),
+            http_max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 100)),
+            http_max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20)),
+            http_keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30.0)),
+            http2=_env_bool("HTTP2", False),
+            google_rate_limit=float(os.getenv("GOOGLE_RATE_LIMIT", 50.0)),
+            google_burst=float(os.getenv("GOOGLE_BURST", 100.0)),
+            google_max_concurrency=int(os.getenv("GOOGLE_MAX_CONCURRENCY", 128)),
+            openai_rate_limit=float(os.getenv("OPENAI_RATE_LIMIT", 10.0)),
+            openai_burst=float(os.getenv("OPENAI_BURST", 20.0)),
+            openai_max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", 32)),
+            upstream_max_attempts=int(os.getenv("UPSTREAM_MAX_ATTEMPTS", 3)),
+            upstream_backoff_base=float(os.getenv("UPSTREAM_BACKOFF_BASE", 0.25)),
+            upstream_backoff_max=float(os.getenv("UPSTREAM_BACKOFF_MAX", 8.0)),
+            upstream_failure_threshold=int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", 5)),
+            upstream_reset_timeout=float(os.getenv("UPSTREAM_RESET_TIMEOUT", 30.0)),
+            image_cache_enabled=_env_bool("IMAGE_CACHE_ENABLED", True),
+            image_cache_dir=os.getenv("IMAGE_CACHE_DIR", ".cache/images"),
+            image_cache_max_bytes=int(os.getenv("IMAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024)),
+            image_cache_heading_step=_env_optional_float("IMAGE_CACHE_HEADING_STEP"),
+            image_cache_pitch_step=_env_optional_float("IMAGE_CACHE_PITCH_STEP"),
+            image_cache_max_age=int(os.getenv("IMAGE_CACHE_MAX_AGE", 86400)),
+            image_preprocess_enabled=_env_bool("IMAGE_PREPROCESS_ENABLED", True),
+            image_max_dimension=int(os.getenv("IMAGE_MAX_DIMENSION", 1024)),
+            image_format=os.getenv("IMAGE_FORMAT", "JPEG"),
+            image_quality=int(os.getenv("IMAGE_QUALITY", 80)),
+            image_detail=os.getenv("IMAGE_DETAIL", "auto"),
+            image_workers=int(os.getenv("IMAGE_WORKERS", 4)),
+            prompt_token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", 2000)),
+            prompt_recent_timeline=int(os.getenv("PROMPT_RECENT_TIMELINE", 8)),
+            note_similarity_threshold=float(os.getenv("NOTE_SIMILARITY_THRESHOLD", 0.7)),
+            analysis_cache_enabled=_env_bool("ANALYSIS_CACHE_ENABLED", True),
+            analysis_cache_max_entries=int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", 5000)),
+            analysis_cache_ttl=float(os.getenv("ANALYSIS_CACHE_TTL", 3600.0)),
+            analysis_cache_max_distance=int(os.getenv("ANALYSIS_CACHE_MAX_DISTANCE", 6)),
+            session_store=os.getenv("SESSION_STORE", "memory"),
+            session_db_path=os.getenv("SESSION_DB_PATH", ".cache/sessions.db"),
+            shared_state=os.getenv("SHARED_STATE", "none").lower(),
+            shared_state_path=os.getenv("SHARED_STATE_PATH", ".cache/shared.db"),
+            redis_url=os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+            shared_lock_ttl=float(os.getenv("SHARED_LOCK_TTL", 30.0)),
+            shared_ttl=float(os.getenv("SHARED_TTL", 86400.0)),
+            warm_start_enabled=_env_bool("WARM_START_ENABLED", True),
+            warm_start_path=os.getenv("WARM_START_PATH", ".cache/warm_start.json.gz"),
+            warm_start_max_age=float(os.getenv("WARM_START_MAX_AGE", 604800.0)),
+            batch_concurrency=int(os.getenv("BATCH_CONCURRENCY", 8)),
+            batch_max_views=int(os.getenv("BATCH_MAX_VIEWS", 64)),
+            metadata_cache_enabled=_env_bool("METADATA_CACHE_ENABLED", True),
+            metadata_cache_max_entries=int(os.getenv("METADATA_CACHE_MAX_ENTRIES", 10000)),
+            metadata_cache_ttl=float(os.getenv("METADATA_CACHE_TTL", 86400.0)),
+            metadata_cache_negative_ttl=float(os.getenv("METADATA_CACHE_NEGATIVE_TTL", 3600.0)),
+            metadata_cache_precision=int(os.getenv("METADATA_CACHE_PRECISION", 5)),
+            server_timing=_env_bool("SERVER_TIMING", False),
+            panorama_graph_max_nodes=int(os.getenv("PANORAMA_GRAPH_MAX_NODES", 50000)),
+            prefetch_enabled=_env_bool("PREFETCH_ENABLED", True),
+            prefetch_top_k=int(os.getenv("PREFETCH_TOP_K", 2)),
+            prefetch_concurrency=int(os.getenv("PREFETCH_CONCURRENCY", 4)),
+            spatial_index_enabled=_env_bool("SPATIAL_INDEX_ENABLED", True),
+            spatial_index_path=os.getenv("SPATIAL_INDEX_PATH", ".cache/panoramas.json"),
+            spatial_index_precision=int(os.getenv("SPATIAL_INDEX_PRECISION", 7)),
+            spatial_index_tolerance=float(os.getenv("SPATIAL_INDEX_TOLERANCE", 5.0)),
+            spatial_index_flush_interval=int(os.getenv("SPATIAL_INDEX_FLUSH_INTERVAL", 200)),
+            explore_max_agents=int(os.getenv("EXPLORE_MAX_AGENTS", 8)),
+            mosaic_workers=int(os.getenv("MOSAIC_WORKERS", 2)),
+            mosaic_quality=int(os.getenv("MOSAIC_QUALITY", 85)),
+            novelty_filter_enabled=_env_bool("NOVELTY_FILTER_ENABLED", True),
+            novelty_threshold=float(os.getenv("NOVELTY_THRESHOLD", 0.1)),
+            novelty_max_views=int(os.getenv("NOVELTY_MAX_VIEWS", 256)),
+            transcode_enabled=_env_bool("TRANSCODE_ENABLED", True),
+            transcode_formats=os.getenv("TRANSCODE_FORMATS", "webp,avif"),
+            transcode_quality=int(os.getenv("TRANSCODE_QUALITY", 75)),
+            transcode_workers=int(os.getenv("TRANSCODE_WORKERS", 2)),
+            cascade_enabled=_env_bool("CASCADE_ENABLED", True),
+            cascade_small_model=os.getenv("CASCADE_SMALL_MODEL", "gpt-4o-mini"),
+            cascade_min_confidence=float(os.getenv("CASCADE_MIN_CONFIDENCE", 0.8)),
+            cascade_escalate_on_notes=_env_bool("CASCADE_ESCALATE_ON_NOTES", True),
+        )
@@ -0,0 +1,51 @@
+# dependencies.py
+from typing import Optional
+from fastapi import Request
+from services.street_view import GoogleStreetViewService
+from services.openai import OpenAIService
+from services.explorer import ExplorationService
+from services.session_store import SessionStore
+from services.mosaic import MosaicComposer
+from services.novelty import NoveltyTracker
+from services.transcode import ImageTranscoder
+from services.warm_start import WarmStartSnapshot
+
+
+def get_street_view_service(request: Request) -> GoogleStreetViewService:
+    """Street View service owned by the app lifespan"""
+    return request.app.state.street_view
+
+
+def get_openai_service(request: Request) -> OpenAIService:
+    """OpenAI service owned by the app lifespan"""
+    return request.app.state.openai
+
+
+def get_exploration_service(request: Request) -> ExplorationService:
+    """Server-side exploration loop owned by the app lifespan"""
+    return request.app.state.explorer
+
+
+def get_session_store(request: Request) -> SessionStore:
+    """Exploration session store owned by the app lifespan"""
+    return request.app.state.sessions
+
+
+def get_mosaic_composer(request: Request) -> MosaicComposer:
+    """Multi-heading mosaic composer owned by the app lifespan"""
+    return request.app.state.mosaic
+
+
+def get_novelty_tracker(request: Request) -> Optional[NoveltyTracker]:
+    """Per-session novelty filter owned by the app lifespan (None when disabled)"""
+    return request.app.state.novelty
+
+
+def get_image_transcoder(request: Request) -> Optional[ImageTranscoder]:
+    """Image format/size negotiation owned by the app lifespan (None when disabled)"""
+    return request.app.state.transcoder
+
+
+def get_warm_start(request: Request) -> Optional[WarmStartSnapshot]:
+    """Warm-start snapshot owned by the app lifespan (None when disabled)"""
+    return request.app.state.warm_start
@@ -1,22 +1,305 @@
 # main.py
-from fastapi import FastAPI
+import time
+
+# Measured from here so /metrics can report how long the imports below take
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
+from typing import Optional
+import logging
+import math
+import httpx
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from routes import street_view, openai
-# Initialize app
-app = FastAPI()
-
-# Update CORS middleware configuration
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "http://localhost:5173",
-    ],  # Update this to match your Vite dev server port
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-    expose_headers=["*"]
-)
-
-# Include routers
-app.include_router(street_view.router)
-app.include_router(openai.router)
+from fastapi.responses import JSONResponse
+from config import Settings
+from routes import street_view, openai, explore, sessions, metrics
+from services.street_view import GoogleStreetViewService
+from services.image_cache import ImageCache
+from services.metadata_cache import MetadataCache
+from services.openai import OpenAIService, classify_openai_error
+from services.explorer import ExplorationService
+from services.image_processing import ImagePreprocessor
+from services.prompt_context import PromptContextBuilder
+from services.analysis_cache import AnalysisCache
+from services.upstream import UpstreamGuard, UpstreamError, classify_httpx_error
+from services.session_store import InMemorySessionStore, SQLiteSessionStore, SharedSessionStore
+from services.metrics import MetricsMiddleware, STARTUP_SECONDS
+from services.panorama_graph import PanoramaGraph
+from services.prefetch import Prefetcher
+from services.mosaic import MosaicComposer
+from services.spatial_index import PanoramaIndex
+from services.novelty import NoveltyTracker
+from services.model_cascade import ModelCascade
+from services.transcode import ImageTranscoder
+from services.shared_state import SharedState, MemorySharedState, SQLiteSharedState, RedisSharedState, SharedFlight
+from services.warm_start import WarmStartSnapshot
+
+logger = logging.getLogger(__name__)
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
+STARTUP_SECONDS.set(IMPORT_SECONDS, phase="import")
+
+
+def _guard_settings(settings: Settings) -> dict:
+    return dict(
+        max_attempts=settings.upstream_max_attempts,
+        base_delay=settings.upstream_backoff_base,
+        max_delay=settings.upstream_backoff_max,
+        failure_threshold=settings.upstream_failure_threshold,
+        reset_timeout=settings.upstream_reset_timeout
+    )
+
+
+def build_shared_state(settings: Settings) -> Optional[SharedState]:
+    """Cross-worker state backend named by SHARED_STATE (None when it is 'none')"""
+    if settings.shared_state == "sqlite":
+        return SQLiteSharedState(settings.shared_state_path)
+    if settings.shared_state == "redis":
+        return RedisSharedState(settings.redis_url)
+    if settings.shared_state == "memory":
+        return MemorySharedState()
+    if settings.shared_state != "none":
+        raise ValueError(f"Unknown SHARED_STATE {settings.shared_state!r} (expected none, memory, sqlite or redis)")
+    return None
+
+
+def build_street_view_service(settings: Settings, shared_state: Optional[SharedState] = None) -> GoogleStreetViewService:
+    """Street View service with the caches, graph, spatial index, guard and shared state the settings enable"""
+    image_cache = None
+    if settings.image_cache_enabled:
+        image_cache = ImageCache(
+            directory=settings.image_cache_dir,
+            max_bytes=settings.image_cache_max_bytes,
+            heading_step=settings.image_cache_heading_step,
+            pitch_step=settings.image_cache_pitch_step
+        )
+    metadata_cache = None
+    if settings.metadata_cache_enabled:
+        metadata_cache = MetadataCache(
+            max_entries=settings.metadata_cache_max_entries,
+            ttl=settings.metadata_cache_ttl,
+            negative_ttl=settings.metadata_cache_negative_ttl,
+            precision=settings.metadata_cache_precision
+        )
+    spatial_index = None
+    if settings.spatial_index_enabled:
+        spatial_index = PanoramaIndex(
+            path=settings.spatial_index_path,
+            precision=settings.spatial_index_precision,
+            flush_interval=settings.spatial_index_flush_interval
+        )
+    return GoogleStreetViewService(
+        api_key=settings.google_api_key,
+        base_url=settings.street_view_base_url,
+        timeout=settings.http_timeout,
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive_connections,
+        keepalive_expiry=settings.http_keepalive_expiry,
+        http2=settings.http2,
+        image_cache=image_cache,
+        metadata_cache=metadata_cache,
+        graph=PanoramaGraph(max_nodes=settings.panorama_graph_max_nodes),
+        spatial_index=spatial_index,
+        index_tolerance=settings.spatial_index_tolerance,
+        shared=SharedFlight(shared_state, lock_ttl=settings.shared_lock_ttl) if shared_state is not None else None,
+        shared_ttl=settings.shared_ttl,
+        guard=UpstreamGuard(
+            "google",
+            classify_httpx_error,
+            rate=settings.google_rate_limit,
+            burst=settings.google_burst,
+            initial_concurrency=min(16, settings.google_max_concurrency),
+            max_concurrency=settings.google_max_concurrency,
+            **_guard_settings(settings)
+        )
+    )
+
+
+def build_openai_service(settings: Settings, street_view: GoogleStreetViewService) -> OpenAIService:
+    """OpenAI service with the preprocessing, prompt context, cache, cascade and guard the settings enable"""
+    preprocessor = None
+    if settings.image_preprocess_enabled:
+        preprocessor = ImagePreprocessor(
+            max_dimension=settings.image_max_dimension,
+            image_format=settings.image_format,
+            quality=settings.image_quality,
+            detail=settings.image_detail,
+            max_workers=settings.image_workers
+        )
+    analysis_cache = None
+    if settings.analysis_cache_enabled:
+        analysis_cache = AnalysisCache(
+            max_entries=settings.analysis_cache_max_entries,
+            ttl=settings.analysis_cache_ttl,
+            max_distance=settings.analysis_cache_max_distance
+        )
+    cascade = None
+    if settings.cascade_enabled:
+        cascade = ModelCascade(
+            small_model=settings.cascade_small_model,
+            min_confidence=settings.cascade_min_confidence,
+            escalate_on_notes=settings.cascade_escalate_on_notes
+        )
+    return OpenAIService(
+        api_key=settings.openai_api_key,
+        base_url=settings.openai_base_url,
+        http_client_factory=lambda: httpx.AsyncClient(
+            timeout=settings.http_timeout,
+            limits=street_view.limits,
+            http2=street_view.http2
+        ),
+        preprocessor=preprocessor,
+        context_builder=PromptContextBuilder(
+            token_budget=settings.prompt_token_budget,
+            recent_entries=settings.prompt_recent_timeline,
+            note_similarity=settings.note_similarity_threshold
+        ),
+        analysis_cache=analysis_cache,
+        cascade=cascade,
+        guard=UpstreamGuard(
+            "openai",
+            classify_openai_error,
+            rate=settings.openai_rate_limit,
+            burst=settings.openai_burst,
+            initial_concurrency=min(16, settings.openai_max_concurrency),
+            max_concurrency=settings.openai_max_concurrency,
+            **_guard_settings(settings)
+        )
+    )
+
+
+async def close_services(street_view: GoogleStreetViewService, openai_service: OpenAIService) -> None:
+    """Persist the on-disk caches and close the connection pools"""
+    if street_view.image_cache is not None:
+        await street_view.image_cache.flush()
+    if street_view.spatial_index is not None:
+        await street_view.spatial_index.flush(force=True)
+    await street_view.aclose()
+    await openai_service.aclose()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Create the upstream services once per process and restore the warm-start snapshot
+
+    Connection pools and the OpenAI SDK client are opened on first use, so
+    startup does no network or SDK work.
+    """
+    started = time.perf_counter()
+    settings = app.state.settings
+    app.state.shared_state = build_shared_state(settings)
+    app.state.street_view = build_street_view_service(settings, app.state.shared_state)
+    app.state.openai = build_openai_service(settings, app.state.street_view)
+    prefetcher = None
+    if settings.prefetch_enabled:
+        prefetcher = Prefetcher(
+            app.state.street_view,
+            top_k=settings.prefetch_top_k,
+            concurrency=settings.prefetch_concurrency
+        )
+    app.state.mosaic = MosaicComposer(
+        app.state.street_view,
+        max_workers=settings.mosaic_workers,
+        quality=settings.mosaic_quality
+    )
+    app.state.transcoder = None
+    if settings.transcode_enabled:
+        app.state.transcoder = ImageTranscoder(
+            app.state.street_view.image_cache,
+            formats=[f.strip() for f in settings.transcode_formats.split(",") if f.strip()],
+            quality=settings.transcode_quality,
+            max_workers=settings.transcode_workers
+        )
+    app.state.novelty = None
+    if settings.novelty_filter_enabled:
+        app.state.novelty = NoveltyTracker(
+            threshold=settings.novelty_threshold,
+            max_views=settings.novelty_max_views
+        )
+    app.state.explorer = ExplorationService(
+        app.state.street_view,
+        app.state.openai,
+        prefetcher=prefetcher,
+        mosaic=app.state.mosaic,
+        novelty=app.state.novelty,
+        max_agents=settings.explore_max_agents
+    )
+    if settings.session_store == "sqlite":
+        app.state.sessions = SQLiteSessionStore(settings.session_db_path)
+    elif settings.session_store == "shared":
+        if app.state.shared_state is None:
+            raise ValueError("SESSION_STORE=shared needs SHARED_STATE set to memory, sqlite or redis")
+        app.state.sessions = SharedSessionStore(app.state.shared_state)
+    else:
+        app.state.sessions = InMemorySessionStore()
+    app.state.warm_start = None
+    if settings.warm_start_enabled:
+        app.state.warm_start = WarmStartSnapshot(settings.warm_start_path, max_age=settings.warm_start_max_age)
+        await app.state.warm_start.load(app.state.street_view)
+    startup = time.perf_counter() - started
+    STARTUP_SECONDS.set(startup, phase="lifespan")
+    logger.info(f"Started in {startup:.3f}s after {IMPORT_SECONDS:.3f}s of imports")
+    try:
+        yield
+    finally:
+        if app.state.warm_start is not None:
+            await app.state.warm_start.save(app.state.street_view)
+        await close_services(app.state.street_view, app.state.openai)
+        await app.state.sessions.close()
+        app.state.mosaic.close()
+        if app.state.transcoder is not None:
+            app.state.transcoder.close()
+        if app.state.shared_state is not None:
+            await app.state.shared_state.close()
+
+
+async def upstream_error_handler(request: Request, exc: UpstreamError):
+    """Surface upstream failures as 429/502/503 instead of opaque errors"""
+    headers = None
+    if exc.retry_after is not None:
+        headers = {"Retry-After": str(math.ceil(exc.retry_after))}
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": str(exc), "upstream": exc.upstream},
+        headers=headers
+    )
+
+
+def create_app(settings: Optional[Settings] = None) -> FastAPI:
+    """
+    Build the API for the given settings (read from the environment by default)
+
+    Services are created by the lifespan hook, so building the app is cheap;
+    run `uvicorn main:create_app --factory` to skip the module-level app.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.state.settings = settings or Settings.from_env()
+    app.add_exception_handler(UpstreamError, upstream_error_handler)
+
+    # Request latency, in-flight and response size metrics (served at /metrics)
+    app.add_middleware(MetricsMiddleware, server_timing=app.state.settings.server_timing)
+
+    # Update CORS middleware configuration
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=[
+            "http://localhost:5173",
+        ],  # Update this to match your Vite dev server port
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["*"]
+    )
+
+    # Include routers
+    app.include_router(street_view.router)
+    app.include_router(openai.router)
+    app.include_router(explore.router)
+    app.include_router(sessions.router)
+    app.include_router(metrics.router)
+    return app
+
+
+app = create_app()
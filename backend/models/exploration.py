@@ -0,0 +1,44 @@
+# models/exploration.py
+from pydantic import BaseModel, Field, model_validator
+from typing import Optional, Dict, Any, Literal
+
+class ExplorationRequest(BaseModel):
+    goal: str
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    pano_id: Optional[str] = None
+    heading: float = 0.0
+    pitch: float = 0.0
+    zoom: float = 1.0
+    max_steps: int = Field(20, ge=1, le=200)
+    max_seconds: float = Field(300.0, gt=0)
+    image_size: str = "640x640"
+    temperature: Optional[float] = 0.7
+    model: Optional[str] = "gpt-4o"
+    max_tokens: Optional[int] = 300
+    # Analyze a labelled mosaic of this many headings per step instead of a single view
+    mosaic_views: Optional[int] = Field(None, ge=2, le=12)
+    mosaic_tile_size: str = "320x320"
+    # Skip views whose novelty against earlier views falls below this (None: server default, 0: never skip)
+    novelty_threshold: Optional[float] = Field(None, ge=0, le=1)
+    # Include per-step timing spans (image fetch, link probing, analysis) in step events
+    trace: bool = False
+
+    @model_validator(mode="after")
+    def check_start(self) -> "ExplorationRequest":
+        if not self.pano_id and (self.latitude is None or self.longitude is None):
+            raise ValueError("Either pano_id or latitude/longitude must be provided")
+        return self
+
+class TeamExplorationRequest(ExplorationRequest):
+    # Agents exploring concurrently; max_steps and max_seconds are shared by the whole team
+    agents: int = Field(4, ge=1, le=16)
+
+class ExplorationEvent(BaseModel):
+    event: Literal["start", "step", "error", "complete"]
+    run_id: str
+    step: Optional[int] = None
+    data: Dict[str, Any] = {}
+
+    def to_sse(self) -> str:
+        return f"event: {self.event}\ndata: {self.model_dump_json()}\n\n"
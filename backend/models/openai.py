@@ -1,6 +1,6 @@
 # models/openai.py
 from pydantic import BaseModel
-from typing import Optional, Type, Union, List, Dict, Literal
+from typing import Optional, Type, Union, List, Dict, Literal, Any
 
 class ImageContent(BaseModel):
     type: Literal["image_url"]
@@ -46,6 +46,12 @@ class ScreenshotAnalysis(BaseModel):
     temperature: Optional[float] = 0.7
     model: Optional[str] = "gpt-4o"
     max_tokens: Optional[int] = 300
+    image_detail: Optional[Literal["low", "high", "auto"]] = None
+    # How the images are laid out (e.g. a labelled multi-heading mosaic)
+    image_description: Optional[str] = None
+    bypass_cache: bool = False
+    # Try the server's cheaper cascade model first, escalating to `model` when needed
+    cascade: bool = True
 
 class AnalysisOutput(BaseModel):
     next_action: str
@@ -55,4 +61,50 @@ class AnalysisOutput(BaseModel):
     next_zoom: float
     thoughts: str
     important_notes: List[str]
-    goal_response: str
\ No newline at end of file
+    goal_response: str
+
+class ImagePreprocessReport(BaseModel):
+    images: int = 0
+    processed: int = 0
+    passthrough: int = 0
+    original_bytes: int = 0
+    processed_bytes: int = 0
+    original_tokens: int = 0
+    processed_tokens: int = 0
+
+    @property
+    def bytes_saved(self) -> int:
+        return self.original_bytes - self.processed_bytes
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.original_tokens - self.processed_tokens
+
+class NoveltyReport(BaseModel):
+    score: float
+    threshold: float
+    skipped: bool
+    compared: int
+
+class CascadeRoute(BaseModel):
+    model: str
+    escalated: bool
+    reason: Optional[str] = None
+    confidence: Optional[float] = None
+
+class AnalysisResult(BaseModel):
+    output: AnalysisOutput
+    image_report: Optional[ImagePreprocessReport] = None
+    prompt_tokens_estimate: Optional[int] = None
+    cache_hit: bool = False
+    novelty: Optional[NoveltyReport] = None
+    route: Optional[CascadeRoute] = None
+
+class AnalysisStreamEvent(BaseModel):
+    event: Literal["field", "navigation", "delta", "result", "error"]
+    field: Optional[str] = None
+    data: Any = None
+    cache_hit: bool = False
+
+    def to_sse(self) -> str:
+        return f"event: {self.event}\ndata: {self.model_dump_json()}\n\n"
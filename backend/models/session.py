@@ -0,0 +1,36 @@
+# models/session.py
+from pydantic import BaseModel, Field
+from typing import Optional, List, Literal
+from models.openai import ActionTimeline, ConnectedPanorama
+
+class SessionCreate(BaseModel):
+    goal: str
+
+class ExplorationSession(BaseModel):
+    id: str
+    goal: str
+    created_at: str
+    updated_at: str
+    timeline: List[ActionTimeline] = []
+    important_notes: List[str] = []
+
+class SessionAppend(BaseModel):
+    timeline: List[ActionTimeline] = []
+    important_notes: List[str] = []
+
+class SessionAnalysisRequest(BaseModel):
+    latitude: float
+    longitude: float
+    heading: float
+    pitch: float
+    zoom: float
+    images: List[str]
+    panoramas: List[ConnectedPanorama]
+    action: Optional[ActionTimeline] = None
+    temperature: Optional[float] = 0.7
+    model: Optional[str] = "gpt-4o"
+    max_tokens: Optional[int] = 300
+    image_detail: Optional[Literal["low", "high", "auto"]] = None
+    bypass_cache: bool = False
+    # Reuse the earlier analysis when the view's novelty falls below this (None: server default, 0: never skip)
+    novelty_threshold: Optional[float] = Field(None, ge=0, le=1)
@@ -1,21 +1,81 @@
-from pydantic import BaseModel
-from typing import Optional, Dict
+from pydantic import BaseModel, Field, model_validator
+from typing import Optional, Dict, List, Literal, Union
 
 class StreetViewResponse(BaseModel):
     content: bytes
     content_type: str
     status_code: int
+    etag: Optional[str] = None
+    cache_hit: bool = False
+
+class ImageVariant(BaseModel):
+    format: Literal["jpeg", "webp", "avif"]
+    width: Optional[int] = None
+    quality: int = 75
+
+    @property
+    def content_type(self) -> str:
+        return f"image/{self.format}"
 
 class StreetViewMetadata(BaseModel):
-    copyright: Optional[str]
-    date: Optional[str]
-    location: Optional[Dict[str, float]]
-    pano_id: Optional[str]
+    copyright: Optional[str] = None
+    date: Optional[str] = None
+    location: Optional[Dict[str, float]] = None
+    pano_id: Optional[str] = None
     status: str
 
+class PanoramaLink(BaseModel):
+    pano: str
+    heading: float
+    distance: float
+    location: Dict[str, float]
+
 class AddressRequest(BaseModel):
     address: str
     size: str = "640x640"
     heading: Optional[float] = None
     pitch: Optional[float] = None
-    fov: Optional[float] = None
\ No newline at end of file
+    fov: Optional[float] = None
+    # Downscale to this width and/or re-encode at this quality (format comes from Accept)
+    width: Optional[int] = Field(None, ge=16, le=640)
+    quality: Optional[int] = Field(None, ge=1, le=100)
+
+class ViewSpec(BaseModel):
+    pano_id: Optional[str] = None
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    address: Optional[str] = None
+    size: str = "640x640"
+    heading: Optional[float] = None
+    pitch: Optional[float] = None
+    fov: Optional[float] = None
+
+    @model_validator(mode="after")
+    def check_target(self) -> "ViewSpec":
+        if not self.pano_id and not self.address and (self.lat is None or self.lng is None):
+            raise ValueError("Each view needs a pano_id, an address, or lat/lng coordinates")
+        return self
+
+    @property
+    def location(self) -> Optional[Union[str, tuple[float, float]]]:
+        if self.address:
+            return self.address
+        if self.lat is not None and self.lng is not None:
+            return (self.lat, self.lng)
+        return None
+
+class BatchViewRequest(BaseModel):
+    views: List[ViewSpec] = Field(..., min_length=1)
+    concurrency: Optional[int] = Field(None, ge=1)
+
+class MosaicImage(BaseModel):
+    content: bytes
+    content_type: str
+    pano_id: str
+    headings: List[float]
+    rows: int
+    columns: int
+    width: int
+    height: int
+    fov: float
+    cache_hits: int = 0
@@ -0,0 +1,69 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from models.exploration import ExplorationRequest, TeamExplorationRequest
+from dependencies import get_exploration_service
+from services.explorer import ExplorationService
+
+
+router = APIRouter(prefix="/explore", tags=["explore"])
+
+@router.post("/stream")
+async def stream_exploration(
+    request: ExplorationRequest,
+    http_request: Request,
+    explorer: ExplorationService = Depends(get_exploration_service)
+):
+    """Run the exploration loop server-side and stream each step as a server-sent event"""
+    async def events():
+        run = explorer.run(request)
+        try:
+            async for event in run:
+                yield event.to_sse()
+                if await http_request.is_disconnected():
+                    explorer.cancel(event.run_id)
+        finally:
+            await run.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.post("/team/stream")
+async def stream_team_exploration(
+    request: TeamExplorationRequest,
+    http_request: Request,
+    explorer: ExplorationService = Depends(get_exploration_service)
+):
+    """Run several exploration agents concurrently and stream their steps as server-sent events"""
+    async def events():
+        run = explorer.run_team(request)
+        try:
+            async for event in run:
+                yield event.to_sse()
+                if await http_request.is_disconnected():
+                    explorer.cancel(event.run_id)
+        finally:
+            await run.aclose()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/runs")
+async def list_runs(explorer: ExplorationService = Depends(get_exploration_service)):
+    """IDs of explorations currently running"""
+    return {"runs": explorer.active_runs}
+
+@router.delete("/{run_id}")
+async def cancel_exploration(
+    run_id: str,
+    explorer: ExplorationService = Depends(get_exploration_service)
+):
+    """Cancel a running exploration, abandoning its in-flight step"""
+    if not explorer.cancel(run_id):
+        raise HTTPException(status_code=404, detail="Exploration not found")
+    return {"run_id": run_id, "cancelled": True}
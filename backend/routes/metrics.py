@@ -0,0 +1,69 @@
+from typing import Optional
+from fastapi import APIRouter, Depends
+from fastapi.responses import PlainTextResponse
+from dependencies import get_street_view_service, get_openai_service, get_exploration_service, get_image_transcoder, get_warm_start
+from services.street_view import GoogleStreetViewService
+from services.openai import OpenAIService
+from services.explorer import ExplorationService
+from services.transcode import ImageTranscoder
+from services.warm_start import WarmStartSnapshot
+from services.metrics import REGISTRY, stats_gauges
+
+
+router = APIRouter(tags=["metrics"])
+
+
+def _guard_stats(guard) -> Optional[dict]:
+    if guard is None:
+        return None
+    stats = guard.stats()
+    stats["circuit_open"] = int(stats["circuit"] == "open")
+    return stats
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics(
+    street_view: GoogleStreetViewService = Depends(get_street_view_service),
+    openai_service: OpenAIService = Depends(get_openai_service),
+    explorer: ExplorationService = Depends(get_exploration_service),
+    transcoder: Optional[ImageTranscoder] = Depends(get_image_transcoder),
+    warm_start: Optional[WarmStartSnapshot] = Depends(get_warm_start)
+):
+    """Prometheus text exposition of request, upstream, token and cache metrics"""
+    metadata = None
+    if street_view.metadata_cache is not None:
+        metadata = {**street_view.metadata_cache.stats(), "coalesced": street_view.metadata_flight.coalesced}
+    caches = stats_gauges("cache", "Cache statistics", "cache", {
+        "image": street_view.image_cache.stats() if street_view.image_cache is not None else None,
+        "metadata": metadata,
+        "analysis": openai_service.analysis_cache.stats() if openai_service.analysis_cache is not None else None,
+        "panorama_graph": street_view.graph.stats() if street_view.graph is not None else None,
+        "spatial_index": street_view.spatial_index.stats() if street_view.spatial_index is not None else None,
+    })
+    prefetch = stats_gauges("prefetch", "Exploration prefetcher", "service", {
+        "explorer": explorer.prefetcher.stats() if explorer.prefetcher is not None else None,
+    })
+    cascade = stats_gauges(
+        "analysis_cascade", "Model cascade tier", "tier",
+        openai_service.cascade.stats()["tiers"] if openai_service.cascade is not None else {}
+    )
+    shared = stats_gauges("shared_state", "Cross-worker shared state", "service", {
+        "streetview": street_view.shared.stats() if street_view.shared is not None else None,
+    })
+    transcode = stats_gauges("transcode", "Image variant transcoding", "service", {
+        "streetview": transcoder.stats() if transcoder is not None else None,
+    })
+    novelty = stats_gauges("novelty", "Visual novelty filter", "service", {
+        "explorer": explorer.novelty.stats() if explorer.novelty is not None else None,
+    })
+    snapshot = stats_gauges("warm_start", "Warm-start snapshot", "service", {
+        "streetview": warm_start.stats() if warm_start is not None else None,
+    })
+    guards = stats_gauges("upstream_guard", "Upstream guard state", "upstream", {
+        "google": _guard_stats(street_view.guard),
+        "openai": _guard_stats(openai_service.guard),
+    })
+    return PlainTextResponse(
+        REGISTRY.render(extra=caches + guards + prefetch + novelty + cascade + transcode + shared + snapshot),
+        media_type="text/plain; version=0.0.4"
+    )
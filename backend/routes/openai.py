@@ -1,18 +1,33 @@
-from models.openai import ChatRequest, ScreenshotAnalysis
-from fastapi import APIRouter
+from models.openai import ChatRequest, ScreenshotAnalysis, AnalysisResult
+from fastapi import APIRouter, Depends, Response
 from fastapi.responses import StreamingResponse
-import os
-from dotenv import load_dotenv
+from dependencies import get_openai_service
 from services.openai import OpenAIService
 
 
-load_dotenv()
-
 router = APIRouter(prefix="/openai", tags=["openai"])
-openai_service = OpenAIService(api_key=os.getenv('OPENAI_API_KEY'))
+
+
+def set_analysis_headers(response: Response, result: AnalysisResult) -> None:
+    """Report how the analysis request was prepared"""
+    response.headers["X-Analysis-Cache"] = "HIT" if result.cache_hit else "MISS"
+    if result.image_report is not None:
+        response.headers["X-Image-Bytes-Saved"] = str(result.image_report.bytes_saved)
+        response.headers["X-Image-Tokens-Saved"] = str(result.image_report.tokens_saved)
+    if result.route is not None:
+        response.headers["X-Analysis-Model"] = result.route.model
+        if result.route.reason is not None:
+            response.headers["X-Analysis-Escalation"] = result.route.reason
+    if result.novelty is not None:
+        response.headers["X-Novelty-Score"] = str(result.novelty.score)
+        response.headers["X-Novelty-Skipped"] = "true" if result.novelty.skipped else "false"
+
 
 @router.post("/chat/stream")
-async def stream_chat(request: ChatRequest):
+async def stream_chat(
+    request: ChatRequest,
+    openai_service: OpenAIService = Depends(get_openai_service)
+):
     """Stream chat completion responses"""
     return StreamingResponse(
         openai_service.stream_chat_completion(request),
@@ -20,6 +35,46 @@ async def stream_chat(request: ChatRequest):
     )
 
 @router.post("/analyze/screenshot")
-async def analyze_screenshot(request: ScreenshotAnalysis):
+async def analyze_screenshot(
+    request: ScreenshotAnalysis,
+    response: Response,
+    openai_service: OpenAIService = Depends(get_openai_service)
+):
     """Analyze screenshot with structured output"""
-    return await openai_service.analyze_screenshot(request)
\ No newline at end of file
+    result = await openai_service.analyze(request)
+    set_analysis_headers(response, result)
+    return result.output
+
+@router.post("/analyze/screenshot/stream")
+async def stream_screenshot_analysis(
+    request: ScreenshotAnalysis,
+    openai_service: OpenAIService = Depends(get_openai_service)
+):
+    """Analyze screenshot, streaming navigation fields as soon as they are decided"""
+    async def events():
+        async for event in openai_service.stream_analysis(request):
+            yield event.to_sse()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/cache/stats")
+async def get_analysis_cache_stats(
+    openai_service: OpenAIService = Depends(get_openai_service)
+):
+    """Hit rate of the screenshot analysis cache"""
+    if openai_service.analysis_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **openai_service.analysis_cache.stats()}
+
+@router.get("/analyze/cascade/stats")
+async def get_cascade_stats(
+    openai_service: OpenAIService = Depends(get_openai_service)
+):
+    """Routing decisions and per-tier latency, tokens and cost of the model cascade"""
+    if openai_service.cascade is None:
+        return {"enabled": False}
+    return {"enabled": True, **openai_service.cascade.stats()}
@@ -0,0 +1,115 @@
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Response
+from models.openai import ScreenshotAnalysis, AnalysisResult
+from models.session import SessionCreate, SessionAppend, SessionAnalysisRequest
+from dependencies import get_openai_service, get_session_store, get_novelty_tracker
+from routes.openai import set_analysis_headers
+from services.openai import OpenAIService
+from services.model_cascade import validation_error
+from services.image_processing import decode_data_url
+from services.novelty import NoveltyTracker
+from services.prompt_context import NoteDeduplicator
+from services.session_store import SessionStore
+
+
+router = APIRouter(prefix="/sessions", tags=["sessions"])
+
+@router.post("")
+async def create_session(
+    request: SessionCreate,
+    store: SessionStore = Depends(get_session_store)
+):
+    """Create an exploration session that holds the timeline and notes server-side"""
+    return await store.create(request.goal)
+
+@router.get("/{session_id}")
+async def get_session(
+    session_id: str,
+    store: SessionStore = Depends(get_session_store)
+):
+    """Get a session with its full timeline and notes"""
+    session = await store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+@router.post("/{session_id}/append")
+async def append_to_session(
+    session_id: str,
+    request: SessionAppend,
+    store: SessionStore = Depends(get_session_store)
+):
+    """Append timeline entries and notes to a session"""
+    session = await store.append(session_id, request.timeline, request.important_notes)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session
+
+@router.delete("/{session_id}")
+async def delete_session(
+    session_id: str,
+    store: SessionStore = Depends(get_session_store),
+    novelty: Optional[NoveltyTracker] = Depends(get_novelty_tracker)
+):
+    """Delete a session"""
+    if not await store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    if novelty is not None:
+        novelty.forget(session_id)
+    return {"id": session_id, "deleted": True}
+
+@router.post("/{session_id}/analyze")
+async def analyze_in_session(
+    session_id: str,
+    request: SessionAnalysisRequest,
+    response: Response,
+    store: SessionStore = Depends(get_session_store),
+    openai_service: OpenAIService = Depends(get_openai_service),
+    novelty: Optional[NoveltyTracker] = Depends(get_novelty_tracker)
+):
+    """
+    Analyze a view using the session's stored history
+
+    Only the new action and images are sent; new notes returned by the model
+    are merged into the session. A single-image view that is a near-duplicate
+    of one already analyzed in the session gets that earlier analysis back
+    without a model call (reported in the X-Novelty-* headers), provided that
+    analysis is still valid for this view's panoramas and timeline.
+    """
+    if request.action is not None:
+        session = await store.append(session_id, [request.action], [])
+    else:
+        session = await store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    analysis = ScreenshotAnalysis(
+        goal=session.goal,
+        timeline=session.timeline,
+        important_notes=session.important_notes,
+        **request.model_dump(exclude={"action", "novelty_threshold"})
+    )
+    report, signature = None, None
+    raw = decode_data_url(request.images[0]) if len(request.images) == 1 else None
+    if novelty is not None and raw is not None and request.novelty_threshold != 0:
+        report, signature, merged = await novelty.assess(
+            session_id, raw, request.novelty_threshold,
+            usable=lambda output: validation_error(output, analysis) is None
+        )
+        if report.skipped:
+            set_analysis_headers(response, AnalysisResult(output=merged, novelty=report))
+            return merged
+
+    result = await openai_service.analyze(analysis)
+    if novelty is not None:
+        novelty.record(session_id, signature, result.output)
+        result.novelty = report
+
+    notes = NoteDeduplicator(openai_service.context_builder.note_similarity)
+    notes.extend(session.important_notes)
+    new_notes = notes.extend(result.output.important_notes)
+    if new_notes:
+        await store.append(session_id, [], new_notes)
+
+    set_analysis_headers(response, result)
+    return result.output
@@ -1,69 +1,324 @@
 # In your routes/street_view.py
-from fastapi import APIRouter, HTTPException
-from services.street_view import GoogleStreetViewService
-from fastapi.responses import Response
-from models.street_view import AddressRequest
-import os
-from dotenv import load_dotenv
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from services.street_view import GoogleStreetViewService, ImageStream
+from services.mosaic import MosaicComposer, mosaic_headings
+from services.transcode import ImageTranscoder
+from services.upstream import UpstreamError, error_detail
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+from models.street_view import AddressRequest, BatchViewRequest, ImageVariant, StreetViewResponse
+from dependencies import get_street_view_service, get_mosaic_composer, get_image_transcoder
 from typing import Optional
+import base64
+import json
+import logging
 
+logger = logging.getLogger(__name__)
 
-load_dotenv()
 router = APIRouter(prefix="/streetview", tags=["streetview"])
-street_view = GoogleStreetViewService(
-    api_key=os.getenv('GOOGLE_API_KEY')
-)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [c.strip().removeprefix("W/") for c in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+async def _image_response(request: Request, stream: ImageStream, vary: bool = False) -> Response:
+    """
+    Proxy an image stream; sizes and validators are passed through when known
+
+    ETags are only known up front for cache hits, so a miss is served without
+    one and the next request (from the cache) carries it.
+    """
+    headers = {"X-Cache": "HIT" if stream.cache_hit else "MISS"}
+    if vary:
+        headers["Vary"] = "Accept"
+    if stream.content_length is not None:
+        headers["Content-Length"] = str(stream.content_length)
+    if stream.status_code == 200 and stream.etag:
+        etag = f'"{stream.etag}"'
+        headers["ETag"] = etag
+        headers["Cache-Control"] = f"public, max-age={request.app.state.settings.image_cache_max_age}"
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            await stream.aclose()
+            del headers["Content-Length"]
+            return Response(status_code=304, headers=headers)
+    return StreamingResponse(
+        stream.chunks,
+        media_type=stream.content_type,
+        status_code=stream.status_code,
+        headers=headers,
+        background=BackgroundTask(stream.aclose)
+    )
+
+async def _variant_response(
+    request: Request,
+    source: StreetViewResponse,
+    variant: ImageVariant,
+    transcoder: ImageTranscoder
+) -> Response:
+    """Serve a negotiated encoding of an image, produced from the fetched (or cached) original"""
+    if source.status_code != 200 or not source.content_type.startswith("image/"):
+        return Response(content=source.content, media_type=source.content_type, status_code=source.status_code)
+    image = await transcoder.variant(source, variant)
+    etag = f'"{image.etag}"'
+    headers = {
+        "X-Cache": "HIT" if image.cache_hit else "MISS",
+        "X-Image-Variant": f"{variant.format};width={variant.width or 'original'};quality={variant.quality}",
+        "Vary": "Accept",
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={request.app.state.settings.image_cache_max_age}"
+    }
+    if _etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=image.content, media_type=image.content_type, headers=headers)
 
 @router.get("/by-coordinates/{lat}/{lng}")
 async def get_street_view_by_coordinates(
+    request: Request,
     lat: float,
     lng: float,
     size: str = "640x640",
     heading: Optional[float] = None,
     pitch: Optional[float] = None,
-    fov: Optional[float] = None
+    fov: Optional[float] = None,
+    width: Optional[int] = Query(None, ge=16, le=640),
+    quality: Optional[int] = Query(None, ge=1, le=100),
+    street_view: GoogleStreetViewService = Depends(get_street_view_service),
+    transcoder: Optional[ImageTranscoder] = Depends(get_image_transcoder)
 ):
     """Get Street View image using latitude and longitude coordinates"""
     try:
-        result = await street_view.get_image_by_location(
+        variant = transcoder.negotiate(request.headers.get("accept"), width, quality) if transcoder else None
+        if variant is not None:
+            source = await street_view.get_image_by_location(
+                location=(lat, lng),
+                size=size,
+                heading=heading,
+                pitch=pitch,
+                fov=fov
+            )
+            return await _variant_response(request, source, variant, transcoder)
+        stream = await street_view.stream_image_by_location(
             location=(lat, lng),
             size=size,
             heading=heading,
             pitch=pitch,
             fov=fov
         )
-        return Response(
-            content=result.content,
-            media_type=result.content_type,
-            status_code=result.status_code
-        )
+        return await _image_response(request, stream, vary=transcoder is not None)
+    except UpstreamError:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise HTTPException(status_code=400, detail=error_detail(e))
 
 @router.post("/by-address")
-async def get_street_view_by_address(request: AddressRequest):
+async def get_street_view_by_address(
+    request: AddressRequest,
+    http_request: Request,
+    street_view: GoogleStreetViewService = Depends(get_street_view_service),
+    transcoder: Optional[ImageTranscoder] = Depends(get_image_transcoder)
+):
     """Get Street View image using a street address"""
     try:
-        result = await street_view.get_image_by_location(
+        variant = None
+        if transcoder is not None:
+            variant = transcoder.negotiate(http_request.headers.get("accept"), request.width, request.quality)
+        if variant is not None:
+            source = await street_view.get_image_by_location(
+                location=request.address,
+                size=request.size,
+                heading=request.heading,
+                pitch=request.pitch,
+                fov=request.fov
+            )
+            return await _variant_response(http_request, source, variant, transcoder)
+        stream = await street_view.stream_image_by_location(
             location=request.address,
             size=request.size,
             heading=request.heading,
             pitch=request.pitch,
             fov=request.fov
         )
-        return Response(
-            content=result.content,
-            media_type=result.content_type,
-            status_code=result.status_code
+        return await _image_response(http_request, stream, vary=transcoder is not None)
+    except UpstreamError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=error_detail(e))
+
+@router.get("/by-pano/{pano_id}")
+async def get_street_view_by_pano(
+    request: Request,
+    pano_id: str,
+    size: str = "640x640",
+    heading: Optional[float] = None,
+    pitch: Optional[float] = None,
+    fov: Optional[float] = None,
+    width: Optional[int] = Query(None, ge=16, le=640),
+    quality: Optional[int] = Query(None, ge=1, le=100),
+    street_view: GoogleStreetViewService = Depends(get_street_view_service),
+    transcoder: Optional[ImageTranscoder] = Depends(get_image_transcoder)
+):
+    """Get Street View image for a specific panorama ID"""
+    try:
+        variant = transcoder.negotiate(request.headers.get("accept"), width, quality) if transcoder else None
+        if variant is not None:
+            source = await street_view.get_image_by_pano(
+                pano_id=pano_id,
+                size=size,
+                heading=heading,
+                pitch=pitch,
+                fov=fov
+            )
+            return await _variant_response(request, source, variant, transcoder)
+        stream = await street_view.stream_image_by_pano(
+            pano_id=pano_id,
+            size=size,
+            heading=heading,
+            pitch=pitch,
+            fov=fov
+        )
+        return await _image_response(request, stream, vary=transcoder is not None)
+    except UpstreamError:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=error_detail(e))
+
+@router.get("/mosaic/{pano_id}")
+async def get_street_view_mosaic(
+    pano_id: str,
+    views: int = Query(4, ge=1, le=12),
+    heading: float = 0.0,
+    columns: Optional[int] = Query(None, ge=1),
+    tile_size: str = "320x320",
+    pitch: float = 0.0,
+    fov: Optional[float] = None,
+    label: bool = True,
+    mosaic: MosaicComposer = Depends(get_mosaic_composer)
+):
+    """Get several evenly spaced headings of a panorama tiled into one labelled image"""
+    try:
+        result = await mosaic.compose(
+            pano_id=pano_id,
+            headings=mosaic_headings(heading, views),
+            tile_size=tile_size,
+            columns=columns,
+            pitch=pitch,
+            fov=fov,
+            label=label
         )
+    except UpstreamError:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise HTTPException(status_code=400, detail=error_detail(e))
+    return Response(
+        content=result.content,
+        media_type=result.content_type,
+        headers={
+            "X-Mosaic-Headings": ",".join(f"{h:g}" for h in result.headings),
+            "X-Mosaic-Grid": f"{result.rows}x{result.columns}"
+        }
+    )
+
+@router.post("/batch")
+async def get_street_view_batch(
+    request: BatchViewRequest,
+    http_request: Request,
+    street_view: GoogleStreetViewService = Depends(get_street_view_service)
+):
+    """
+    Fetch several views concurrently and stream them back as NDJSON
+
+    Each line is emitted as soon as its image is ready, so results arrive in
+    completion order; use `index` to match them to the requested views.
+    """
+    settings = http_request.app.state.settings
+    if len(request.views) > settings.batch_max_views:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.batch_max_views} views can be requested per batch"
+        )
+    concurrency = min(request.concurrency or settings.batch_concurrency, settings.batch_concurrency)
+
+    async def results():
+        async for index, result in street_view.iter_views(request.views, concurrency):
+            if isinstance(result, Exception):
+                line = {"index": index, "error": error_detail(result)}
+                if isinstance(result, UpstreamError):
+                    line["status_code"] = result.status_code
+            else:
+                line = {
+                    "index": index,
+                    "status_code": result.status_code,
+                    "content_type": result.content_type,
+                    "etag": result.etag,
+                    "cache_hit": result.cache_hit,
+                    "data": base64.b64encode(result.content).decode("ascii")
+                }
+            yield json.dumps(line) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+@router.get("/cache/stats")
+async def get_image_cache_stats(
+    street_view: GoogleStreetViewService = Depends(get_street_view_service),
+    transcoder: Optional[ImageTranscoder] = Depends(get_image_transcoder)
+):
+    """Hit/miss counts and sizes of the image and metadata caches, the panorama graph, the spatial index and transcoding"""
+    images = {"enabled": False}
+    if street_view.image_cache is not None:
+        images = {"enabled": True, **street_view.image_cache.stats()}
+    metadata = {"enabled": False}
+    if street_view.metadata_cache is not None:
+        metadata = {"enabled": True, **street_view.metadata_cache.stats()}
+    metadata["coalesced"] = street_view.metadata_flight.coalesced
+    graph = {"enabled": False}
+    if street_view.graph is not None:
+        graph = {"enabled": True, **street_view.graph.stats()}
+    index = {"enabled": False}
+    if street_view.spatial_index is not None:
+        index = {"enabled": True, **street_view.spatial_index.stats()}
+    shared = {"enabled": False}
+    if street_view.shared is not None:
+        shared = {"enabled": True, **street_view.shared.stats()}
+    transcode = {"enabled": False}
+    if transcoder is not None:
+        transcode = {"enabled": True, **transcoder.stats()}
+    return {"images": images, "metadata": metadata, "graph": graph, "index": index, "shared": shared, "transcode": transcode}
+
+@router.get("/nearest")
+async def get_nearest_panoramas(
+    lat: float,
+    lng: float,
+    k: int = Query(5, ge=1, le=100),
+    radius: Optional[float] = Query(None, gt=0),
+    street_view: GoogleStreetViewService = Depends(get_street_view_service)
+):
+    """
+    Nearest panoramas already seen by this server, answered from the local spatial index
+
+    Returns up to k panoramas, nearest first; with a radius, only those within
+    that many meters. Nothing is fetched from Google.
+    """
+    if street_view.spatial_index is None:
+        raise HTTPException(status_code=404, detail="The spatial index is disabled")
+    matches = street_view.spatial_index.nearest(lat, lng, k=k, radius=radius)
+    return {
+        "panoramas": [
+            {**match.panorama.model_dump(), "distance": match.distance}
+            for match in matches
+        ],
+        "indexed": len(street_view.spatial_index)
+    }
 
 @router.get("/metadata")
 async def get_street_view_metadata(
     address: Optional[str] = None,
     lat: Optional[float] = None,
-    lng: Optional[float] = None
+    lng: Optional[float] = None,
+    street_view: GoogleStreetViewService = Depends(get_street_view_service)
 ):
     """Get enhanced metadata about Street View availability for a location"""
     try:
@@ -89,7 +344,7 @@ async def get_street_view_metadata(
                 formatted_date = date_obj.strftime("%B %Y")
                 metadata.date = formatted_date
             except Exception as e:
-                print(f"Error formatting date: {e}")
+                logger.warning(f"Error formatting date: {e}")
                 # Keep original date format if parsing fails
                 pass
                 
@@ -101,11 +356,13 @@ async def get_street_view_metadata(
                 static_url = street_view.build_static_url(location=location_str)
                 metadata.description = location_str  # Fallback
             except Exception as e:
-                print(f"Error getting location description: {e}")
+                logger.warning(f"Error getting location description: {e}")
                 
         return metadata
+    except UpstreamError:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
+        raise HTTPException(status_code=400, detail=error_detail(e))
 
 @router.get("/static-url")
 async def get_static_url(
@@ -115,7 +372,8 @@ async def get_static_url(
     size: str = "640x640",
     heading: Optional[float] = None,
     pitch: Optional[float] = None,
-    zoom: Optional[float] = None  # Changed from fov to zoom
+    zoom: Optional[float] = None,  # Changed from fov to zoom
+    street_view: GoogleStreetViewService = Depends(get_street_view_service)
 ):
     """
     Get a static URL that can be used in <img> tags
@@ -145,5 +403,7 @@ async def get_static_url(
             fov=fov
         )
         return {"url": url}
+    except UpstreamError:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=400, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=400, detail=error_detail(e))
\ No newline at end of file
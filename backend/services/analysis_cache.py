@@ -0,0 +1,156 @@
+# services/analysis_cache.py
+from typing import Optional, List, Dict, Any, Union
+import asyncio
+import hashlib
+import io
+import time
+import numpy as np
+from PIL import Image
+from models.openai import ScreenshotAnalysis, AnalysisOutput
+from services.cache import TTLCache
+from services.image_processing import decode_data_url
+
+HASH_SIZE = 8
+HASH_SAMPLE = 32
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT = _dct_matrix(HASH_SAMPLE)
+
+
+def perceptual_hash(raw: bytes) -> int:
+    """64-bit DCT perceptual hash: low-frequency coefficients compared to their median"""
+    with Image.open(io.BytesIO(raw)) as image:
+        pixels = np.asarray(
+            image.convert("L").resize((HASH_SAMPLE, HASH_SAMPLE), Image.LANCZOS),
+            dtype=np.float64
+        )
+    coefficients = (_DCT @ pixels @ _DCT.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+    bits = coefficients > np.median(coefficients[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+ImageSignature = Union[int, str]
+
+
+def image_signature(url: str) -> ImageSignature:
+    """Perceptual hash for inline images; remote URLs can only match exactly"""
+    raw = decode_data_url(url)
+    if raw is not None:
+        try:
+            return perceptual_hash(raw)
+        except Exception:
+            return hashlib.sha256(raw).hexdigest()
+    return url
+
+
+class AnalysisCache:
+    def __init__(
+        self,
+        max_entries: int = 5000,
+        ttl: float = 3600.0,
+        max_distance: int = 6,
+        bucket_size: int = 16
+    ):
+        """
+        Reuse analysis results for perceptually similar views
+
+        Entries are bucketed by the normalized goal and the decision-relevant state
+        (model, zoom, unvisited candidate panoramas); within a bucket images match
+        when every perceptual hash is within max_distance bits.
+
+        Args:
+            max_entries: Buckets kept before the least recently used is dropped
+            ttl: Seconds a cached analysis stays valid
+            max_distance: Hamming distance threshold for near-duplicate images (0 = exact)
+            bucket_size: Analyses kept per bucket
+        """
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.bucket_size = bucket_size
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self._buckets: TTLCache[List[Dict[str, Any]]] = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    @staticmethod
+    def state_key(request: ScreenshotAnalysis) -> str:
+        visited = {t.panorama for t in request.timeline}
+        candidates = sorted(p.pano for p in request.panoramas if p.pano not in visited)
+        state = {
+            "goal": " ".join(request.goal.lower().split()),
+            "model": request.model,
+            "cascade": request.cascade,
+            "zoom": round(request.zoom, 1),
+            "candidates": candidates,
+            "images": len(request.images),
+            "layout": request.image_description,
+        }
+        return hashlib.sha256(repr(sorted(state.items())).encode()).hexdigest()
+
+    async def signatures(self, request: ScreenshotAnalysis) -> List[ImageSignature]:
+        return await asyncio.gather(*[asyncio.to_thread(image_signature, url) for url in request.images])
+
+    def _matches(self, a: List[ImageSignature], b: List[ImageSignature]) -> Optional[int]:
+        """Total distance between two signature lists, or None if any image differs too much"""
+        total = 0
+        for x, y in zip(a, b):
+            if isinstance(x, int) and isinstance(y, int):
+                distance = hamming(x, y)
+                if distance > self.max_distance:
+                    return None
+                total += distance
+            elif x != y:
+                return None
+        return total
+
+    def lookup(self, key: str, signatures: List[ImageSignature]) -> Optional[AnalysisOutput]:
+        bucket = self._buckets.get(key) or []
+        now = time.monotonic()
+        best = None
+        for entry in bucket:
+            if entry["expires_at"] <= now:
+                continue
+            distance = self._matches(signatures, entry["signatures"])
+            if distance is not None and (best is None or distance < best[0]):
+                best = (distance, entry["output"])
+        if best is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if best[0] > 0:
+            self.near_hits += 1
+        return best[1].model_copy(deep=True)
+
+    def store(self, key: str, signatures: List[ImageSignature], output: Optional[AnalysisOutput]) -> None:
+        # A refusal has no output and must not be replayed to later requests
+        if output is None:
+            return
+        now = time.monotonic()
+        bucket = [entry for entry in (self._buckets.get(key) or []) if entry["expires_at"] > now]
+        bucket.append({"signatures": signatures, "output": output.model_copy(deep=True), "expires_at": now + self.ttl})
+        self._buckets.set(key, bucket[-self.bucket_size:])
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "buckets": len(self._buckets),
+            "max_distance": self.max_distance,
+        }
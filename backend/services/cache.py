@@ -0,0 +1,102 @@
+# services/cache.py
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, Iterable, List, Optional, TypeVar
+import asyncio
+import time
+
+T = TypeVar("T")
+
+
+class TTLCache(Generic[T]):
+    def __init__(self, max_entries: int = 10000, ttl: float = 3600.0):
+        """
+        Bounded in-memory LRU cache whose entries expire after a TTL
+
+        Args:
+            max_entries: Entries kept before the least recently used is dropped
+            ttl: Default time-to-live in seconds
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple[float, T]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[T]:
+        item = self._entries.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, value = item
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: T, ttl: Optional[float] = None) -> None:
+        self._entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def dump(self) -> List[tuple[Hashable, float, T]]:
+        """Live entries as (key, seconds left, value), least recently used first"""
+        now = time.monotonic()
+        return [(key, expires_at - now, value) for key, (expires_at, value) in self._entries.items() if expires_at > now]
+
+    def restore(self, entries: Iterable[tuple[Hashable, float, T]]) -> int:
+        """Load entries from `dump` (keeping their order and remaining TTL); returns how many were live"""
+        restored = 0
+        for key, ttl, value in entries:
+            if ttl > 0:
+                self.set(key, value, ttl=ttl)
+                restored += 1
+        return restored
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+        }
+
+
+class SingleFlight:
+    def __init__(self):
+        """Coalesce concurrent calls for the same key into one in-flight task"""
+        self.coalesced = 0
+        self._inflight: Dict[Hashable, "asyncio.Task[Any]"] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run fn once per key at a time; concurrent callers await the same result
+
+        The shared task is shielded so a cancelled caller doesn't cancel the
+        work other callers are waiting on.
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def __len__(self) -> int:
+        return len(self._inflight)
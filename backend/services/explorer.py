@@ -0,0 +1,654 @@
+# services/explorer.py
+from typing import AsyncGenerator, Dict, List, Optional
+from datetime import datetime, timezone
+import asyncio
+import base64
+import logging
+import time
+import uuid
+from models.exploration import ExplorationRequest, ExplorationEvent, TeamExplorationRequest
+from models.openai import ScreenshotAnalysis, ActionTimeline, ConnectedPanorama, AnalysisOutput, NoveltyReport
+from models.street_view import PanoramaLink
+from services.street_view import GoogleStreetViewService
+from services.openai import OpenAIService
+from services.geo import bearing_deg, heading_delta, zoom_to_fov
+from services.prompt_context import NoteDeduplicator
+from services.metrics import trace, span
+from services.prefetch import Prefetcher
+from services.mosaic import MosaicComposer, mosaic_headings, mosaic_fov, describe_mosaic
+from services.novelty import NoveltyTracker
+
+logger = logging.getLogger(__name__)
+
+
+class TeamState:
+    def __init__(self, max_steps: int, note_similarity: float):
+        """Progress shared by the agents of a team exploration"""
+        self.max_steps = max_steps
+        self.steps = 0
+        self.visited: set[str] = set()
+        self.notes = NoteDeduplicator(note_similarity)
+        self.responses: Dict[int, str] = {}
+        self.reasons: Dict[int, str] = {}
+        self.agent_steps: Dict[int, int] = {}
+        self.skipped = 0
+        self.completed_by: Optional[int] = None
+
+    def claim_step(self) -> Optional[int]:
+        """Reserve a step from the shared budget, returning its number (None once spent)"""
+        if self.steps >= self.max_steps:
+            return None
+        self.steps += 1
+        return self.steps - 1
+
+
+def merge_goal_responses(
+    responses: Dict[int, str],
+    completed_by: Optional[int] = None,
+    threshold: float = 0.7
+) -> str:
+    """
+    Combine the agents' final answers into one, dropping near-duplicates
+
+    The agent that completed the goal (if any) leads; the rest follow in agent order.
+    """
+    order = sorted(responses, key=lambda agent: (agent != completed_by, agent))
+    merged = NoteDeduplicator(threshold)
+    merged.extend([responses[agent] for agent in order])
+    return "\n".join(merged.notes)
+
+
+class ExplorationService:
+    def __init__(
+        self,
+        street_view: GoogleStreetViewService,
+        openai: OpenAIService,
+        prefetcher: Optional[Prefetcher] = None,
+        mosaic: Optional[MosaicComposer] = None,
+        novelty: Optional[NoveltyTracker] = None,
+        max_agents: int = 8
+    ):
+        """
+        Run the analyze -> navigate loop server-side
+
+        Args:
+            street_view: Service used for panorama metadata, links and images
+            openai: Service used to analyze each view
+            prefetcher: Optional prefetcher warming likely next panoramas during analysis
+            mosaic: Composer used when a request asks for multi-heading mosaics
+            novelty: Optional filter that skips views too similar to ones already analyzed
+            max_agents: Upper bound on concurrent agents in a team exploration
+        """
+        self.street_view = street_view
+        self.openai = openai
+        self.prefetcher = prefetcher
+        self.mosaic = mosaic
+        self.novelty = novelty
+        self.max_agents = max_agents
+        self._runs: Dict[str, asyncio.Event] = {}
+
+    def cancel(self, run_id: str) -> bool:
+        """Stop a running exploration, abandoning its in-flight step"""
+        cancelled = self._runs.get(run_id)
+        if cancelled is None:
+            return False
+        cancelled.set()
+        return True
+
+    @property
+    def active_runs(self) -> List[str]:
+        return list(self._runs)
+
+    async def run(self, request: ExplorationRequest) -> AsyncGenerator[ExplorationEvent, None]:
+        """
+        Explore toward a goal, yielding an event per step
+
+        Stops when the model answers 'complete', the step or time budget runs out,
+        there is nowhere left to go, or the run is cancelled.
+        """
+        run_id = uuid.uuid4().hex
+        cancelled = asyncio.Event()
+        self._runs[run_id] = cancelled
+        deadline = time.monotonic() + request.max_seconds
+        timeline: List[ActionTimeline] = []
+        notes = NoteDeduplicator(self.openai.context_builder.note_similarity)
+        visited: set[str] = set()
+        last_output: Optional[AnalysisOutput] = None
+        skipped = 0
+        reason = "max_steps"
+
+        try:
+            location = (request.latitude, request.longitude) if request.pano_id is None else None
+            metadata = await self.street_view.get_metadata(location=location, pano_id=request.pano_id)
+            if metadata.status != "OK" or not metadata.pano_id or not metadata.location:
+                yield ExplorationEvent(event="error", run_id=run_id, data={"detail": f"No Street View imagery at start ({metadata.status})"})
+                return
+
+            pano = metadata.pano_id
+            lat, lng = metadata.location["lat"], metadata.location["lng"]
+            heading, pitch, zoom = request.heading, request.pitch, request.zoom
+            yield ExplorationEvent(event="start", run_id=run_id, data={"pano": pano, "latitude": lat, "longitude": lng})
+
+            for step in range(request.max_steps):
+                if cancelled.is_set():
+                    reason = "cancelled"
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    reason = "time_budget"
+                    break
+
+                visited.add(pano)
+                started = time.monotonic()
+                step_task = asyncio.ensure_future(
+                    self._step(request, run_id, pano, lat, lng, heading, pitch, zoom, timeline, notes.notes, visited)
+                )
+                cancel_task = asyncio.ensure_future(cancelled.wait())
+                try:
+                    await asyncio.wait(
+                        {step_task, cancel_task},
+                        timeout=remaining,
+                        return_when=asyncio.FIRST_COMPLETED
+                    )
+                finally:
+                    cancel_task.cancel()
+                    if not step_task.done():
+                        step_task.cancel()
+                if not step_task.done() or step_task.cancelled():
+                    reason = "cancelled" if cancelled.is_set() else "time_budget"
+                    break
+                links, output, timings, novelty = step_task.result()
+
+                if output is None:
+                    # Near-duplicate of a view already analyzed: move on without a model call
+                    skipped += 1
+                    yield ExplorationEvent(
+                        event="step",
+                        run_id=run_id,
+                        step=step,
+                        data={
+                            "pano": pano,
+                            "latitude": lat,
+                            "longitude": lng,
+                            "heading": heading,
+                            "pitch": pitch,
+                            "zoom": zoom,
+                            "elapsed": round(time.monotonic() - started, 3),
+                            "analysis": None,
+                            "skipped": True,
+                            "novelty": novelty.model_dump(),
+                            **({"timings": timings} if request.trace else {})
+                        }
+                    )
+                    target = self._choose_panorama(None, links, visited, heading)
+                    if target is None:
+                        reason = "dead_end"
+                        break
+                    if self.prefetcher is not None:
+                        self.prefetcher.record_move(run_id, target.pano)
+                    pano = target.pano
+                    lat, lng = target.location["lat"], target.location["lng"]
+                    heading, pitch, zoom = target.heading % 360, 0.0, 1.0
+                    continue
+
+                last_output = output
+                notes.extend(output.important_notes)
+                timeline.append(ActionTimeline(
+                    action=output.next_action,
+                    panorama=pano,
+                    heading=heading,
+                    pitch=pitch,
+                    zoom=zoom,
+                    timestamp=datetime.now(timezone.utc).isoformat()
+                ))
+                yield ExplorationEvent(
+                    event="step",
+                    run_id=run_id,
+                    step=step,
+                    data={
+                        "pano": pano,
+                        "latitude": lat,
+                        "longitude": lng,
+                        "heading": heading,
+                        "pitch": pitch,
+                        "zoom": zoom,
+                        "elapsed": round(time.monotonic() - started, 3),
+                        "analysis": output.model_dump(),
+                        **({"novelty": novelty.model_dump()} if novelty else {}),
+                        **({"timings": timings} if request.trace else {})
+                    }
+                )
+
+                if output.next_action == "complete":
+                    reason = "complete"
+                    break
+                if output.next_action == "new_view":
+                    heading = output.next_heading % 360
+                    pitch = output.next_pitch
+                    zoom = output.next_zoom or zoom
+                    continue
+
+                target = self._choose_panorama(output, links, visited, heading)
+                if target is None:
+                    reason = "dead_end"
+                    break
+                if self.prefetcher is not None:
+                    self.prefetcher.record_move(run_id, target.pano)
+                pano = target.pano
+                lat, lng = target.location["lat"], target.location["lng"]
+                heading = (output.next_heading if output.next_panorama == target.pano else target.heading) % 360
+                pitch, zoom = 0.0, 1.0
+
+            yield ExplorationEvent(
+                event="complete",
+                run_id=run_id,
+                data={
+                    "reason": reason,
+                    "steps": len(timeline) + skipped,
+                    "skipped": skipped,
+                    "visited": sorted(visited),
+                    "important_notes": notes.notes,
+                    "goal_response": last_output.goal_response if last_output else ""
+                }
+            )
+        except Exception as e:
+            logger.error(f"Exploration {run_id} failed: {e}")
+            yield ExplorationEvent(event="error", run_id=run_id, data={"detail": str(getattr(e, "detail", e))})
+        finally:
+            self._runs.pop(run_id, None)
+            if self.prefetcher is not None:
+                self.prefetcher.cancel(run_id)
+            if self.novelty is not None:
+                self.novelty.forget(run_id)
+
+    async def run_team(self, request: TeamExplorationRequest) -> AsyncGenerator[ExplorationEvent, None]:
+        """
+        Explore toward a goal with several agents at once, yielding their events as they happen
+
+        Agents start on different panoramas spread around the start and share
+        one visited set (so no panorama is analyzed by two agents), one
+        deduplicated notes store, and the step and time budgets. The run stops
+        when any agent answers 'complete', the budgets run out, every agent is
+        stuck, or it is cancelled; the final event carries a merged goal response.
+        """
+        run_id = uuid.uuid4().hex
+        cancelled = asyncio.Event()
+        self._runs[run_id] = cancelled
+        deadline = time.monotonic() + request.max_seconds
+        state = TeamState(request.max_steps, self.openai.context_builder.note_similarity)
+        events: asyncio.Queue[Optional[ExplorationEvent]] = asyncio.Queue()
+        agents: List[asyncio.Task] = []
+        watcher = asyncio.ensure_future(cancelled.wait())
+        reason = "dead_end"
+
+        try:
+            location = (request.latitude, request.longitude) if request.pano_id is None else None
+            metadata = await self.street_view.get_metadata(location=location, pano_id=request.pano_id)
+            if metadata.status != "OK" or not metadata.pano_id or not metadata.location:
+                yield ExplorationEvent(event="error", run_id=run_id, data={"detail": f"No Street View imagery at start ({metadata.status})"})
+                return
+
+            seeds = await self._seed_agents(
+                metadata.pano_id,
+                metadata.location,
+                request.heading,
+                min(request.agents, self.max_agents)
+            )
+            state.visited.update(seed.pano for seed in seeds)
+            yield ExplorationEvent(
+                event="start",
+                run_id=run_id,
+                data={
+                    "pano": metadata.pano_id,
+                    "latitude": metadata.location["lat"],
+                    "longitude": metadata.location["lng"],
+                    "agents": [
+                        {"agent": agent, "pano": seed.pano, "heading": seed.heading}
+                        for agent, seed in enumerate(seeds)
+                    ]
+                }
+            )
+            agents = [
+                asyncio.ensure_future(self._run_agent(request, run_id, agent, seed, state, events))
+                for agent, seed in enumerate(seeds)
+            ]
+
+            active = len(agents)
+            while active:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    reason = "time_budget"
+                    break
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait({getter, watcher}, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+                if not getter.done():
+                    getter.cancel()
+                    reason = "cancelled" if cancelled.is_set() else "time_budget"
+                    break
+                event = getter.result()
+                if event is None:
+                    active -= 1
+                    continue
+                yield event
+                if event.event == "step" and (event.data["analysis"] or {}).get("next_action") == "complete":
+                    reason = "complete"
+                    break
+            else:
+                if state.steps >= state.max_steps:
+                    reason = "max_steps"
+
+            yield ExplorationEvent(
+                event="complete",
+                run_id=run_id,
+                data={
+                    "reason": reason,
+                    "steps": state.steps,
+                    "skipped": state.skipped,
+                    "visited": sorted(state.visited),
+                    "important_notes": state.notes.notes,
+                    "goal_response": merge_goal_responses(
+                        state.responses,
+                        state.completed_by,
+                        self.openai.context_builder.note_similarity
+                    ),
+                    "agents": [
+                        {
+                            "agent": agent,
+                            "steps": state.agent_steps.get(agent, 0),
+                            "reason": state.reasons.get(agent, reason),
+                            "goal_response": state.responses.get(agent, "")
+                        }
+                        for agent in range(len(agents))
+                    ]
+                }
+            )
+        except Exception as e:
+            logger.error(f"Team exploration {run_id} failed: {e}")
+            yield ExplorationEvent(event="error", run_id=run_id, data={"detail": str(getattr(e, "detail", e))})
+        finally:
+            watcher.cancel()
+            for task in agents:
+                task.cancel()
+            self._runs.pop(run_id, None)
+            if self.prefetcher is not None:
+                for agent in range(len(agents)):
+                    self.prefetcher.cancel(f"{run_id}:{agent}")
+            if self.novelty is not None:
+                self.novelty.forget(run_id)
+
+    async def _seed_agents(
+        self,
+        pano: str,
+        location: Dict[str, float],
+        heading: float,
+        count: int
+    ) -> List[PanoramaLink]:
+        """
+        Starting panoramas for a team, spread over sectors around the start
+
+        The first agent starts where the request does. The frontier is widened
+        breadth-first (two hops at most) until there are enough panoramas, then
+        each further agent takes the one whose bearing from the start best
+        matches the centre of its sector, facing away from the start.
+        """
+        lat, lng = location["lat"], location["lng"]
+        seeds = [PanoramaLink(pano=pano, heading=heading % 360, distance=0.0, location=location)]
+        if count == 1:
+            return seeds
+        frontier: Dict[str, PanoramaLink] = {}
+        layer = [seeds[0]]
+        for _ in range(2):
+            neighbours = await asyncio.gather(*[
+                self.street_view.find_connected_panoramas(node.pano, node.location["lat"], node.location["lng"])
+                for node in layer
+            ])
+            layer = []
+            for links in neighbours:
+                for link in links:
+                    if link.pano != pano and link.pano not in frontier:
+                        frontier[link.pano] = link
+                        layer.append(link)
+            if len(frontier) >= count - 1 or not layer:
+                break
+
+        for agent in range(1, count):
+            if not frontier:
+                break
+            sector = (heading + agent * 360 / count) % 360
+            bearings = {
+                candidate.pano: bearing_deg(lat, lng, candidate.location["lat"], candidate.location["lng"])
+                for candidate in frontier.values()
+            }
+            best = min(frontier.values(), key=lambda candidate: heading_delta(bearings[candidate.pano], sector))
+            del frontier[best.pano]
+            seeds.append(best.model_copy(update={"heading": round(bearings[best.pano], 2)}))
+        return seeds
+
+    async def _run_agent(
+        self,
+        request: TeamExplorationRequest,
+        run_id: str,
+        agent: int,
+        seed: PanoramaLink,
+        state: TeamState,
+        events: "asyncio.Queue[Optional[ExplorationEvent]]"
+    ) -> None:
+        """One agent's analyze -> navigate loop; ends with a None on the queue"""
+        agent_key = f"{run_id}:{agent}"
+        timeline: List[ActionTimeline] = []
+        pano = seed.pano
+        lat, lng = seed.location["lat"], seed.location["lng"]
+        heading, pitch, zoom = seed.heading, request.pitch, request.zoom
+        reason = "max_steps"
+        try:
+            while True:
+                step = state.claim_step()
+                if step is None:
+                    break
+                started = time.monotonic()
+                links, output, timings, novelty = await self._step(
+                    request, agent_key, pano, lat, lng, heading, pitch, zoom, timeline, state.notes.notes, state.visited,
+                    novelty_key=run_id
+                )
+                state.agent_steps[agent] = state.agent_steps.get(agent, 0) + 1
+                if output is None:
+                    state.skipped += 1
+                    events.put_nowait(ExplorationEvent(
+                        event="step",
+                        run_id=run_id,
+                        step=step,
+                        data={
+                            "agent": agent,
+                            "pano": pano,
+                            "latitude": lat,
+                            "longitude": lng,
+                            "heading": heading,
+                            "pitch": pitch,
+                            "zoom": zoom,
+                            "elapsed": round(time.monotonic() - started, 3),
+                            "analysis": None,
+                            "skipped": True,
+                            "novelty": novelty.model_dump(),
+                            **({"timings": timings} if request.trace else {})
+                        }
+                    ))
+                    target = self._choose_panorama(None, links, state.visited, heading)
+                    if target is None:
+                        reason = "dead_end"
+                        break
+                    state.visited.add(target.pano)
+                    if self.prefetcher is not None:
+                        self.prefetcher.record_move(agent_key, target.pano)
+                    pano = target.pano
+                    lat, lng = target.location["lat"], target.location["lng"]
+                    heading, pitch, zoom = target.heading % 360, 0.0, 1.0
+                    continue
+                state.notes.extend(output.important_notes)
+                state.responses[agent] = output.goal_response
+                timeline.append(ActionTimeline(
+                    action=output.next_action,
+                    panorama=pano,
+                    heading=heading,
+                    pitch=pitch,
+                    zoom=zoom,
+                    timestamp=datetime.now(timezone.utc).isoformat()
+                ))
+                if output.next_action == "complete" and state.completed_by is None:
+                    state.completed_by = agent
+                events.put_nowait(ExplorationEvent(
+                    event="step",
+                    run_id=run_id,
+                    step=step,
+                    data={
+                        "agent": agent,
+                        "pano": pano,
+                        "latitude": lat,
+                        "longitude": lng,
+                        "heading": heading,
+                        "pitch": pitch,
+                        "zoom": zoom,
+                        "elapsed": round(time.monotonic() - started, 3),
+                        "analysis": output.model_dump(),
+                        **({"novelty": novelty.model_dump()} if novelty else {}),
+                        **({"timings": timings} if request.trace else {})
+                    }
+                ))
+
+                if output.next_action == "complete":
+                    reason = "complete"
+                    break
+                if output.next_action == "new_view":
+                    heading = output.next_heading % 360
+                    pitch = output.next_pitch
+                    zoom = output.next_zoom or zoom
+                    continue
+
+                # Claiming the target before moving keeps other agents off it
+                target = self._choose_panorama(output, links, state.visited, heading)
+                if target is None:
+                    reason = "dead_end"
+                    break
+                state.visited.add(target.pano)
+                if self.prefetcher is not None:
+                    self.prefetcher.record_move(agent_key, target.pano)
+                pano = target.pano
+                lat, lng = target.location["lat"], target.location["lng"]
+                heading = (output.next_heading if output.next_panorama == target.pano else target.heading) % 360
+                pitch, zoom = 0.0, 1.0
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            reason = "error"
+            logger.error(f"Agent {agent} of exploration {run_id} failed: {e}")
+            events.put_nowait(ExplorationEvent(
+                event="error",
+                run_id=run_id,
+                data={"agent": agent, "detail": str(getattr(e, "detail", e))}
+            ))
+        finally:
+            state.reasons[agent] = reason
+            if self.prefetcher is not None:
+                self.prefetcher.cancel(agent_key)
+        events.put_nowait(None)
+
+    async def _step(
+        self,
+        request: ExplorationRequest,
+        run_id: str,
+        pano: str,
+        lat: float,
+        lng: float,
+        heading: float,
+        pitch: float,
+        zoom: float,
+        timeline: List[ActionTimeline],
+        notes: List[str],
+        visited: set[str],
+        novelty_key: Optional[str] = None
+    ) -> tuple[List[PanoramaLink], Optional[AnalysisOutput], Dict[str, float], Optional[NoveltyReport]]:
+        """
+        Fetch the current view and its links concurrently, then analyze it (with timing spans)
+
+        The likely next panoramas are prefetched while the analysis runs. With
+        `mosaic_views` set, the model sees every direction in one labelled image,
+        so it can pick a panorama without spending steps turning around. When
+        the view is too similar to one this run already analyzed, the analysis
+        is skipped and the output is None.
+        """
+        novelty_key = novelty_key or run_id
+        use_mosaic = request.mosaic_views is not None and self.mosaic is not None
+        with trace() as step_trace:
+            with span("fetch"):
+                if use_mosaic:
+                    view = self.mosaic.compose(
+                        pano_id=pano,
+                        headings=mosaic_headings(heading, request.mosaic_views),
+                        tile_size=request.mosaic_tile_size,
+                        pitch=pitch
+                    )
+                else:
+                    view = self.street_view.get_image_by_pano(
+                        pano_id=pano,
+                        size=request.image_size,
+                        heading=heading,
+                        pitch=pitch,
+                        fov=zoom_to_fov(zoom)
+                    )
+                image, links = await asyncio.gather(
+                    view,
+                    self.street_view.find_connected_panoramas(pano, lat, lng)
+                )
+            if self.prefetcher is not None:
+                # Moving resets the view to pitch 0 / zoom 1 facing along the link
+                if use_mosaic:
+                    self.prefetcher.schedule(
+                        run_id, links, heading, visited, request.mosaic_tile_size,
+                        mosaic_fov(request.mosaic_views), views=request.mosaic_views
+                    )
+                else:
+                    self.prefetcher.schedule(run_id, links, heading, visited, request.image_size, zoom_to_fov(1.0))
+            report, signature = None, None
+            if self.novelty is not None and request.novelty_threshold != 0:
+                with span("novelty"):
+                    report, signature, _ = await self.novelty.assess(
+                        novelty_key, image.content, request.novelty_threshold
+                    )
+                if report.skipped:
+                    return links, None, step_trace.summary(), report
+            data_url = f"data:{image.content_type};base64,{base64.b64encode(image.content).decode('ascii')}"
+            with span("analyze"):
+                output = await self.openai.analyze_screenshot(ScreenshotAnalysis(
+                    goal=request.goal,
+                    latitude=lat,
+                    longitude=lng,
+                    heading=heading,
+                    pitch=pitch,
+                    zoom=zoom,
+                    images=[data_url],
+                    image_description=describe_mosaic(image) if use_mosaic else None,
+                    timeline=timeline,
+                    important_notes=notes,
+                    panoramas=[ConnectedPanorama(pano=link.pano, heading=link.heading) for link in links],
+                    temperature=request.temperature,
+                    model=request.model,
+                    max_tokens=request.max_tokens
+                ))
+            if self.novelty is not None:
+                self.novelty.record(novelty_key, signature, output)
+        return links, output, step_trace.summary(), report
+
+    def _choose_panorama(
+        self,
+        output: Optional[AnalysisOutput],
+        links: List[PanoramaLink],
+        visited: set[str],
+        heading: float
+    ) -> Optional[PanoramaLink]:
+        """Follow the model's pick when valid, else the unvisited link closest to the current heading"""
+        candidates = [link for link in links if link.pano not in visited]
+        for link in candidates:
+            if output is not None and link.pano == output.next_panorama:
+                return link
+        if not candidates:
+            return None
+        return min(candidates, key=lambda link: heading_delta(link.heading, heading))
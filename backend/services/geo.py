@@ -0,0 +1,45 @@
+# services/geo.py
+import math
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in meters"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(a))
+
+
+def bearing_deg(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Initial compass bearing from the first point to the second (0-360)"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dlmb = math.radians(lng2 - lng1)
+    x = math.sin(dlmb) * math.cos(phi2)
+    y = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(dlmb)
+    return math.degrees(math.atan2(x, y)) % 360
+
+
+def offset(lat: float, lng: float, bearing: float, distance_m: float) -> tuple[float, float]:
+    """Point reached by travelling distance_m along bearing from (lat, lng)"""
+    delta = distance_m / EARTH_RADIUS_M
+    theta = math.radians(bearing)
+    phi1, lmb1 = math.radians(lat), math.radians(lng)
+    phi2 = math.asin(math.sin(phi1) * math.cos(delta) + math.cos(phi1) * math.sin(delta) * math.cos(theta))
+    lmb2 = lmb1 + math.atan2(
+        math.sin(theta) * math.sin(delta) * math.cos(phi1),
+        math.cos(delta) - math.sin(phi1) * math.sin(phi2)
+    )
+    return math.degrees(phi2), (math.degrees(lmb2) + 540) % 360 - 180
+
+
+def heading_delta(a: float, b: float) -> float:
+    """Smallest absolute angle between two headings"""
+    return abs((a - b + 180) % 360 - 180)
+
+
+def zoom_to_fov(zoom: float) -> float:
+    """Street View zoom level to Static API field of view (fov = 180 / 2^zoom, clamped to 10-120)"""
+    return max(10.0, min(120.0, 180 / (2 ** zoom)))
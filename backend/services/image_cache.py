@@ -0,0 +1,357 @@
+# services/image_cache.py
+from collections import OrderedDict
+from typing import Optional, Union, Dict, Any, AsyncIterator, BinaryIO
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class CachedImage(BaseModel):
+    key: str
+    digest: str
+    content_type: str
+    size: int
+
+
+class BlobWriter:
+    def __init__(self, cache: "ImageCache"):
+        """
+        Incrementally write a blob (e.g. while proxying a stream) and add it to the cache
+
+        The content is hashed as it is written into a temp file next to the
+        blobs; `commit` moves it into place under its digest.
+
+        Args:
+            cache: Cache the blob is committed to
+        """
+        self.cache = cache
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file: Optional[BinaryIO] = None
+        self._tmp_path: Optional[str] = None
+
+    def _open(self) -> None:
+        fd, self._tmp_path = tempfile.mkstemp(dir=self.cache.directory, suffix=".part")
+        self._file = os.fdopen(fd, "wb")
+
+    async def write(self, chunk: bytes) -> None:
+        if self._file is None:
+            await asyncio.to_thread(self._open)
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        await asyncio.to_thread(self._file.write, chunk)
+
+    def _move_into_place(self, digest: str) -> None:
+        self._file.close()
+        path = self.cache._blob_path(digest)
+        if os.path.exists(path):
+            os.remove(self._tmp_path)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self._tmp_path, path)
+
+    async def commit(self, key: str, content_type: str) -> CachedImage:
+        """Store everything written so far under key"""
+        if self._file is None:
+            await asyncio.to_thread(self._open)
+        digest = self._hash.hexdigest()
+        await asyncio.to_thread(self._move_into_place, digest)
+        self._file = None
+        return await self.cache._commit(key, digest, content_type, self.size)
+
+    def _discard(self) -> None:
+        self._file.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+    async def abort(self) -> None:
+        """Drop a partial write (e.g. the client or upstream went away mid-stream)"""
+        if self._file is not None:
+            await asyncio.to_thread(self._discard)
+            self._file = None
+
+
+class ImageCache:
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int = 512 * 1024 * 1024,
+        heading_step: Optional[float] = None,
+        pitch_step: Optional[float] = None,
+        index_flush_interval: int = 50
+    ):
+        """
+        Content-addressed on-disk cache for Street View images with LRU eviction
+
+        Args:
+            directory: Directory holding the image blobs and the index file
+            max_bytes: Total size cap of stored blobs
+            heading_step: Quantize headings to this many degrees so near-identical views share an entry
+            pitch_step: Quantize pitches to this many degrees
+            index_flush_interval: Persist the index after this many writes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.heading_step = heading_step
+        self.pitch_step = pitch_step
+        self.index_flush_interval = index_flush_interval
+        self.index_path = os.path.join(directory, "index.json")
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, CachedImage]" = OrderedDict()
+        self._refcounts: Dict[str, int] = {}
+        self._blob_sizes: Dict[str, int] = {}
+        self._total_bytes = 0
+        self._dirty_writes = 0
+        os.makedirs(directory, exist_ok=True)
+        self._remove_partials()
+        self._load_index()
+
+    # Keys
+
+    def quantize_heading(self, heading: Optional[float]) -> Optional[float]:
+        if heading is None:
+            return None
+        if self.heading_step:
+            heading = round(heading / self.heading_step) * self.heading_step
+        return round(heading % 360, 2)
+
+    def quantize_pitch(self, pitch: Optional[float]) -> Optional[float]:
+        if pitch is None:
+            return None
+        if self.pitch_step:
+            pitch = round(pitch / self.pitch_step) * self.pitch_step
+        return round(max(-90.0, min(90.0, pitch)), 2)
+
+    def make_key(
+        self,
+        size: str,
+        pano_id: Optional[str] = None,
+        location: Optional[Union[str, tuple[float, float]]] = None,
+        heading: Optional[float] = None,
+        pitch: Optional[float] = None,
+        fov: Optional[float] = None,
+        **extra: Any
+    ) -> str:
+        """Build a normalized cache key; heading and pitch are expected to be quantized already"""
+        if pano_id:
+            target = f"pano:{pano_id}"
+        elif isinstance(location, tuple):
+            target = f"loc:{location[0]:.6f},{location[1]:.6f}"
+        elif location:
+            target = "addr:" + " ".join(location.lower().split())
+        else:
+            raise ValueError("Either location or pano_id must be provided")
+        parts = [
+            target,
+            f"size={size.lower()}",
+            f"heading={heading}",
+            f"pitch={pitch}",
+            f"fov={None if fov is None else round(fov, 2)}",
+        ]
+        parts.extend(f"{k}={v}" for k, v in sorted(extra.items()) if v is not None)
+        return "|".join(parts)
+
+    # Storage
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _remove_partials(self, max_age: float = 3600.0) -> None:
+        # Streamed writes abandoned by a crash; recent ones may belong to another worker
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".part") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+
+    def _load_index(self) -> None:
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path) as f:
+                raw = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable image cache index: {e}")
+            return
+        for item in raw.get("entries", []):
+            entry = CachedImage(**item)
+            if os.path.exists(self._blob_path(entry.digest)):
+                self._track(entry)
+        self._remove_blobs(self._evict())
+
+    def _index_snapshot(self) -> Dict[str, Any]:
+        return {"entries": [entry.model_dump() for entry in self._entries.values()]}
+
+    def _write_index(self, data: Dict[str, Any]) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _write_blob(self, digest: str, content: bytes) -> None:
+        path = self._blob_path(digest)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+    def _read_blob(self, digest: str) -> Optional[bytes]:
+        try:
+            with open(self._blob_path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _track(self, entry: CachedImage) -> None:
+        self._entries[entry.key] = entry
+        if self._refcounts.get(entry.digest, 0) == 0:
+            self._blob_sizes[entry.digest] = entry.size
+            self._total_bytes += entry.size
+        self._refcounts[entry.digest] = self._refcounts.get(entry.digest, 0) + 1
+
+    def _untrack(self, key: str) -> Optional[str]:
+        """Drop a key, returning the blob digest if it is no longer referenced"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        self._refcounts[entry.digest] -= 1
+        if self._refcounts[entry.digest] > 0:
+            return None
+        del self._refcounts[entry.digest]
+        self._total_bytes -= self._blob_sizes.pop(entry.digest)
+        return entry.digest
+
+    def _evict(self) -> list[str]:
+        orphaned = []
+        while self._total_bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            digest = self._untrack(oldest)
+            if digest:
+                orphaned.append(digest)
+        return orphaned
+
+    def _remove_blobs(self, digests: list[str]) -> None:
+        for digest in digests:
+            if digest in self._refcounts:
+                # Re-referenced since it was orphaned
+                continue
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    # Public API
+
+    def peek(self, key: str) -> Optional[CachedImage]:
+        """Entry metadata without touching hit counters or LRU order"""
+        return self._entries.get(key)
+
+    async def get(self, key: str) -> Optional[tuple[CachedImage, bytes]]:
+        """Return the cached entry and its bytes, or None on a miss"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        content = await asyncio.to_thread(self._read_blob, entry.digest)
+        if content is None:
+            # Blob removed underneath us
+            self._untrack(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry, content
+
+    def _open_blob(self, digest: str) -> Optional[BinaryIO]:
+        try:
+            return open(self._blob_path(digest), "rb")
+        except FileNotFoundError:
+            return None
+
+    async def open(self, key: str) -> Optional[tuple[CachedImage, BinaryIO]]:
+        """Like get, but return an open file so large blobs can be streamed"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        f = await asyncio.to_thread(self._open_blob, entry.digest)
+        if f is None:
+            self._untrack(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry, f
+
+    @staticmethod
+    async def iter_file(f: BinaryIO, chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+        """Read an opened blob in chunks, closing it when done"""
+        try:
+            while True:
+                chunk = await asyncio.to_thread(f.read, chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+        finally:
+            f.close()
+
+    def writer(self) -> BlobWriter:
+        """Start an incremental write; see BlobWriter"""
+        return BlobWriter(self)
+
+    async def put(self, key: str, content: bytes, content_type: str) -> CachedImage:
+        """Store image bytes under key, evicting least recently used entries past the size cap"""
+        digest = hashlib.sha256(content).hexdigest()
+        await asyncio.to_thread(self._write_blob, digest, content)
+        return await self._commit(key, digest, content_type, len(content))
+
+    async def _commit(self, key: str, digest: str, content_type: str, size: int) -> CachedImage:
+        """Point key at a blob that is already on disk"""
+        replaced = self._untrack(key)
+        entry = CachedImage(key=key, digest=digest, content_type=content_type, size=size)
+        self._track(entry)
+        orphaned = self._evict()
+        if replaced:
+            orphaned.append(replaced)
+        self._dirty_writes += 1
+        snapshot = None
+        if self._dirty_writes >= self.index_flush_interval:
+            self._dirty_writes = 0
+            snapshot = self._index_snapshot()
+        await asyncio.to_thread(self._finish_write, orphaned, snapshot)
+        return entry
+
+    def _finish_write(self, orphaned: list[str], snapshot: Optional[Dict[str, Any]]) -> None:
+        self._remove_blobs(orphaned)
+        if snapshot is not None:
+            self._write_index(snapshot)
+
+    async def flush(self) -> None:
+        """Persist the index so the cache survives restarts"""
+        self._dirty_writes = 0
+        await asyncio.to_thread(self._write_index, self._index_snapshot())
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+            "blobs": len(self._blob_sizes),
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -0,0 +1,167 @@
+# services/image_processing.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any
+import asyncio
+import base64
+import binascii
+import io
+import logging
+import math
+from PIL import Image
+from models.openai import ImagePreprocessReport
+
+logger = logging.getLogger(__name__)
+
+LOW_DETAIL_TOKENS = 85
+TILE_TOKENS = 170
+LOW_DETAIL_MAX_SIDE = 512
+
+
+def estimate_image_tokens(width: int, height: int, detail: str = "high") -> int:
+    """
+    Estimate vision input tokens for an image
+
+    Mirrors OpenAI's published accounting: low detail is a flat cost; high detail
+    fits the image in 2048x2048, scales the short side down to 768, then charges
+    per 512px tile.
+    """
+    if detail == "low":
+        return LOW_DETAIL_TOKENS
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return TILE_TOKENS * tiles + LOW_DETAIL_TOKENS
+
+
+def decode_data_url(url: str) -> Optional[bytes]:
+    """Bytes of a base64 data URL, or None for anything else"""
+    if not url.startswith("data:"):
+        return None
+    header, _, payload = url.partition(",")
+    if ";base64" not in header:
+        return None
+    try:
+        return base64.b64decode(payload)
+    except (binascii.Error, ValueError):
+        return None
+
+
+class ImagePreprocessor:
+    def __init__(
+        self,
+        max_dimension: int = 1024,
+        image_format: str = "JPEG",
+        quality: int = 80,
+        detail: str = "auto",
+        max_workers: int = 4
+    ):
+        """
+        Downscale and recompress images before they are sent to a vision model
+
+        Args:
+            max_dimension: Longest side after resizing, in pixels
+            image_format: Output format ('JPEG' or 'WEBP')
+            quality: Encoder quality (1-100)
+            detail: Vision detail level: 'low', 'high', or 'auto' to use 'low'
+                whenever the processed image already fits in 512x512
+            max_workers: Threads used for decoding and encoding
+        """
+        self.max_dimension = max_dimension
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self.detail = detail
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="image-preprocess")
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _resolve_detail(self, detail: str, width: int, height: int) -> str:
+        if detail == "auto":
+            return "low" if max(width, height) <= LOW_DETAIL_MAX_SIDE else "high"
+        return detail
+
+    def _process_one(self, raw: bytes, detail: str) -> Dict[str, Any]:
+        """Resize and re-encode one image; runs in the worker pool"""
+        with Image.open(io.BytesIO(raw)) as image:
+            original_size = image.size
+            image = image.convert("RGB")
+            image.thumbnail((self.max_dimension, self.max_dimension), Image.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, format=self.image_format, quality=self.quality, optimize=True)
+            processed = buffer.getvalue()
+            size = image.size
+
+        mime = f"image/{self.image_format.lower()}"
+        if len(processed) >= len(raw) and size == original_size:
+            # Nothing gained by recompressing
+            processed, mime = raw, None
+        resolved = self._resolve_detail(detail, *size)
+        return {
+            "content": processed,
+            "mime": mime,
+            "detail": resolved,
+            "original_bytes": len(raw),
+            "original_tokens": estimate_image_tokens(*original_size),
+            "processed_tokens": estimate_image_tokens(*size, detail=resolved),
+        }
+
+    async def process(
+        self,
+        images: List[str],
+        detail: Optional[str] = None
+    ) -> tuple[List[Dict[str, Any]], ImagePreprocessReport]:
+        """
+        Turn image URLs into chat `image_url` content parts
+
+        Data URLs are decoded, downscaled and recompressed off the event loop.
+        Remote URLs are passed through untouched since their bytes aren't local.
+        """
+        detail = detail or self.detail
+        loop = asyncio.get_running_loop()
+        report = ImagePreprocessReport(images=len(images))
+
+        jobs = []
+        for url in images:
+            raw = decode_data_url(url)
+            if raw is None:
+                jobs.append(None)
+            else:
+                jobs.append(loop.run_in_executor(self._executor, self._process_one, raw, detail))
+        results = await asyncio.gather(*[job for job in jobs if job is not None], return_exceptions=True)
+        results = iter(results)
+
+        parts = []
+        for url, job in zip(images, jobs):
+            if job is None:
+                report.passthrough += 1
+                image_url = {"url": url}
+                if detail != "auto":
+                    image_url["detail"] = detail
+                parts.append({"type": "image_url", "image_url": image_url})
+                continue
+
+            result = next(results)
+            if isinstance(result, Exception):
+                logger.error(f"Could not preprocess image, sending it unchanged: {result}")
+                report.passthrough += 1
+                parts.append({"type": "image_url", "image_url": {"url": url}})
+                continue
+
+            if result["mime"] is None:
+                processed_url = url
+                processed_bytes = result["original_bytes"]
+            else:
+                processed_url = f"data:{result['mime']};base64,{base64.b64encode(result['content']).decode('ascii')}"
+                processed_bytes = len(result["content"])
+            report.processed += 1
+            report.original_bytes += result["original_bytes"]
+            report.processed_bytes += processed_bytes
+            report.original_tokens += result["original_tokens"]
+            report.processed_tokens += result["processed_tokens"]
+            parts.append({
+                "type": "image_url",
+                "image_url": {"url": processed_url, "detail": result["detail"]}
+            })
+        return parts, report
@@ -0,0 +1,178 @@
+# services/job_queue.py
+from typing import Any, Dict, Iterable, List, Tuple
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+EXPORTED = "exported"
+
+
+class JobQueue:
+    def __init__(self, path: str, max_attempts: int = 3):
+        """
+        Resumable on-disk job queue backed by SQLite
+
+        Jobs are keyed so enqueueing the same input twice is a no-op, and each
+        result is committed as soon as it is recorded. Jobs left `running` by
+        an interrupted process go back to `pending` when the queue is reopened.
+        Jobs handed to the Batch API are `exported` until their results are
+        recorded, so they are neither claimed nor exported again meanwhile.
+
+        Args:
+            path: Database file path
+            max_attempts: Failures after which a job stays failed instead of being retried
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status_idx ON jobs(status, seq);
+            """
+        )
+        with self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ? WHERE status = ?", (PENDING, RUNNING)
+            )
+
+    def _enqueue(self, jobs: List[Tuple[str, Dict[str, Any]]]) -> int:
+        now = time.time()
+        with self._lock, self._conn:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO jobs (key, payload, status, updated_at) VALUES (?, ?, ?, ?)",
+                [(key, json.dumps(payload), PENDING, now) for key, payload in jobs]
+            )
+            return self._conn.total_changes - before
+
+    def _claim(self, limit: int) -> List[Tuple[str, Dict[str, Any]]]:
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT key, payload FROM jobs WHERE status = ? ORDER BY seq LIMIT ?", (PENDING, limit)
+            ).fetchall()
+            self._conn.executemany(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE key = ?",
+                [(RUNNING, time.time(), key) for key, _ in rows]
+            )
+        return [(key, json.loads(payload)) for key, payload in rows]
+
+    def _complete(self, key: str, result: Dict[str, Any]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = NULL, updated_at = ? WHERE key = ?",
+                (DONE, json.dumps(result), time.time(), key)
+            )
+
+    def _mark_exported(self, key: str, payload: Dict[str, Any]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, payload = ?, updated_at = ? WHERE key = ?",
+                (EXPORTED, json.dumps(payload), time.time(), key)
+            )
+
+    def _fail(self, key: str, error: str) -> bool:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET attempts = attempts + 1, error = ?, updated_at = ?, "
+                "status = CASE WHEN attempts + 1 >= ? THEN ? ELSE ? END WHERE key = ?",
+                (error, time.time(), self.max_attempts, FAILED, PENDING, key)
+            )
+            (status,) = self._conn.execute("SELECT status FROM jobs WHERE key = ?", (key,)).fetchone()
+        return status == PENDING
+
+    def _retry_failed(self) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = 0 WHERE status = ?", (PENDING, FAILED)
+            ).rowcount
+
+    def _requeue_exported(self) -> int:
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE status = ?", (PENDING, time.time(), EXPORTED)
+            ).rowcount
+
+    def _counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        counts = {PENDING: 0, RUNNING: 0, EXPORTED: 0, DONE: 0, FAILED: 0}
+        counts.update(dict(rows))
+        return counts
+
+    def results(self, batch_size: int = 500) -> Iterable[Tuple[str, Dict[str, Any]]]:
+        """Completed jobs' results in enqueue order"""
+        last = 0
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT seq, key, result FROM jobs WHERE status = ? AND seq > ? ORDER BY seq LIMIT ?",
+                    (DONE, last, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for seq, key, result in rows:
+                yield key, json.loads(result)
+            last = rows[-1][0]
+
+    def payloads(self, status: str = PENDING) -> List[Tuple[str, Dict[str, Any]]]:
+        """Keys and payloads of the jobs in a status, in enqueue order"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, payload FROM jobs WHERE status = ? ORDER BY seq", (status,)
+            ).fetchall()
+        return [(key, json.loads(payload)) for key, payload in rows]
+
+    async def enqueue(self, jobs: List[Tuple[str, Dict[str, Any]]]) -> int:
+        """Add jobs that aren't queued yet; returns how many were new"""
+        return await asyncio.to_thread(self._enqueue, jobs)
+
+    async def claim(self, limit: int = 1) -> List[Tuple[str, Dict[str, Any]]]:
+        """Mark up to `limit` pending jobs running and return them"""
+        return await asyncio.to_thread(self._claim, limit)
+
+    async def complete(self, key: str, result: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self._complete, key, result)
+
+    async def mark_exported(self, key: str, payload: Dict[str, Any]) -> None:
+        """Park a job until its Batch API result is imported, with the payload resolved while exporting it"""
+        await asyncio.to_thread(self._mark_exported, key, payload)
+
+    async def fail(self, key: str, error: str) -> bool:
+        """Record a failure; returns whether the job will be retried"""
+        return await asyncio.to_thread(self._fail, key, error)
+
+    async def retry_failed(self) -> int:
+        """Put failed jobs back in the queue with a fresh attempt budget"""
+        return await asyncio.to_thread(self._retry_failed)
+
+    async def requeue_exported(self) -> int:
+        """Put exported jobs whose results will never be imported back in the queue"""
+        return await asyncio.to_thread(self._requeue_exported)
+
+    async def counts(self) -> Dict[str, int]:
+        return await asyncio.to_thread(self._counts)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,152 @@
+# services/json_stream.py
+from typing import Any, List, Optional, Tuple
+import json
+
+WHITESPACE = " \t\r\n"
+
+# (kind, key, value): kind is "delta" for a partial string value or "field" for a complete member
+JSONStreamEvent = Tuple[str, str, Any]
+
+
+def _safe_string_prefix(raw: str) -> str:
+    """Longest prefix of a raw JSON string body that doesn't end inside an escape sequence"""
+    backslashes = len(raw) - len(raw.rstrip("\\"))
+    if backslashes % 2:
+        raw = raw[:-1]
+    unicode_escape = raw.rfind("\\u")
+    if unicode_escape != -1 and len(raw) - unicode_escape < 6:
+        preceding = len(raw[:unicode_escape]) - len(raw[:unicode_escape].rstrip("\\"))
+        if preceding % 2 == 0:
+            raw = raw[:unicode_escape]
+    return raw
+
+
+class IncrementalJSONObjectParser:
+    def __init__(self):
+        """
+        Parse a JSON object as it streams in, reporting each top-level member
+        as soon as it is complete and string values as they grow
+        """
+        self.result: dict = {}
+        self._state = "start"
+        self._key = ""
+        self._raw = ""
+        self._escape = False
+        self._in_string = False
+        self._depth = 0
+        self._emitted = 0
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    @property
+    def current_key(self) -> Optional[str]:
+        return self._key if self._state in ("string_value", "value") else None
+
+    def _complete(self, events: List[JSONStreamEvent], value: Any) -> None:
+        self.result[self._key] = value
+        events.append(("field", self._key, value))
+
+    def feed(self, text: str) -> List[JSONStreamEvent]:
+        events: List[JSONStreamEvent] = []
+        for ch in text:
+            state = self._state
+            if state == "start":
+                if ch == "{":
+                    self._state = "key_or_end"
+                elif ch not in WHITESPACE:
+                    raise ValueError(f"Expected '{{', got {ch!r}")
+            elif state == "key_or_end":
+                if ch == '"':
+                    self._state, self._raw, self._escape = "key", "", False
+                elif ch == "}":
+                    self._state = "done"
+                elif ch not in WHITESPACE + ",":
+                    raise ValueError(f"Expected a key, got {ch!r}")
+            elif state == "key":
+                if self._escape:
+                    self._escape = False
+                    self._raw += ch
+                elif ch == "\\":
+                    self._escape = True
+                    self._raw += ch
+                elif ch == '"':
+                    self._key = json.loads(f'"{self._raw}"')
+                    self._state = "colon"
+                else:
+                    self._raw += ch
+            elif state == "colon":
+                if ch == ":":
+                    self._state = "value_start"
+                elif ch not in WHITESPACE:
+                    raise ValueError(f"Expected ':', got {ch!r}")
+            elif state == "value_start":
+                if ch in WHITESPACE:
+                    continue
+                self._raw, self._escape = "", False
+                if ch == '"':
+                    self._state, self._emitted = "string_value", 0
+                else:
+                    self._state, self._raw, self._in_string = "value", ch, False
+                    self._depth = 1 if ch in "[{" else 0
+            elif state == "string_value":
+                if self._escape:
+                    self._escape = False
+                    self._raw += ch
+                elif ch == "\\":
+                    self._escape = True
+                    self._raw += ch
+                elif ch == '"':
+                    value = json.loads(f'"{self._raw}"')
+                    if len(value) > self._emitted:
+                        events.append(("delta", self._key, value[self._emitted:]))
+                    self._complete(events, value)
+                    self._state = "after_value"
+                else:
+                    self._raw += ch
+            elif state == "value":
+                if self._in_string:
+                    self._raw += ch
+                    if self._escape:
+                        self._escape = False
+                    elif ch == "\\":
+                        self._escape = True
+                    elif ch == '"':
+                        self._in_string = False
+                elif ch == '"':
+                    self._raw += ch
+                    self._in_string = True
+                elif ch in "[{":
+                    self._raw += ch
+                    self._depth += 1
+                elif ch in "]}" and self._depth > 0:
+                    self._raw += ch
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._complete(events, json.loads(self._raw))
+                        self._state = "after_value"
+                elif self._depth == 0 and ch in ",}":
+                    self._complete(events, json.loads(self._raw))
+                    self._state = "key_or_end" if ch == "," else "done"
+                else:
+                    self._raw += ch
+            elif state == "after_value":
+                if ch == ",":
+                    self._state = "key_or_end"
+                elif ch == "}":
+                    self._state = "done"
+                elif ch not in WHITESPACE:
+                    raise ValueError(f"Expected ',' or '}}', got {ch!r}")
+            elif ch not in WHITESPACE:
+                raise ValueError("Unexpected data after the end of the object")
+
+        if self._state == "string_value":
+            decoded = json.loads(f'"{_safe_string_prefix(self._raw)}"')
+            if decoded and "\ud800" <= decoded[-1] <= "\udbff":
+                # Wait for the low half of a surrogate pair
+                decoded = decoded[:-1]
+            if len(decoded) > self._emitted:
+                events.append(("delta", self._key, decoded[self._emitted:]))
+                self._emitted = len(decoded)
+        return events
@@ -0,0 +1,73 @@
+# services/metadata_cache.py
+from typing import Optional, Union, Dict, Any, List
+from models.street_view import StreetViewMetadata
+from services.cache import TTLCache
+
+
+def metadata_key(
+    location: Optional[Union[str, tuple[float, float]]] = None,
+    pano_id: Optional[str] = None,
+    precision: int = 5
+) -> str:
+    """Normalized lookup key; coordinates are rounded so nearby lookups share an entry"""
+    if location:
+        if isinstance(location, tuple):
+            return f"loc:{float(location[0]):.{precision}f},{float(location[1]):.{precision}f}"
+        return "addr:" + " ".join(location.lower().split())
+    if pano_id:
+        return f"pano:{pano_id}"
+    raise ValueError("Either location or pano_id must be provided")
+
+
+class MetadataCache:
+    def __init__(
+        self,
+        max_entries: int = 10000,
+        ttl: float = 86400.0,
+        negative_ttl: float = 3600.0,
+        precision: int = 5
+    ):
+        """
+        TTL cache for Street View metadata responses
+
+        Args:
+            max_entries: Entries kept before the least recently used is dropped
+            ttl: Seconds an OK response is kept (panorama metadata rarely changes)
+            negative_ttl: Seconds a ZERO_RESULTS response is kept
+            precision: Decimal places lat/lng are rounded to when building keys
+        """
+        self.negative_ttl = negative_ttl
+        self.precision = precision
+        self._cache: TTLCache[StreetViewMetadata] = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    def make_key(
+        self,
+        location: Optional[Union[str, tuple[float, float]]] = None,
+        pano_id: Optional[str] = None
+    ) -> str:
+        return metadata_key(location, pano_id, self.precision)
+
+    def get(self, key: str) -> Optional[StreetViewMetadata]:
+        return self._cache.get(key)
+
+    def store(self, key: str, metadata: StreetViewMetadata) -> None:
+        """Cache OK and ZERO_RESULTS responses; transient errors are never cached"""
+        if metadata.status == "OK":
+            self._cache.set(key, metadata)
+            if metadata.pano_id:
+                self._cache.set(metadata_key(pano_id=metadata.pano_id), metadata)
+        elif metadata.status == "ZERO_RESULTS":
+            self._cache.set(key, metadata, ttl=self.negative_ttl)
+
+    def dump(self) -> List[list]:
+        """JSON-ready [key, seconds left, metadata] entries, least recently used first"""
+        return [[key, ttl, metadata.model_dump(exclude_none=True)] for key, ttl, metadata in self._cache.dump()]
+
+    def restore(self, entries: List[list], elapsed: float = 0.0) -> int:
+        """Load entries from `dump`, less `elapsed` seconds of TTL; returns how many were still live"""
+        return self._cache.restore(
+            (key, ttl - elapsed, StreetViewMetadata(**metadata)) for key, ttl, metadata in entries
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
@@ -0,0 +1,379 @@
+# services/metrics.py
+import bisect
+import contextvars
+import math
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+
+    def _key(self, labels: Dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, label_values, value in self.samples():
+            names = self.label_names + (("le",) if len(label_values) > len(self.label_names) else ())
+            lines.append(f"{self.name}{suffix}{_format_labels(names, label_values)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        for key, value in sorted(self._values.items()):
+            yield "", key, value
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: Any) -> None:
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        for key, value in sorted(self._values.items()):
+            yield "", key, value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [non-cumulative bucket counts..., +Inf count], sum
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+            self._sums[key] = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+
+    def count(self, **labels: Any) -> int:
+        return sum(self._counts.get(self._key(labels), ()))
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        for key in sorted(self._counts):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), self._counts[key]):
+                cumulative += count
+                yield "_bucket", key + (_format_value(bound),), cumulative
+            yield "_sum", key, self._sums[key]
+            yield "_count", key, cumulative
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> Any:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+                raise ValueError(f"Metric {metric.name} is already registered with a different shape")
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help_text, labels))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS
+    ) -> Histogram:
+        return self._register(Histogram(name, help_text, labels, buckets))
+
+    def render(self, extra: Sequence[_Metric] = ()) -> str:
+        """Prometheus text exposition (format 0.0.4) for registered and scrape-time metrics"""
+        lines: List[str] = []
+        for metric in list(self._metrics.values()) + list(extra):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Time to complete an HTTP request, including streamed bodies",
+    ("method", "route", "status")
+)
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being served"
+)
+HTTP_RESPONSE_BYTES = REGISTRY.histogram(
+    "http_response_size_bytes",
+    "Response body size",
+    ("method", "route"),
+    buckets=BYTE_BUCKETS
+)
+UPSTREAM_DURATION = REGISTRY.histogram(
+    "upstream_request_duration_seconds",
+    "Time spent in upstream calls, including retries",
+    ("upstream", "operation", "outcome")
+)
+OPENAI_TOKENS = REGISTRY.counter(
+    "openai_tokens_total",
+    "Tokens reported by OpenAI usage, by kind (prompt, completion, cached_prompt)",
+    ("model", "kind")
+)
+STARTUP_SECONDS = REGISTRY.gauge(
+    "app_startup_seconds",
+    "Time spent starting the process, by phase (import, lifespan)",
+    ("phase",)
+)
+
+
+# Per-request timing spans
+class RequestTrace:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans: List[Tuple[str, float]] = []
+
+    def add(self, name: str, duration: float) -> None:
+        self.spans.append((name, duration))
+
+    def summary(self) -> Dict[str, float]:
+        """Total milliseconds per span name"""
+        totals: Dict[str, float] = {}
+        for name, duration in self.spans:
+            totals[name] = totals.get(name, 0.0) + duration * 1000
+        return {name: round(total, 2) for name, total in totals.items()}
+
+    def server_timing(self) -> str:
+        """Server-Timing header value for the spans finished so far"""
+        entries = [f"{name};dur={total}" for name, total in self.summary().items()]
+        entries.append(f"total;dur={round((time.perf_counter() - self.started) * 1000, 2)}")
+        return ", ".join(entries)
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("request_trace", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def detached_context() -> contextvars.Context:
+    """Copy of the current context with no active trace, for background tasks"""
+    context = contextvars.copy_context()
+    context.run(_current_trace.set, None)
+    return context
+
+
+@contextmanager
+def trace() -> Iterator[RequestTrace]:
+    """Collect spans from this context (and tasks started inside it) into a new trace"""
+    request_trace = RequestTrace()
+    token = _current_trace.set(request_trace)
+    try:
+        yield request_trace
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Time a block into the current trace, if one is active"""
+    request_trace = _current_trace.get()
+    if request_trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        request_trace.add(name, time.perf_counter() - started)
+
+
+@contextmanager
+def upstream_timer(upstream: str, operation: str) -> Iterator[None]:
+    """Record an upstream call's duration (and a `<upstream>-<operation>` span)"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        duration = time.perf_counter() - started
+        UPSTREAM_DURATION.observe(duration, upstream=upstream, operation=operation, outcome=outcome)
+        request_trace = _current_trace.get()
+        if request_trace is not None:
+            request_trace.add(f"{upstream}-{operation}", duration)
+
+
+def record_token_usage(model: str, usage: Any) -> None:
+    """Count prompt/completion tokens from an OpenAI usage object (None is ignored)"""
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(usage.prompt_tokens or 0, model=model, kind="prompt")
+    OPENAI_TOKENS.inc(usage.completion_tokens or 0, model=model, kind="completion")
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached:
+        OPENAI_TOKENS.inc(cached, model=model, kind="cached_prompt")
+
+
+def stats_gauges(prefix: str, help_text: str, label: str, sources: Dict[str, Optional[Dict[str, Any]]]) -> List[Gauge]:
+    """
+    One gauge per numeric stat key, labelled by source, for stats() dicts read at scrape time
+
+    Args:
+        prefix: Metric name prefix (e.g. "cache")
+        help_text: Help text shared by the gauges
+        label: Label name identifying the source (e.g. "cache")
+        sources: Source name -> stats dict (None sources are skipped)
+    """
+    gauges: Dict[str, Gauge] = {}
+    for source, stats in sources.items():
+        if stats is None:
+            continue
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            gauge = gauges.get(key)
+            if gauge is None:
+                gauge = gauges[key] = Gauge(f"{prefix}_{key}", f"{help_text} ({key})", (label,))
+            gauge.set(value, **{label: source})
+    return list(gauges.values())
+
+
+def _route_label(scope: Dict[str, Any]) -> str:
+    # Route templates keep label cardinality bounded; unmatched paths share one label
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request latency, in-flight count and response bytes
+
+    Args:
+        app: The wrapped ASGI app
+        server_timing: Add a Server-Timing header with the request's spans
+    """
+
+    def __init__(self, app, server_timing: bool = False):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        body_bytes = 0
+        request_trace = RequestTrace() if self.server_timing else None
+        token = _current_trace.set(request_trace)
+
+        async def send_with_metrics(message):
+            nonlocal status, body_bytes
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if request_trace is not None:
+                    # Streamed responses only report the spans finished before the first byte
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", request_trace.server_timing().encode("latin-1")))
+                    message = {**message, "headers": headers}
+            elif message["type"] == "http.response.body":
+                body_bytes += len(message.get("body", b""))
+            await send(message)
+
+        HTTP_REQUESTS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec()
+            _current_trace.reset(token)
+            route = _route_label(scope)
+            HTTP_REQUEST_DURATION.observe(
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=route,
+                status=str(status)
+            )
+            HTTP_RESPONSE_BYTES.observe(body_bytes, method=scope["method"], route=route)
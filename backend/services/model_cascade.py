@@ -0,0 +1,158 @@
+# services/model_cascade.py
+from typing import Any, Dict, Optional, Tuple
+import logging
+import math
+from models.openai import ScreenshotAnalysis, AnalysisOutput
+from services.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+NEXT_ACTIONS = ("new_panorama", "new_view", "complete")
+
+# USD per million (prompt, completion) tokens; models not listed are costed at 0
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+}
+
+CASCADE_DECISIONS = REGISTRY.counter(
+    "analysis_cascade_decisions_total",
+    "Cascade routing outcomes: accepted from the small model or the reason for escalating",
+    ("outcome",)
+)
+OPENAI_COST = REGISTRY.counter(
+    "openai_cost_usd_total",
+    "Estimated OpenAI spend from token usage and the model price table",
+    ("model",)
+)
+
+
+def validation_error(output: AnalysisOutput, request: ScreenshotAnalysis) -> Optional[str]:
+    """Why an output can't be acted on for this request (None when it can)"""
+    if output.next_action not in NEXT_ACTIONS:
+        return "invalid_action"
+    if output.next_action == "new_panorama":
+        if output.next_panorama not in {p.pano for p in request.panoramas}:
+            return "unknown_panorama"
+        if output.next_panorama in {entry.panorama for entry in request.timeline}:
+            return "revisit"
+    return None
+
+
+def navigation_confidence(logprobs: Any) -> Optional[float]:
+    """
+    Geometric-mean probability of the tokens before the prose fields
+
+    AnalysisOutput declares the navigation fields first, so these tokens are
+    the model's routing decision. None when the response carries no logprobs.
+    """
+    content = getattr(logprobs, "content", None)
+    if not content:
+        return None
+    text, total, count = "", 0.0, 0
+    for token in content:
+        text += token.token
+        if '"thoughts"' in text:
+            break
+        total += token.logprob
+        count += 1
+    return math.exp(total / count) if count else None
+
+
+def usage_cost(model: str, usage: Any) -> float:
+    """Estimated USD cost of one call's token usage"""
+    if usage is None:
+        return 0.0
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return ((usage.prompt_tokens or 0) * prompt_price + (usage.completion_tokens or 0) * completion_price) / 1e6
+
+
+class ModelCascade:
+    def __init__(
+        self,
+        small_model: str = "gpt-4o-mini",
+        min_confidence: float = 0.8,
+        escalate_on_notes: bool = True
+    ):
+        """
+        Routing policy that tries a small model before the requested one
+
+        The small model's output is kept when it passes validation (a known
+        next_action, an offered and unvisited next_panorama), its navigation
+        tokens are confident enough, and it produced no notes. Otherwise the
+        request is re-run on the requested model. Calls, latency, tokens and
+        estimated cost are tallied per tier so the policy can be tuned.
+
+        Args:
+            small_model: Model tried first
+            min_confidence: Navigation confidence below which the step escalates (0 disables the check)
+            escalate_on_notes: Escalate whenever the small model produces notes, so notes come from the larger model
+        """
+        self.small_model = small_model
+        self.min_confidence = min_confidence
+        self.escalate_on_notes = escalate_on_notes
+        self.decisions: Dict[str, int] = {}
+        self.escalated_invalid = 0
+        self._tiers: Dict[str, Dict[str, float]] = {}
+
+    def applies(self, request: ScreenshotAnalysis) -> bool:
+        return request.cascade and request.model != self.small_model
+
+    def escalation_reason(
+        self,
+        output: AnalysisOutput,
+        request: ScreenshotAnalysis,
+        confidence: Optional[float]
+    ) -> Optional[str]:
+        """Why the small model's output should be escalated (None to accept it)"""
+        error = validation_error(output, request)
+        if error is not None:
+            return error
+        if confidence is not None and confidence < self.min_confidence:
+            return "low_confidence"
+        if self.escalate_on_notes and output.important_notes:
+            return "notes"
+        return None
+
+    def record_call(self, tier: str, model: str, seconds: float, usage: Any) -> None:
+        cost = usage_cost(model, usage)
+        OPENAI_COST.inc(cost, model=model)
+        stats = self._tiers.setdefault(tier, {"calls": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0})
+        stats["calls"] += 1
+        stats["seconds"] += seconds
+        if usage is not None:
+            stats["prompt_tokens"] += usage.prompt_tokens or 0
+            stats["completion_tokens"] += usage.completion_tokens or 0
+        stats["cost_usd"] += cost
+
+    def record_decision(self, reason: Optional[str]) -> None:
+        outcome = reason or "accepted"
+        self.decisions[outcome] = self.decisions.get(outcome, 0) + 1
+        CASCADE_DECISIONS.inc(outcome=outcome)
+
+    def record_escalated(self, error: Optional[str]) -> None:
+        """Note an escalated output that still fails validation (it is returned as the direct path would)"""
+        if error is not None:
+            self.escalated_invalid += 1
+            logger.warning(f"Escalated analysis failed validation: {error}")
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-tier totals (with mean latency) and the decision counts"""
+        tiers = {
+            tier: {**stats, "mean_seconds": stats["seconds"] / stats["calls"] if stats["calls"] else 0.0}
+            for tier, stats in self._tiers.items()
+        }
+        routed = sum(self.decisions.values())
+        escalated = routed - self.decisions.get("accepted", 0)
+        return {
+            "tiers": tiers,
+            "decisions": {
+                **self.decisions,
+                "routed": routed,
+                "escalation_ratio": escalated / routed if routed else 0.0,
+                "escalated_invalid": self.escalated_invalid,
+            },
+        }
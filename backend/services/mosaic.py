@@ -0,0 +1,184 @@
+# services/mosaic.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import asyncio
+import base64
+import io
+import math
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+from models.street_view import MosaicImage
+from services.street_view import GoogleStreetViewService
+
+LABEL_PADDING = 4
+
+
+def mosaic_headings(start: float, views: int) -> List[float]:
+    """Evenly spaced headings around the circle, starting at `start`"""
+    return [round((start + i * 360 / views) % 360, 2) for i in range(views)]
+
+
+def mosaic_fov(views: int) -> float:
+    """Field of view that lets `views` evenly spaced headings cover 360 degrees"""
+    return max(10.0, min(120.0, 360 / views))
+
+
+def describe_mosaic(mosaic: MosaicImage) -> str:
+    """Prompt text telling the model how the tiles are laid out"""
+    order = ", ".join(f"{heading:g}°" for heading in mosaic.headings)
+    return (
+        f"The image is a {mosaic.rows}x{mosaic.columns} mosaic of {len(mosaic.headings)} views from the same "
+        f"panorama, each labelled with its heading; tiles run left to right, top to bottom at headings: {order}."
+    )
+
+
+def _parse_size(size: str) -> tuple[int, int]:
+    width, _, height = size.lower().partition("x")
+    return int(width), int(height)
+
+
+class MosaicComposer:
+    def __init__(
+        self,
+        street_view: GoogleStreetViewService,
+        max_workers: int = 2,
+        image_format: str = "JPEG",
+        quality: int = 85
+    ):
+        """
+        Tile several headings of a panorama into one labelled image
+
+        Covering a panorama with one mosaic costs a single vision input instead
+        of one per heading. Tiles are fetched concurrently (through the image
+        cache) and composed with NumPy in a worker pool.
+
+        Args:
+            street_view: Service the tiles are fetched from
+            max_workers: Threads used for decoding, tiling and encoding
+            image_format: Output format ('JPEG', 'WEBP' or 'PNG')
+            quality: Encoder quality for lossy formats (1-100)
+        """
+        self.street_view = street_view
+        self.image_format = image_format.upper()
+        self.quality = quality
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mosaic")
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def compose(
+        self,
+        pano_id: str,
+        headings: List[float],
+        tile_size: str = "320x320",
+        columns: Optional[int] = None,
+        pitch: float = 0.0,
+        fov: Optional[float] = None,
+        label: bool = True
+    ) -> MosaicImage:
+        """
+        Fetch one tile per heading and compose them into a grid
+
+        Args:
+            pano_id: Panorama to cover
+            headings: Tile headings, in reading order
+            tile_size: Size of each tile (widthxheight) as requested from Street View
+            columns: Tiles per row; defaults to a near-square grid
+            pitch: Camera pitch for every tile
+            fov: Field of view per tile; defaults to 360 / number of headings (capped at 120)
+            label: Draw each tile's heading in its corner
+        """
+        if not headings:
+            raise ValueError("At least one heading is required")
+        columns = columns or math.ceil(math.sqrt(len(headings)))
+        columns = max(1, min(columns, len(headings)))
+        rows = math.ceil(len(headings) / columns)
+        fov = fov if fov is not None else mosaic_fov(len(headings))
+
+        tiles = await asyncio.gather(*[
+            self.street_view.get_image_by_pano(
+                pano_id=pano_id,
+                size=tile_size,
+                heading=heading,
+                pitch=pitch,
+                fov=fov
+            )
+            for heading in headings
+        ])
+        loop = asyncio.get_running_loop()
+        content, width, height = await loop.run_in_executor(
+            self._executor,
+            self._compose,
+            [tile.content for tile in tiles],
+            headings if label else None,
+            _parse_size(tile_size),
+            rows,
+            columns
+        )
+        return MosaicImage(
+            content=content,
+            content_type=f"image/{self.image_format.lower()}",
+            pano_id=pano_id,
+            headings=headings,
+            rows=rows,
+            columns=columns,
+            width=width,
+            height=height,
+            fov=fov,
+            cache_hits=sum(tile.cache_hit for tile in tiles)
+        )
+
+    def _compose(
+        self,
+        contents: List[bytes],
+        labels: Optional[List[float]],
+        tile_size: tuple[int, int],
+        rows: int,
+        columns: int
+    ) -> tuple[bytes, int, int]:
+        """Decode, tile, label and encode; runs in the worker pool"""
+        tile_w, tile_h = tile_size
+        canvas = np.zeros((rows * tile_h, columns * tile_w, 3), dtype=np.uint8)
+        for i, content in enumerate(contents):
+            with Image.open(io.BytesIO(content)) as image:
+                image = image.convert("RGB")
+                if image.size != (tile_w, tile_h):
+                    image = image.resize((tile_w, tile_h), Image.BILINEAR)
+                row, column = divmod(i, columns)
+                canvas[row * tile_h:(row + 1) * tile_h, column * tile_w:(column + 1) * tile_w] = np.asarray(image)
+
+        if labels is not None:
+            font = ImageFont.load_default(size=max(10, tile_h // 14))
+            texts = [f"{heading:g}°" for heading in labels]
+            boxes = [font.getbbox(text) for text in texts]
+            # Darken each label's corner in one pass over the canvas, then draw the text
+            for i, (left, top, right, bottom) in enumerate(boxes):
+                row, column = divmod(i, columns)
+                y0, x0 = row * tile_h, column * tile_w
+                y1 = y0 + min(tile_h, bottom + 2 * LABEL_PADDING)
+                x1 = x0 + min(tile_w, right + 2 * LABEL_PADDING)
+                canvas[y0:y1, x0:x1] //= 3
+            mosaic = Image.fromarray(canvas)
+            draw = ImageDraw.Draw(mosaic)
+            for i, text in enumerate(texts):
+                row, column = divmod(i, columns)
+                draw.text(
+                    (column * tile_w + LABEL_PADDING, row * tile_h + LABEL_PADDING),
+                    text,
+                    fill=(255, 255, 255),
+                    font=font
+                )
+        else:
+            mosaic = Image.fromarray(canvas)
+
+        buffer = io.BytesIO()
+        if self.image_format == "PNG":
+            mosaic.save(buffer, format="PNG", optimize=True)
+        else:
+            mosaic.save(buffer, format=self.image_format, quality=self.quality)
+        return buffer.getvalue(), mosaic.width, mosaic.height
+
+    @staticmethod
+    def data_url(mosaic: MosaicImage) -> str:
+        """Mosaic as a data URL, ready to pass as a ScreenshotAnalysis image"""
+        return f"data:{mosaic.content_type};base64,{base64.b64encode(mosaic.content).decode('ascii')}"
@@ -0,0 +1,175 @@
+# services/novelty.py
+from typing import Any, Callable, Dict, Hashable, Optional
+import asyncio
+import io
+import numpy as np
+from PIL import Image
+from models.openai import AnalysisOutput, NoveltyReport
+from services.cache import TTLCache
+
+THUMB_SIZE = 16
+HIST_BINS = 4
+# Grayscale standard deviation (0-1) below which a view counts as featureless (walls, sky, fog)
+BLANK_DETAIL = 0.03
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+class ViewSignature:
+    def __init__(self, structure: np.ndarray, colour: np.ndarray, blank: bool):
+        """Compact description of a view: normalized 16x16 grayscale layout and a 64-bin colour histogram"""
+        self.structure = structure
+        self.colour = colour
+        self.blank = blank
+
+
+def view_signature(raw: bytes) -> ViewSignature:
+    with Image.open(io.BytesIO(raw)) as image:
+        # JPEG draft mode decodes at a reduced scale, which is all a 16x16 thumbnail needs
+        image.draft("RGB", (THUMB_SIZE * 4, THUMB_SIZE * 4))
+        image = image.convert("RGB")
+        # The histogram uses more pixels than the layout so it isn't dominated by a few
+        pixels = np.asarray(image.resize((THUMB_SIZE * 4, THUMB_SIZE * 4), Image.BILINEAR))
+        rgb = np.asarray(image.resize((THUMB_SIZE, THUMB_SIZE), Image.BILINEAR), dtype=np.float32)
+    gray = (rgb @ _LUMA).ravel()
+    centered = gray - gray.mean()
+    norm = np.linalg.norm(centered)
+    structure = centered / norm if norm > 0 else centered
+    bins = pixels.astype(np.int64) // (256 // HIST_BINS)
+    index = (bins[..., 0] * HIST_BINS + bins[..., 1]) * HIST_BINS + bins[..., 2]
+    colour = np.bincount(index.ravel(), minlength=HIST_BINS ** 3).astype(np.float32) / index.size
+    return ViewSignature(structure.astype(np.float32), colour, bool(gray.std() / 255 < BLANK_DETAIL))
+
+
+class NoveltyFilter:
+    def __init__(self, max_views: int = 256):
+        """
+        Views already analyzed in one session, scored against in a single vectorized pass
+
+        Similarity to a prior view averages the correlation of the grayscale
+        layouts with the overlap of the colour histograms; two featureless views
+        count as the same layout. Novelty is one minus the best similarity.
+
+        Args:
+            max_views: Prior views kept; the oldest are overwritten first
+        """
+        self.max_views = max_views
+        self._structure = np.zeros((max_views, THUMB_SIZE * THUMB_SIZE), dtype=np.float32)
+        self._colour = np.zeros((max_views, HIST_BINS ** 3), dtype=np.float32)
+        self._blank = np.zeros(max_views, dtype=bool)
+        self._outputs: list[Optional[AnalysisOutput]] = [None] * max_views
+        self._count = 0
+
+    def __len__(self) -> int:
+        return min(self._count, self.max_views)
+
+    def score(self, signature: ViewSignature) -> tuple[float, Optional[int]]:
+        """Novelty (0 = seen before, 1 = nothing like it) and the slot of the most similar view"""
+        n = len(self)
+        if n == 0:
+            return 1.0, None
+        layout = np.clip(self._structure[:n] @ signature.structure, 0.0, 1.0)
+        if signature.blank:
+            layout = np.where(self._blank[:n], 1.0, layout)
+        colour = np.minimum(self._colour[:n], signature.colour).sum(axis=1)
+        similarity = 0.5 * layout + 0.5 * colour
+        nearest = int(np.argmax(similarity))
+        return float(1.0 - similarity[nearest]), nearest
+
+    def add(self, signature: ViewSignature, output: Optional[AnalysisOutput] = None) -> None:
+        slot = self._count % self.max_views
+        self._structure[slot] = signature.structure
+        self._colour[slot] = signature.colour
+        self._blank[slot] = signature.blank
+        self._outputs[slot] = output
+        self._count += 1
+
+    def output(self, slot: Optional[int]) -> Optional[AnalysisOutput]:
+        return self._outputs[slot] if slot is not None else None
+
+
+class NoveltyTracker:
+    def __init__(
+        self,
+        threshold: float = 0.1,
+        max_views: int = 256,
+        max_sessions: int = 1000,
+        ttl: float = 3600.0
+    ):
+        """
+        Per-session novelty filters, checked before a view is sent to the model
+
+        A view whose novelty falls below the threshold is skipped; callers get
+        the score and the analysis of the most similar earlier view instead of
+        a new model call.
+
+        Args:
+            threshold: Novelty below which a view is skipped (0 disables skipping)
+            max_views: Prior views kept per session
+            max_sessions: Sessions tracked before the least recently used is dropped
+            ttl: Seconds an idle session's views are kept
+        """
+        self.threshold = threshold
+        self.max_views = max_views
+        self._filters: TTLCache[NoveltyFilter] = TTLCache(max_entries=max_sessions, ttl=ttl)
+        self.checked = 0
+        self.skipped = 0
+        self.unusable = 0
+
+    def _filter(self, session: Hashable) -> NoveltyFilter:
+        novelty_filter = self._filters.get(session)
+        if novelty_filter is None:
+            novelty_filter = NoveltyFilter(self.max_views)
+        # Re-setting refreshes the TTL, so only idle sessions expire
+        self._filters.set(session, novelty_filter)
+        return novelty_filter
+
+    async def assess(
+        self,
+        session: Hashable,
+        raw: bytes,
+        threshold: Optional[float] = None,
+        usable: Optional[Callable[[AnalysisOutput], bool]] = None
+    ) -> tuple[NoveltyReport, Optional[ViewSignature], Optional[AnalysisOutput]]:
+        """
+        Score a view against the session's earlier views
+
+        Returns the report, the view's signature (to `record` once it has been
+        analyzed) and, when the view is skipped, the earlier view's analysis.
+        Images that can't be decoded are never skipped, and neither are views
+        whose earlier analysis `usable` rejects (e.g. it points at a panorama
+        that has since been visited).
+        """
+        threshold = self.threshold if threshold is None else threshold
+        try:
+            signature = await asyncio.to_thread(view_signature, raw)
+        except Exception:
+            return NoveltyReport(score=1.0, threshold=threshold, skipped=False, compared=0), None, None
+        novelty_filter = self._filter(session)
+        score, nearest = novelty_filter.score(signature)
+        merged = novelty_filter.output(nearest)
+        skipped = score < threshold and merged is not None
+        if skipped and usable is not None and not usable(merged):
+            skipped = False
+            self.unusable += 1
+        self.checked += 1
+        if skipped:
+            self.skipped += 1
+        report = NoveltyReport(score=round(score, 4), threshold=threshold, skipped=skipped, compared=len(novelty_filter))
+        return report, signature, merged if skipped else None
+
+    def record(self, session: Hashable, signature: Optional[ViewSignature], output: AnalysisOutput) -> None:
+        """Remember an analyzed view so later near-duplicates can be skipped"""
+        if signature is not None:
+            self._filter(session).add(signature, output)
+
+    def forget(self, session: Hashable) -> None:
+        self._filters.delete(session)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "checked": self.checked,
+            "skipped": self.skipped,
+            "skip_ratio": self.skipped / self.checked if self.checked else 0.0,
+            "unusable": self.unusable,
+            "sessions": len(self._filters),
+        }
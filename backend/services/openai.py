@@ -1,16 +1,166 @@
-from typing import Any, AsyncGenerator
+from contextlib import nullcontext
+from typing import Any, AsyncGenerator, Callable, Optional
+import time
+
+import httpx
 
 from fastapi import HTTPException
-from dotenv import load_dotenv
-from openai import AsyncOpenAI
-from models.openai import ChatRequest, ScreenshotAnalysis, AnalysisOutput
+from pydantic import BaseModel
+from models.openai import (
+    ChatRequest,
+    ScreenshotAnalysis,
+    AnalysisOutput,
+    AnalysisResult,
+    AnalysisStreamEvent,
+    ImagePreprocessReport,
+    CascadeRoute
+)
+from services.image_processing import ImagePreprocessor
+from services.prompt_context import PromptContextBuilder, PromptContext
+from services.json_stream import IncrementalJSONObjectParser
+from services.upstream import UpstreamGuard, UpstreamError, Failure, error_detail, parse_retry_after
+from services.analysis_cache import AnalysisCache
+from services.model_cascade import ModelCascade, navigation_confidence, validation_error
+from services.metrics import upstream_timer, record_token_usage, span
+
+SYSTEM_PROMPT = "You are an expert geographer analyzing a screenshot to provide thoughts and important notes based on a specified goal."
+
+# Static instructions live in the system message so every request shares the
+# same prefix and only the per-step user content changes (lets OpenAI reuse
+# its prompt cache for the prefix)
+ANALYSIS_RULES = """
+Rules:
+1. When deciding which panorama to move to next, always choose the connected panoramas that have a heading closest to the current heading - you will be shut off if you dont follow this rule
+2. Do not visit the same panorama twice or you will be shut off
+3. Important Notes and Thoughts should be directly related to the goal (dont include any other thoughts or notes) - be very stringent when deciding if you return any notes or not
+3. the next_action field can only have three possible values: 'new_panorama', 'new_view', or 'complete'
+    - 'new_panorama' means that you want to move to the next panorama
+    - 'new_view' means that you want to stay on the current panorama but move to a different heading, pitch, or zoom
+    - 'complete' means that you are done with the analysis
+4. the next_panorama field should contain the ID of the next panorama you want to move to - this should only be filled if the next_action field is 'new panorama'
+5. the next_heading field should contain the heading of the next view you want to move to - this should only be filled if the next_action field is 'new view' or 'new panorama' - if 'new panorama' then this should be the heading of the next panorama
+6. the next_pitch field should contain the pitch of the next view you want to move to - this should only be filled if the next_action field is 'new view'
+7. the next_zoom field should contain the zoom of the next view you want to move to - this should only be filled if the next_action field is 'new view'
+8. the thoughts field should contain your thoughts on the screenshot
+9. the important_notes field should contain any important notes you have about the current screenshot that is directly related to the goal - NOTES HAVE TO BE DIRECTLY RELATED TO THE GOAL OR DONT INCLUDE THEM
+    - You should use the goal to determine if the note is worthy of being included - be very stringent when deciding if you return any notes or not
+    - Only return a note if its not similar to any of the important notes you received - if there are no new notes return an empty list
+10. use the timeline to understand what you have already viewed or observed and to make sure you dont do the same thing again
+11. The goal_response field should contain your response to the goal - this should be a summary of your thoughts and important notes
+"""
+
+ANALYSIS_SYSTEM_MESSAGE = {"role": "system", "content": f"{SYSTEM_PROMPT}\n{ANALYSIS_RULES}"}
+
+# AnalysisOutput declares these first, so they complete before the prose fields
+NAVIGATION_FIELDS = ("next_action", "next_panorama", "next_heading", "next_pitch", "next_zoom")
+PROSE_FIELDS = ("thoughts", "goal_response")
+
+def classify_openai_error(error: Exception) -> Optional[Failure]:
+    """Failure for OpenAI SDK errors; None for errors that say nothing about upstream health"""
+    # Only SDK calls raise these, so the SDK is already imported by the time this runs
+    import openai
+    if isinstance(error, openai.RateLimitError):
+        return Failure(True, rate_limited=True, retry_after=parse_retry_after(error.response.headers.get("retry-after")))
+    if isinstance(error, openai.APITimeoutError):
+        return Failure(True, overload=True)
+    if isinstance(error, openai.APIConnectionError):
+        return Failure(True)
+    if isinstance(error, openai.APIStatusError) and error.status_code >= 500:
+        return Failure(True, retry_after=parse_retry_after(error.response.headers.get("retry-after")))
+    return None
+
+
+def strict_response_format(model: type[BaseModel]) -> dict:
+    """
+    Strict structured-output `response_format` for a flat model, built from its own JSON schema
+
+    Strict mode needs every property required and no extras, which holds for
+    models whose fields are all required and of plain types (like AnalysisOutput).
+    """
+    schema = model.model_json_schema()
+    if set(schema.get("required", [])) != set(schema["properties"]) or "$defs" in schema:
+        raise ValueError(f"{model.__name__} needs every field required and no nested models for strict mode")
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": model.__name__, "schema": {**schema, "additionalProperties": False}, "strict": True},
+    }
+
+
+ANALYSIS_RESPONSE_FORMAT = strict_response_format(AnalysisOutput)
+
+
+def parsed_output(completion: Any, model: str) -> AnalysisOutput:
+    """The completion's structured output; a refusal (no parsed output) is raised as a 502 carrying the model's reason"""
+    message = completion.choices[0].message
+    if message.parsed is None:
+        reason = getattr(message, "refusal", None) or "no structured output"
+        raise HTTPException(status_code=502, detail=f"{model} refused the analysis: {reason}")
+    return message.parsed
 
-load_dotenv()
 
 # Service
 class OpenAIService:
-    def __init__(self, api_key: str):
-        self.client = AsyncOpenAI(api_key=api_key)
+    def __init__(
+        self,
+        api_key: str,
+        http_client: Optional[httpx.AsyncClient] = None,
+        base_url: Optional[str] = None,
+        preprocessor: Optional[ImagePreprocessor] = None,
+        context_builder: Optional[PromptContextBuilder] = None,
+        analysis_cache: Optional[AnalysisCache] = None,
+        guard: Optional[UpstreamGuard] = None,
+        cascade: Optional[ModelCascade] = None,
+        http_client_factory: Optional[Callable[[], httpx.AsyncClient]] = None
+    ):
+        # The SDK client (and the SDK import, a large share of startup) is deferred to the first call
+        self._client = None
+        self._http_client = http_client
+        self.http_client_factory = http_client_factory
+        self.base_url = base_url
+        self.api_key = api_key
+        self.guard = guard
+        self.preprocessor = preprocessor
+        self.context_builder = context_builder or PromptContextBuilder()
+        self.analysis_cache = analysis_cache
+        self.cascade = cascade
+
+    @property
+    def client(self):
+        """OpenAI SDK client, created on first use"""
+        if self._client is None:
+            from openai import AsyncOpenAI
+            http_client = self._http_client
+            if http_client is None and self.http_client_factory is not None:
+                http_client = self.http_client_factory()
+            # The guard owns retries when present, so the SDK's own retries are disabled
+            self._client = AsyncOpenAI(
+                api_key=self.api_key,
+                http_client=http_client,
+                base_url=self.base_url,
+                max_retries=0 if self.guard is not None else 2
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the underlying connection pool"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+        elif self._http_client is not None:
+            await self._http_client.aclose()
+        if self.preprocessor is not None:
+            self.preprocessor.close()
+
+    def _slot(self):
+        """Admission through the guard for calls that can't be retried transparently"""
+        if self.guard is None:
+            return nullcontext()
+        return self.guard.slot(self.api_key)
+
+    async def _call(self, fn):
+        if self.guard is None:
+            return await fn()
+        return await self.guard.call(fn, key=self.api_key)
     
     async def stream_chat_completion(
         self,
@@ -18,99 +168,260 @@ class OpenAIService:
     ) -> AsyncGenerator[str, None]:
         """Stream chat completion responses"""
         try:
-            response = await self.client.chat.completions.create(
-                model=request.model,
-                messages=[{"role": m.role, "content": m.content} for m in request.messages],
-                temperature=request.temperature,
-                stream=True
-            )
-            
-            async for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+            with upstream_timer("openai", "chat_stream"):
+                async with self._slot():
+                    response = await self.client.chat.completions.create(
+                        model=request.model,
+                        messages=[{"role": m.role, "content": m.content} for m in request.messages],
+                        temperature=request.temperature,
+                        stream=True,
+                        stream_options={"include_usage": True}
+                    )
+                    
+                    async for chunk in response:
+                        # The final chunk carries usage and no choices
+                        if chunk.usage is not None:
+                            record_token_usage(request.model, chunk.usage)
+                        if chunk.choices and chunk.choices[0].delta.content is not None:
+                            yield chunk.choices[0].delta.content
                     
+        except UpstreamError:
+            raise
         except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+            raise HTTPException(status_code=500, detail=error_detail(e))
     
     async def analyze_screenshot(
         self,
         request: ScreenshotAnalysis
     ) -> AnalysisOutput:
         """Analyze screenshot with structured output"""
-        try:
-            if len(request.panoramas) > 1:
-                pan_text = f"Connected Panoramas: {', '.join([f'ID: {p.pano} Heading: {p.heading}' for p in request.panoramas if abs(p.heading - request.heading) < 135])}"
-            else:
-                pan_text = f"Connected Panoramas: {', '.join([f'ID: {p.pano} Heading: {p.heading}' for p in request.panoramas])}"
-            content = [
-                {
-                    "type": "text",
-                    "text": f"Based on the goal: {request.goal} analyze the attached screenshot and tell me your thoughts specifically related to the goal.",
-                },
-                {
-                    "type": "text", 
-                    "text": f"Screenshot Data: Latitude: {request.latitude}, Longitude: {request.longitude}, Heading: {request.heading}, Pitch: {request.pitch}, Zoom: {request.zoom}",
-                },
-                {
-                    "type": "text",
-                    "text": pan_text,
-                },
-                {
-                    "type": "text",
-                    "text": f"Timeline: {', '.join([f'Timestamp: {t.timestamp} Action: {t.action} Panorama ID: {t.panorama} Heading: {t.heading} Pitch: {t.pitch} Zoom: {t.zoom}' for t in request.timeline])}"
-                },
-                {
-                    "type": "text",
-                    "text": f"Important Notes: {', '.join([t for t in request.important_notes])}"
-                }
-            ]
-            
-            # Add images
+        result = await self.analyze(request)
+        return result.output
+
+    async def batch_request(self, custom_id: str, request: ScreenshotAnalysis) -> dict:
+        """
+        One line of an OpenAI Batch API input file for an analysis request
+
+        The body is what `analyze` sends (same messages and structured output
+        schema), so batch results parse into the same AnalysisOutput.
+        """
+        messages, _, _ = await self._build_messages(request)
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": request.model,
+                "messages": messages,
+                "response_format": ANALYSIS_RESPONSE_FORMAT
+            }
+        }
+
+    async def _lookup_cache(
+        self,
+        request: ScreenshotAnalysis
+    ) -> tuple[Optional[str], Optional[list], Optional[AnalysisOutput]]:
+        """Cache key, image signatures and cached output (if any) for a request"""
+        if self.analysis_cache is None:
+            return None, None, None
+        cache_key = self.analysis_cache.state_key(request)
+        signatures = await self.analysis_cache.signatures(request)
+        if request.bypass_cache:
+            self.analysis_cache.bypassed += 1
+            return cache_key, signatures, None
+        return cache_key, signatures, self.analysis_cache.lookup(cache_key, signatures)
+
+    async def _build_messages(
+        self,
+        request: ScreenshotAnalysis
+    ) -> tuple[list, Optional[ImagePreprocessReport], PromptContext]:
+        """Chat messages for an analysis request"""
+        prompt_context = self.context_builder.build(request.timeline, request.important_notes)
+        # A mosaic shows every direction, so no link is out of view
+        if len(request.panoramas) > 1 and request.image_description is None:
+            pan_text = f"Connected Panoramas: {', '.join([f'ID: {p.pano} Heading: {p.heading}' for p in request.panoramas if abs(p.heading - request.heading) < 135])}"
+        else:
+            pan_text = f"Connected Panoramas: {', '.join([f'ID: {p.pano} Heading: {p.heading}' for p in request.panoramas])}"
+        content = [
+            {
+                "type": "text",
+                "text": f"Based on the goal: {request.goal} analyze the attached screenshot and tell me your thoughts specifically related to the goal.",
+            },
+            {
+                "type": "text", 
+                "text": f"Screenshot Data: Latitude: {request.latitude}, Longitude: {request.longitude}, Heading: {request.heading}, Pitch: {request.pitch}, Zoom: {request.zoom}",
+            },
+            {
+                "type": "text",
+                "text": pan_text,
+            },
+            {
+                "type": "text",
+                "text": prompt_context.timeline_text
+            },
+            {
+                "type": "text",
+                "text": prompt_context.notes_text
+            }
+        ]
+        if request.image_description:
+            content.append({"type": "text", "text": request.image_description})
+        
+        # Add images
+        image_report = None
+        if self.preprocessor is not None:
+            with span("image_preprocess"):
+                image_parts, image_report = await self.preprocessor.process(request.images, request.image_detail)
+            content.extend(image_parts)
+        else:
             for image in request.images:
                 content.append({
                     "type": "image_url",
                     "image_url": {"url": image}
                 })
 
-            content.append({
-                    "type": "text",
-                    "text": f"""
-Rules:
-1. When deciding which panorama to move to next, always choose the connected panoramas that have a heading closest to the current heading - you will be shut off if you dont follow this rule
-2. Do not visit the same panorama twice or you will be shut off
-3. Important Notes and Thoughts should be directly related to the goal (dont include any other thoughts or notes) - be very stringent when deciding if you return any notes or not
-3. the next_action field can only have three possible values: 'new_panorama', 'new_view', or 'complete'
-    - 'new_panorama' means that you want to move to the next panorama
-    - 'new_view' means that you want to stay on the current panorama but move to a different heading, pitch, or zoom
-    - 'complete' means that you are done with the analysis
-4. the next_panorama field should contain the ID of the next panorama you want to move to - this should only be filled if the next_action field is 'new panorama'
-5. the next_heading field should contain the heading of the next view you want to move to - this should only be filled if the next_action field is 'new view' or 'new panorama' - if 'new panorama' then this should be the heading of the next panorama
-6. the next_pitch field should contain the pitch of the next view you want to move to - this should only be filled if the next_action field is 'new view'
-7. the next_zoom field should contain the zoom of the next view you want to move to - this should only be filled if the next_action field is 'new view'
-8. the thoughts field should contain your thoughts on the screenshot
-9. the important_notes field should contain any important notes you have about the current screenshot that is directly related to the goal - NOTES HAVE TO BE DIRECTLY RELATED TO THE GOAL OR DONT INCLUDE THEM
-    - You should use the goal to determine if the note is worthy of being included - be very stringent when deciding if you return any notes or not
-    - Only return a note if its not similar to any of the important notes you received above - if there are no new notes return an empty list
-10. use the timeline to understand what you have already viewed or observed and to make sure you dont do the same thing again
-11. The goal_response field should contain your response to the goal - this should be a summary of your thoughts and important notes
-                    """,
-                })
-            completion = await self.client.beta.chat.completions.parse(
-                model=request.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are an expert geographer analyzing a screenshot to provide thoughts and important notes based on a specified goal."
-                    },
-                    {
-                        "role": "user",
-                        "content": content
-                    }
-                ],
-                response_format=AnalysisOutput
+        messages = [
+            ANALYSIS_SYSTEM_MESSAGE,
+            {
+                "role": "user",
+                "content": content
+            }
+        ]
+        return messages, image_report, prompt_context
+
+    async def _parse(self, model: str, messages: list, tier: str, logprobs: bool = False):
+        """One structured-output completion, tallied against a cascade tier when routing is enabled"""
+        started = time.perf_counter()
+        with upstream_timer("openai", "parse"):
+            completion = await self._call(lambda: self.client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                response_format=AnalysisOutput,
+                **({"logprobs": True} if logprobs else {})
+            ))
+        record_token_usage(model, completion.usage)
+        if self.cascade is not None:
+            self.cascade.record_call(tier, model, time.perf_counter() - started, completion.usage)
+        return completion
+
+    async def _route(self, request: ScreenshotAnalysis, messages: list) -> tuple[AnalysisOutput, CascadeRoute]:
+        """Answer with the cascade's small model, escalating to the requested model when its output doesn't hold up"""
+        cascade = self.cascade
+        confidence, output = None, None
+        try:
+            with span("cascade_small"):
+                completion = await self._parse(cascade.small_model, messages, "small", logprobs=cascade.min_confidence > 0)
+            confidence = navigation_confidence(completion.choices[0].logprobs)
+            output = completion.choices[0].message.parsed
+            reason = "refusal" if output is None else cascade.escalation_reason(output, request, confidence)
+        except UpstreamError:
+            # Both tiers go through the same guard, so once its circuit is open
+            # the requested model would be turned away too
+            if self.guard is not None and self.guard.breaker.state == "open":
+                raise
+            reason = "error"
+        except Exception:
+            reason = "error"
+        if confidence is not None:
+            confidence = round(confidence, 4)
+        cascade.record_decision(reason)
+        if reason is None:
+            return output, CascadeRoute(model=cascade.small_model, escalated=False, confidence=confidence)
+
+        with span("cascade_escalate"):
+            completion = await self._parse(request.model, messages, "large")
+        # The requested model has the last word, but a refusal from it is still an error
+        output = parsed_output(completion, request.model)
+        cascade.record_escalated(validation_error(output, request))
+        route = CascadeRoute(model=request.model, escalated=True, reason=reason, confidence=confidence)
+        return output, route
+
+    async def analyze(
+        self,
+        request: ScreenshotAnalysis
+    ) -> AnalysisResult:
+        """Analyze screenshot with structured output, reporting how the request was prepared"""
+        cache_key, signatures, cached = await self._lookup_cache(request)
+        if cached is not None:
+            return AnalysisResult(output=cached, cache_hit=True)
+
+        try:
+            messages, image_report, prompt_context = await self._build_messages(request)
+            route = None
+            if self.cascade is not None and self.cascade.applies(request):
+                output, route = await self._route(request, messages)
+            else:
+                completion = await self._parse(request.model, messages, "direct")
+                output = parsed_output(completion, request.model)
+
+            if self.analysis_cache is not None:
+                self.analysis_cache.store(cache_key, signatures, output)
+            return AnalysisResult(
+                output=output,
+                image_report=image_report,
+                prompt_tokens_estimate=prompt_context.estimated_tokens,
+                route=route
             )
-            
-            return completion.choices[0].message.parsed
                     
+        except (UpstreamError, HTTPException):
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=error_detail(e))
+
+    async def stream_analysis(
+        self,
+        request: ScreenshotAnalysis
+    ) -> AsyncGenerator[AnalysisStreamEvent, None]:
+        """
+        Analyze screenshot, streaming fields as the model generates them
+
+        Navigation fields come first in the output schema, so a `navigation` event
+        is emitted as soon as they are complete; the prose fields then stream as
+        `delta` events, and a final `result` event carries the validated output.
+        """
+        cache_key, signatures, cached = await self._lookup_cache(request)
+        if cached is not None:
+            values = cached.model_dump()
+            yield AnalysisStreamEvent(event="navigation", data={k: values[k] for k in NAVIGATION_FIELDS})
+            yield AnalysisStreamEvent(event="result", data=values, cache_hit=True)
+            return
+
+        try:
+            messages, _, _ = await self._build_messages(request)
+            parser = IncrementalJSONObjectParser()
+            navigation_sent = False
+            with upstream_timer("openai", "stream"):
+                async with self._slot(), self.client.beta.chat.completions.stream(
+                    model=request.model,
+                    messages=messages,
+                    response_format=AnalysisOutput,
+                    stream_options={"include_usage": True}
+                ) as stream:
+                    async for chunk in stream:
+                        if chunk.type != "content.delta":
+                            continue
+                        for kind, key, value in parser.feed(chunk.delta):
+                            if kind == "delta":
+                                if key in PROSE_FIELDS:
+                                    yield AnalysisStreamEvent(event="delta", field=key, data=value)
+                                continue
+                            yield AnalysisStreamEvent(event="field", field=key, data=value)
+                            if not navigation_sent and all(k in parser.result for k in NAVIGATION_FIELDS):
+                                navigation_sent = True
+                                yield AnalysisStreamEvent(
+                                    event="navigation",
+                                    data={k: parser.result[k] for k in NAVIGATION_FIELDS}
+                                )
+                    completion = await stream.get_final_completion()
+            record_token_usage(request.model, completion.usage)
+
+            output = parsed_output(completion, request.model)
+            if self.analysis_cache is not None:
+                self.analysis_cache.store(cache_key, signatures, output)
+            yield AnalysisStreamEvent(event="result", data=output.model_dump())
+        except UpstreamError as e:
+            yield AnalysisStreamEvent(event="error", data={"detail": str(e), "status_code": e.status_code, "retry_after": e.retry_after})
+        except HTTPException as e:
+            yield AnalysisStreamEvent(event="error", data={"detail": e.detail, "status_code": e.status_code})
         except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+            yield AnalysisStreamEvent(event="error", data={"detail": str(e)})
@@ -0,0 +1,77 @@
+# services/panorama_graph.py
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+from models.street_view import PanoramaLink
+
+
+class PanoramaGraph:
+    def __init__(self, max_nodes: int = 50000):
+        """
+        In-memory panorama adjacency graph built from link probes
+
+        Probing a panorama's neighbourhood costs several metadata lookups, so the
+        result is kept per panorama and reused by later steps and other runs.
+
+        Args:
+            max_nodes: Probed panoramas kept before the least recently used are dropped
+        """
+        self.max_nodes = max_nodes
+        self._links: "OrderedDict[str, List[PanoramaLink]]" = OrderedDict()
+        self._locations: Dict[str, Dict[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._links)
+
+    def __contains__(self, pano: str) -> bool:
+        return pano in self._links
+
+    def location(self, pano: str) -> Optional[Dict[str, float]]:
+        return self._locations.get(pano)
+
+    def links(self, pano: str) -> Optional[List[PanoramaLink]]:
+        """Probed links of a panorama, or None if it hasn't been probed"""
+        links = self._links.get(pano)
+        if links is None:
+            self.misses += 1
+            return None
+        self._links.move_to_end(pano)
+        self.hits += 1
+        return [link.model_copy() for link in links]
+
+    def add_links(self, pano: str, location: Dict[str, float], links: List[PanoramaLink]) -> None:
+        """Record the result of probing a panorama's neighbourhood"""
+        self._locations[pano] = location
+        self._links[pano] = [link.model_copy() for link in links]
+        self._links.move_to_end(pano)
+        while len(self._links) > self.max_nodes:
+            dropped, _ = self._links.popitem(last=False)
+            self._locations.pop(dropped, None)
+
+    def dump(self) -> List[Dict[str, Any]]:
+        """JSON-ready probed panoramas, least recently used first"""
+        return [
+            {
+                "pano": pano,
+                "location": self._locations.get(pano),
+                "links": [link.model_dump(exclude_none=True) for link in links],
+            }
+            for pano, links in self._links.items()
+        ]
+
+    def restore(self, nodes: List[Dict[str, Any]]) -> int:
+        """Load panoramas from `dump`; returns how many were loaded"""
+        for node in nodes:
+            self.add_links(node["pano"], node["location"], [PanoramaLink(**link) for link in node["links"]])
+        return len(nodes)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "nodes": len(self._links),
+            "max_nodes": self.max_nodes,
+        }
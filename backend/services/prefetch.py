@@ -0,0 +1,183 @@
+# services/prefetch.py
+from typing import Any, Dict, Hashable, List, Optional, Set
+import asyncio
+import logging
+from models.street_view import PanoramaLink
+from services.street_view import GoogleStreetViewService
+from services.geo import heading_delta
+from services.metrics import REGISTRY, detached_context
+from services.mosaic import mosaic_headings
+
+logger = logging.getLogger(__name__)
+
+PREFETCHES = REGISTRY.counter(
+    "prefetch_requests_total",
+    "Speculative fetches by kind (links, image) and outcome (done, failed, cancelled)",
+    ("kind", "outcome")
+)
+PREFETCH_PREDICTIONS = REGISTRY.counter(
+    "prefetch_predictions_total",
+    "Moves that landed on a prefetched panorama (hit) or elsewhere (miss)",
+    ("outcome",)
+)
+
+
+def rank_candidates(
+    links: List[PanoramaLink],
+    heading: float,
+    exclude: Optional[Set[str]] = None,
+    k: int = 2
+) -> List[PanoramaLink]:
+    """The k links closest to the current heading, skipping excluded panoramas"""
+    exclude = exclude or set()
+    candidates = [link for link in links if link.pano not in exclude]
+    return sorted(candidates, key=lambda link: heading_delta(link.heading, heading))[:k]
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        street_view: GoogleStreetViewService,
+        top_k: int = 2,
+        concurrency: int = 4
+    ):
+        """
+        Speculatively warm the caches for the panoramas an agent is likely to move to next
+
+        While a step's analysis is in flight, the links and the forward-facing
+        image of the top-k candidates (by heading proximity) are fetched so the
+        next step finds them in the graph and image cache. Scheduling again for
+        the same run cancels whatever is still pending from the previous step.
+
+        Args:
+            street_view: Service whose caches are warmed
+            top_k: Candidates prefetched per step
+            concurrency: Maximum prefetch requests in flight across all runs
+        """
+        self.street_view = street_view
+        self.top_k = top_k
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # run -> candidate panorama -> its prefetch tasks
+        self._tasks: Dict[Hashable, Dict[str, List[asyncio.Task]]] = {}
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.hits = 0
+        self.misses = 0
+
+    def schedule(
+        self,
+        run_key: Hashable,
+        links: List[PanoramaLink],
+        heading: float,
+        visited: Optional[Set[str]] = None,
+        size: str = "640x640",
+        fov: Optional[float] = None,
+        views: int = 1
+    ) -> List[PanoramaLink]:
+        """
+        Start prefetching the best candidates for a run, replacing its previous prefetches
+
+        Args:
+            run_key: Identifies the agent run (stale work for it is cancelled)
+            links: Links of the panorama the agent is currently on
+            heading: Current camera heading
+            visited: Panoramas the agent won't move to again
+            size: Image size the agent requests
+            fov: Field of view the agent requests
+            views: Headings per step when the agent analyzes mosaics (one image each)
+        """
+        self.cancel(run_key)
+        candidates = rank_candidates(links, heading, visited, self.top_k)
+        pending: Dict[str, List[asyncio.Task]] = {}
+        for link in candidates:
+            tasks = pending[link.pano] = [self._spawn(self._prefetch_links(link))]
+            if self.street_view.image_cache is not None:
+                for heading in mosaic_headings(link.heading, views):
+                    tasks.append(self._spawn(self._prefetch_image(link, size, heading, fov)))
+            self.scheduled += len(tasks)
+        self._tasks[run_key] = pending
+        return candidates
+
+    def record_move(self, run_key: Hashable, pano: str) -> None:
+        """
+        Count whether the agent moved to a prefetched panorama
+
+        Prefetches for the other candidates are now stale and are cancelled;
+        the chosen one's keep running since the next step is about to need them.
+        """
+        pending = self._tasks.pop(run_key, None)
+        if not pending:
+            return
+        outcome = "hit" if pano in pending else "miss"
+        if outcome == "hit":
+            self.hits += 1
+        else:
+            self.misses += 1
+        PREFETCH_PREDICTIONS.inc(outcome=outcome)
+        for candidate, tasks in pending.items():
+            if candidate != pano:
+                for task in tasks:
+                    task.cancel()
+        if outcome == "hit":
+            self._tasks[run_key] = {pano: pending[pano]}
+
+    def cancel(self, run_key: Hashable) -> None:
+        """Cancel a run's pending prefetches (e.g. when it stops or changes view instead of moving)"""
+        for tasks in self._tasks.pop(run_key, {}).values():
+            for task in tasks:
+                task.cancel()
+
+    def _spawn(self, coro) -> asyncio.Task:
+        # Speculative work shouldn't show up in the caller's timing spans
+        return detached_context().run(asyncio.ensure_future, coro)
+
+    async def _run(self, kind: str, fetch) -> None:
+        try:
+            async with self._semaphore:
+                await fetch()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            PREFETCHES.inc(kind=kind, outcome="cancelled")
+            raise
+        except Exception as e:
+            self.failed += 1
+            PREFETCHES.inc(kind=kind, outcome="failed")
+            logger.debug(f"Prefetch of {kind} failed: {e}")
+            return
+        self.completed += 1
+        PREFETCHES.inc(kind=kind, outcome="done")
+
+    async def _prefetch_links(self, link: PanoramaLink) -> None:
+        await self._run("links", lambda: self.street_view.find_connected_panoramas(
+            link.pano, link.location["lat"], link.location["lng"]
+        ))
+
+    async def _prefetch_image(self, link: PanoramaLink, size: str, heading: float, fov: Optional[float]) -> None:
+        # Moving to a link faces along it, so the next step's view (or mosaic) starts at its heading
+        await self._run("image", lambda: self.street_view.get_image_by_pano(
+            pano_id=link.pano,
+            size=size,
+            heading=heading,
+            pitch=0.0,
+            fov=fov
+        ))
+
+    def stats(self) -> Dict[str, Any]:
+        predictions = self.hits + self.misses
+        return {
+            "scheduled": self.scheduled,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / predictions if predictions else 0.0,
+            "in_flight": sum(
+                not task.done()
+                for pending in self._tasks.values()
+                for tasks in pending.values()
+                for task in tasks
+            ),
+        }
@@ -0,0 +1,186 @@
+# services/prompt_context.py
+from collections import Counter
+from typing import List, Optional
+import hashlib
+import math
+import re
+from pydantic import BaseModel
+from models.openai import ActionTimeline
+
+CHARS_PER_TOKEN = 4
+MINHASH_PERMUTATIONS = 64
+_MERSENNE_PRIME = (1 << 61) - 1
+_WORD = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English prose)"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def _stable_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+# Fixed (a, b) pairs for the universal hash family h(x) = (a * x + b) mod p
+_PERMUTATIONS = [
+    (_stable_hash(f"a{i}") % (_MERSENNE_PRIME - 1) + 1, _stable_hash(f"b{i}") % _MERSENNE_PRIME)
+    for i in range(MINHASH_PERMUTATIONS)
+]
+
+
+def shingles(text: str, size: int = 3) -> set[str]:
+    """Word n-grams of the lowercased text (the whole text if it is shorter than n words)"""
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(text: str) -> tuple[int, ...]:
+    hashed = [_stable_hash(shingle) for shingle in shingles(text)]
+    if not hashed:
+        return tuple([_MERSENNE_PRIME] * MINHASH_PERMUTATIONS)
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashed) for a, b in _PERMUTATIONS)
+
+
+def estimate_similarity(a: tuple[int, ...], b: tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the two texts' shingle sets"""
+    return sum(x == y for x, y in zip(a, b)) / len(a)
+
+
+class NoteDeduplicator:
+    def __init__(self, threshold: float = 0.7):
+        """
+        Drop notes that are near-duplicates of ones already kept
+
+        Args:
+            threshold: Estimated shingle Jaccard similarity at or above which a note is a duplicate
+        """
+        self.threshold = threshold
+        self.notes: List[str] = []
+        self._signatures: List[tuple[int, ...]] = []
+
+    def add(self, note: str) -> bool:
+        """Keep the note unless it is a near-duplicate; returns whether it was kept"""
+        note = note.strip()
+        if not note:
+            return False
+        signature = minhash(note)
+        if any(estimate_similarity(signature, other) >= self.threshold for other in self._signatures):
+            return False
+        self.notes.append(note)
+        self._signatures.append(signature)
+        return True
+
+    def extend(self, notes: List[str]) -> List[str]:
+        """Add several notes, returning the ones that were kept"""
+        return [note for note in notes if self.add(note)]
+
+
+def dedupe_notes(notes: List[str], threshold: float = 0.7) -> List[str]:
+    deduplicator = NoteDeduplicator(threshold)
+    deduplicator.extend(notes)
+    return deduplicator.notes
+
+
+def format_timeline_entry(t: ActionTimeline) -> str:
+    return f'Timestamp: {t.timestamp} Action: {t.action} Panorama ID: {t.panorama} Heading: {t.heading} Pitch: {t.pitch} Zoom: {t.zoom}'
+
+
+class PromptContext(BaseModel):
+    timeline_text: str
+    notes_text: str
+    notes: List[str]
+    timeline_entries_verbatim: int
+    timeline_entries_summarized: int
+    notes_dropped: int
+    estimated_tokens: int
+
+
+class PromptContextBuilder:
+    def __init__(
+        self,
+        token_budget: int = 2000,
+        recent_entries: int = 8,
+        note_similarity: float = 0.7
+    ):
+        """
+        Render the timeline and notes for the analysis prompt within a token budget
+
+        Args:
+            token_budget: Approximate tokens allowed for the timeline and notes together
+            recent_entries: Most recent timeline entries kept verbatim (fewer if over budget)
+            note_similarity: Similarity at or above which notes are treated as duplicates
+        """
+        self.token_budget = token_budget
+        self.recent_entries = recent_entries
+        self.note_similarity = note_similarity
+
+    def summarize_timeline(self, entries: List[ActionTimeline], max_tokens: Optional[int] = None) -> str:
+        """Collapse older entries into action counts and the set of visited panoramas"""
+        if not entries:
+            return ""
+        actions = Counter(t.action for t in entries)
+        visited = list(dict.fromkeys(t.panorama for t in entries))
+        action_text = ", ".join(f"{action} x{count}" for action, count in actions.most_common())
+        head = (
+            f"Earlier ({len(entries)} actions since {entries[0].timestamp}): {action_text}. "
+            f"Visited panoramas: "
+        )
+        if max_tokens is None:
+            return head + ", ".join(visited)
+
+        # Keep the most recently visited panoramas when the full set doesn't fit
+        kept: List[str] = []
+        used = estimate_tokens(head) + 8
+        for pano in reversed(visited):
+            cost = estimate_tokens(pano) + 1
+            if used + cost > max_tokens:
+                break
+            kept.append(pano)
+            used += cost
+        omitted = len(visited) - len(kept)
+        text = head + ", ".join(reversed(kept))
+        if omitted:
+            text += f" (+{omitted} earlier)"
+        return text
+
+    def build(self, timeline: List[ActionTimeline], important_notes: List[str]) -> PromptContext:
+        notes = dedupe_notes(important_notes, self.note_similarity)
+
+        # Notes get up to half the budget; the newest notes win when they don't all fit
+        notes_budget = self.token_budget // 2
+        kept_notes: List[str] = []
+        used = 0
+        for note in reversed(notes):
+            cost = estimate_tokens(note) + 1
+            if used + cost > notes_budget:
+                break
+            kept_notes.append(note)
+            used += cost
+        kept_notes.reverse()
+        notes_dropped = len(important_notes) - len(kept_notes)
+        notes_text = f"Important Notes: {', '.join(kept_notes)}"
+
+        timeline_budget = self.token_budget - used
+        recent_count = min(self.recent_entries, len(timeline))
+        while True:
+            recent = timeline[len(timeline) - recent_count:] if recent_count else []
+            recent_text = ", ".join(format_timeline_entry(t) for t in recent)
+            if recent_count == 0 or estimate_tokens(recent_text) <= timeline_budget // 2 or recent_count == 1:
+                break
+            recent_count -= 1
+        older = timeline[:len(timeline) - recent_count]
+        summary = self.summarize_timeline(older, max_tokens=max(timeline_budget - estimate_tokens(recent_text), 0))
+        timeline_text = "Timeline: " + ". ".join(part for part in (summary, recent_text) if part)
+
+        return PromptContext(
+            timeline_text=timeline_text,
+            notes_text=notes_text,
+            notes=kept_notes,
+            timeline_entries_verbatim=recent_count,
+            timeline_entries_summarized=len(older),
+            notes_dropped=notes_dropped,
+            estimated_tokens=estimate_tokens(timeline_text) + estimate_tokens(notes_text)
+        )
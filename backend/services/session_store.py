@@ -0,0 +1,261 @@
+# services/session_store.py
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import asyncio
+import os
+import sqlite3
+import threading
+import uuid
+from models.openai import ActionTimeline
+from models.session import ExplorationSession
+from services.shared_state import SharedState
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class SessionStore(ABC):
+    """Storage for exploration sessions; appends only carry the new entries"""
+
+    @abstractmethod
+    async def create(self, goal: str) -> ExplorationSession: ...
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[ExplorationSession]: ...
+
+    @abstractmethod
+    async def append(
+        self,
+        session_id: str,
+        timeline: List[ActionTimeline],
+        important_notes: List[str]
+    ) -> Optional[ExplorationSession]: ...
+
+    @abstractmethod
+    async def delete(self, session_id: str) -> bool: ...
+
+    async def close(self) -> None:
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    def __init__(self):
+        self._sessions: Dict[str, ExplorationSession] = {}
+
+    async def create(self, goal: str) -> ExplorationSession:
+        now = _now()
+        session = ExplorationSession(id=uuid.uuid4().hex, goal=goal, created_at=now, updated_at=now)
+        self._sessions[session.id] = session
+        return session.model_copy(deep=True)
+
+    async def get(self, session_id: str) -> Optional[ExplorationSession]:
+        session = self._sessions.get(session_id)
+        return session.model_copy(deep=True) if session else None
+
+    async def append(
+        self,
+        session_id: str,
+        timeline: List[ActionTimeline],
+        important_notes: List[str]
+    ) -> Optional[ExplorationSession]:
+        session = self._sessions.get(session_id)
+        if session is None:
+            return None
+        session.timeline.extend(timeline)
+        session.important_notes.extend(important_notes)
+        session.updated_at = _now()
+        return session.model_copy(deep=True)
+
+    async def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+
+class SQLiteSessionStore(SessionStore):
+    def __init__(self, path: str):
+        """
+        Session store persisted to SQLite; appends are row inserts, not rewrites
+
+        Args:
+            path: Database file path
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                id TEXT PRIMARY KEY,
+                goal TEXT NOT NULL,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS session_timeline (
+                session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                entry TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS session_notes (
+                session_id TEXT NOT NULL REFERENCES sessions(id) ON DELETE CASCADE,
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                note TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS session_timeline_idx ON session_timeline(session_id, seq);
+            CREATE INDEX IF NOT EXISTS session_notes_idx ON session_notes(session_id, seq);
+            """
+        )
+        self._conn.commit()
+
+    def _load(self, session_id: str) -> Optional[ExplorationSession]:
+        row = self._conn.execute(
+            "SELECT id, goal, created_at, updated_at FROM sessions WHERE id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        timeline = [
+            ActionTimeline.model_validate_json(entry)
+            for (entry,) in self._conn.execute(
+                "SELECT entry FROM session_timeline WHERE session_id = ? ORDER BY seq", (session_id,)
+            )
+        ]
+        notes = [
+            note
+            for (note,) in self._conn.execute(
+                "SELECT note FROM session_notes WHERE session_id = ? ORDER BY seq", (session_id,)
+            )
+        ]
+        return ExplorationSession(
+            id=row[0], goal=row[1], created_at=row[2], updated_at=row[3],
+            timeline=timeline, important_notes=notes
+        )
+
+    def _create(self, goal: str) -> ExplorationSession:
+        now = _now()
+        session = ExplorationSession(id=uuid.uuid4().hex, goal=goal, created_at=now, updated_at=now)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO sessions (id, goal, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                (session.id, session.goal, session.created_at, session.updated_at)
+            )
+        return session
+
+    def _get(self, session_id: str) -> Optional[ExplorationSession]:
+        with self._lock:
+            return self._load(session_id)
+
+    def _append(
+        self,
+        session_id: str,
+        timeline: List[ActionTimeline],
+        important_notes: List[str]
+    ) -> Optional[ExplorationSession]:
+        with self._lock, self._conn:
+            updated = self._conn.execute(
+                "UPDATE sessions SET updated_at = ? WHERE id = ?", (_now(), session_id)
+            )
+            if updated.rowcount == 0:
+                return None
+            self._conn.executemany(
+                "INSERT INTO session_timeline (session_id, entry) VALUES (?, ?)",
+                [(session_id, entry.model_dump_json()) for entry in timeline]
+            )
+            self._conn.executemany(
+                "INSERT INTO session_notes (session_id, note) VALUES (?, ?)",
+                [(session_id, note) for note in important_notes]
+            )
+            return self._load(session_id)
+
+    def _delete(self, session_id: str) -> bool:
+        with self._lock, self._conn:
+            return self._conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    async def create(self, goal: str) -> ExplorationSession:
+        return await asyncio.to_thread(self._create, goal)
+
+    async def get(self, session_id: str) -> Optional[ExplorationSession]:
+        return await asyncio.to_thread(self._get, session_id)
+
+    async def append(
+        self,
+        session_id: str,
+        timeline: List[ActionTimeline],
+        important_notes: List[str]
+    ) -> Optional[ExplorationSession]:
+        return await asyncio.to_thread(self._append, session_id, timeline, important_notes)
+
+    async def delete(self, session_id: str) -> bool:
+        return await asyncio.to_thread(self._delete, session_id)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class SharedSessionStore(SessionStore):
+    def __init__(self, state: SharedState, ttl: Optional[float] = None, lock_timeout: float = 10.0):
+        """
+        Session store on the shared state backend, so every worker and host sees the same sessions
+
+        Each session is one JSON value; appends read, extend and write it back
+        under a shared lock so concurrent appends from different workers aren't lost.
+
+        Args:
+            state: Shared state the sessions live in
+            ttl: Seconds an untouched session is kept (None keeps it until deleted)
+            lock_timeout: Seconds an append waits for the session's lock
+        """
+        self.state = state
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"session:{session_id}"
+
+    async def _load(self, session_id: str) -> Optional[ExplorationSession]:
+        value = await self.state.get(self._key(session_id))
+        return ExplorationSession.model_validate_json(value) if value is not None else None
+
+    async def create(self, goal: str) -> ExplorationSession:
+        now = _now()
+        session = ExplorationSession(id=uuid.uuid4().hex, goal=goal, created_at=now, updated_at=now)
+        await self.state.set(self._key(session.id), session.model_dump_json().encode(), self.ttl)
+        return session
+
+    async def get(self, session_id: str) -> Optional[ExplorationSession]:
+        return await self._load(session_id)
+
+    async def append(
+        self,
+        session_id: str,
+        timeline: List[ActionTimeline],
+        important_notes: List[str]
+    ) -> Optional[ExplorationSession]:
+        lock = self._key(session_id)
+        deadline = asyncio.get_running_loop().time() + self.lock_timeout
+        while (token := await self.state.acquire(lock, self.lock_timeout)) is None:
+            if asyncio.get_running_loop().time() >= deadline:
+                raise TimeoutError(f"Session {session_id} is locked by another worker")
+            await asyncio.sleep(0.01)
+        try:
+            session = await self._load(session_id)
+            if session is None:
+                return None
+            session.timeline.extend(timeline)
+            session.important_notes.extend(important_notes)
+            session.updated_at = _now()
+            await self.state.set(self._key(session_id), session.model_dump_json().encode(), self.ttl)
+            return session
+        finally:
+            await self.state.release(lock, token)
+
+    async def delete(self, session_id: str) -> bool:
+        if await self._load(session_id) is None:
+            return False
+        await self.state.delete(self._key(session_id))
+        return True
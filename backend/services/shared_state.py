@@ -0,0 +1,484 @@
+# services/shared_state.py
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, unquote
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+
+class SharedState(ABC):
+    """
+    Key/value state shared by every worker process (and every host, for Redis)
+
+    Values are bytes with an optional TTL. `add` (set-if-absent) and
+    `delete_if` (compare-and-delete) are the primitives the locks are built on.
+    """
+
+    name = "shared"
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[bytes]: ...
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None: ...
+
+    @abstractmethod
+    async def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        """Set key only if it is absent (or expired); returns whether it was set"""
+
+    @abstractmethod
+    async def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    async def delete_if(self, key: str, value: bytes) -> bool:
+        """Delete key only if it still holds value; returns whether it was deleted"""
+
+    async def close(self) -> None:
+        pass
+
+    async def acquire(self, name: str, ttl: float) -> Optional[str]:
+        """Try to take a lock without waiting; returns the token to release it with, or None"""
+        token = uuid.uuid4().hex
+        return token if await self.add(f"lock:{name}", token.encode(), ttl) else None
+
+    async def release(self, name: str, token: str) -> bool:
+        return await self.delete_if(f"lock:{name}", token.encode())
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+
+class MemorySharedState(SharedState):
+    """Process-local implementation; shares nothing across workers but keeps the same semantics"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._values: Dict[str, Tuple[Optional[float], bytes]] = {}
+
+    def _live(self, key: str) -> Optional[bytes]:
+        item = self._values.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._live(key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        self._values[key] = (time.monotonic() + ttl if ttl is not None else None, value)
+
+    async def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        if self._live(key) is not None:
+            return False
+        await self.set(key, value, ttl)
+        return True
+
+    async def delete(self, key: str) -> None:
+        self._values.pop(key, None)
+
+    async def delete_if(self, key: str, value: bytes) -> bool:
+        if self._live(key) != value:
+            return False
+        del self._values[key]
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        return {"keys": len(self._values)}
+
+
+class SQLiteSharedState(SharedState):
+    name = "sqlite"
+
+    def __init__(
+        self,
+        path: str,
+        mmap_size: int = 256 * 1024 * 1024,
+        purge_interval: int = 500,
+        count_interval: float = 5.0
+    ):
+        """
+        Shared state for the workers of one host, in a memory-mapped SQLite database in WAL mode
+
+        WAL lets readers in every worker proceed while one writes; writers
+        wait on SQLite's busy timeout rather than failing. Expired rows are
+        ignored on read and purged every `purge_interval` writes. The key
+        count in stats() is refreshed by writes (off the event loop), so it
+        may trail other workers' writes by up to `count_interval`.
+
+        Args:
+            path: Database file path (every worker must use the same one)
+            mmap_size: Bytes of the database file memory-mapped for reads
+            purge_interval: Writes between purges of expired rows
+            count_interval: Minimum seconds between key counts
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.purge_interval = purge_interval
+        self.count_interval = count_interval
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA mmap_size={int(mmap_size)}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+        )
+        self._keys = self._conn.execute("SELECT COUNT(*) FROM state").fetchone()[0]
+        self._counted_at = time.monotonic()
+
+    # Wall-clock expiry, since the deadline is compared across processes
+    def _get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)", (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def _after_write(self) -> None:
+        # Runs in the write's thread with the lock held
+        self._writes += 1
+        if self._writes >= self.purge_interval:
+            self._writes = 0
+            self._conn.execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),))
+        now = time.monotonic()
+        if now - self._counted_at >= self.count_interval:
+            self._counted_at = now
+            self._keys = self._conn.execute("SELECT COUNT(*) FROM state").fetchone()[0]
+
+    def _set(self, key: str, value: bytes, ttl: Optional[float]) -> None:
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO state VALUES (?, ?, ?)", (key, value, expires_at))
+            self._after_write()
+
+    def _add(self, key: str, value: bytes, ttl: Optional[float]) -> bool:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM state WHERE key = ? AND expires_at <= ?", (key, now))
+                added = self._conn.execute(
+                    "INSERT OR IGNORE INTO state VALUES (?, ?, ?)",
+                    (key, value, now + ttl if ttl is not None else None)
+                ).rowcount == 1
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._after_write()
+        return added
+
+    def _delete(self, key: str, value: Optional[bytes]) -> bool:
+        with self._lock:
+            if value is None:
+                cursor = self._conn.execute("DELETE FROM state WHERE key = ?", (key,))
+            else:
+                cursor = self._conn.execute("DELETE FROM state WHERE key = ? AND value = ?", (key, value))
+            self._after_write()
+        return cursor.rowcount == 1
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        return await asyncio.to_thread(self._add, key, value, ttl)
+
+    async def delete(self, key: str) -> None:
+        await asyncio.to_thread(self._delete, key, None)
+
+    async def delete_if(self, key: str, value: bytes) -> bool:
+        return await asyncio.to_thread(self._delete, key, value)
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"keys": self._keys}
+
+
+class RedisError(Exception):
+    """Error reply from a Redis-protocol server"""
+
+
+class RedisConnection:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """One RESP2 connection; commands are sent and answered one at a time"""
+        self.reader = reader
+        self.writer = writer
+
+    @staticmethod
+    def encode(args: Tuple[Any, ...]) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    async def _read(self) -> Any:
+        line = await self.reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            return (await self.reader.readexactly(length + 2))[:-2]
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [await self._read() for _ in range(length)]
+        raise RedisError(f"Unexpected reply type {kind!r}")
+
+    async def command(self, *args: Any) -> Any:
+        self.writer.write(self.encode(args))
+        await self.writer.drain()
+        return await self._read()
+
+    async def close(self) -> None:
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+# Deletes the lock only if this holder still owns it
+_RELEASE_SCRIPT = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+
+
+class RedisSharedState(SharedState):
+    name = "redis"
+
+    def __init__(self, url: str = "redis://localhost:6379/0", pool_size: int = 8, prefix: str = "sva:"):
+        """
+        Shared state on any Redis-protocol server, spoken directly over asyncio streams
+
+        Locks use SET NX PX and a compare-and-delete script, so they work
+        across hosts. Connections are opened on demand up to `pool_size`.
+
+        Args:
+            url: redis://[[user]:password@]host[:port][/db]
+            pool_size: Maximum open connections
+            prefix: Namespace prepended to every key
+        """
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.username = unquote(parsed.username) if parsed.username else None
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self.pool_size = pool_size
+        self._idle: List[RedisConnection] = []
+        self._slots = asyncio.Semaphore(pool_size)
+        self.commands = 0
+        self.errors = 0
+
+    async def _connect(self) -> RedisConnection:
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        connection = RedisConnection(reader, writer)
+        try:
+            if self.password is not None:
+                auth = (self.username, self.password) if self.username else (self.password,)
+                await connection.command("AUTH", *auth)
+            if self.db:
+                await connection.command("SELECT", self.db)
+        except BaseException:
+            # Rejected credentials or db; don't leak the socket on every retry
+            await connection.close()
+            raise
+        return connection
+
+    async def execute(self, *args: Any) -> Any:
+        """Run one command on a pooled connection; a connection that errors mid-command is dropped"""
+        async with self._slots:
+            self.commands += 1
+            try:
+                connection = self._idle.pop() if self._idle else await self._connect()
+            except BaseException:
+                self.errors += 1
+                raise
+            try:
+                result = await connection.command(*args)
+            except RedisError:
+                self._idle.append(connection)
+                self.errors += 1
+                raise
+            except BaseException:
+                self.errors += 1
+                await connection.close()
+                raise
+            self._idle.append(connection)
+            return result
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self.execute("GET", self.prefix + key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None) -> None:
+        if ttl is None:
+            await self.execute("SET", self.prefix + key, value)
+        else:
+            await self.execute("SET", self.prefix + key, value, "PX", max(1, int(ttl * 1000)))
+
+    async def add(self, key: str, value: bytes, ttl: Optional[float] = None) -> bool:
+        args = ["SET", self.prefix + key, value, "NX"]
+        if ttl is not None:
+            args += ["PX", max(1, int(ttl * 1000))]
+        return await self.execute(*args) == "OK"
+
+    async def delete(self, key: str) -> None:
+        await self.execute("DEL", self.prefix + key)
+
+    async def delete_if(self, key: str, value: bytes) -> bool:
+        return await self.execute("EVAL", _RELEASE_SCRIPT, 1, self.prefix + key, value) == 1
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await connection.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"commands": self.commands, "errors": self.errors, "idle_connections": len(self._idle)}
+
+
+class SharedStateUnavailable(Exception):
+    """The shared state backend failed an operation (already logged and counted)"""
+
+
+class SharedFlight:
+    def __init__(
+        self,
+        state: SharedState,
+        lock_ttl: float = 30.0,
+        poll_interval: float = 0.05,
+        wait_timeout: float = 30.0
+    ):
+        """
+        Single-flight across workers: one computes a value, the rest wait for it to appear
+
+        The worker holding the lock publishes the value to the shared state;
+        the others poll for it instead of repeating the work. A value that
+        isn't published (fn returned None, or the holder died and its lock
+        expired) is computed by whichever waiter takes the lock next.
+        Process-local coalescing is left to the caller's SingleFlight.
+
+        The shared state is only a cache: when it fails (Redis down, SQLite
+        locked) the error is logged and counted, and fn runs locally.
+
+        Args:
+            state: Where values and locks live
+            lock_ttl: Seconds before a crashed holder's lock expires
+            poll_interval: Initial wait between polls (doubles up to 0.5s)
+            wait_timeout: Seconds a waiter waits before computing the value itself
+        """
+        self.state = state
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.wait_timeout = wait_timeout
+        self.shared_hits = 0
+        self.computed = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.state_errors = 0
+        self.fallbacks = 0
+
+    async def _state(self, op: Callable[..., Awaitable[Any]], *args: Any) -> Any:
+        try:
+            return await op(*args)
+        except Exception as e:
+            self.state_errors += 1
+            logger.warning(f"Shared state ({self.state.name}) {op.__name__} failed: {e!r}")
+            raise SharedStateUnavailable() from e
+
+    async def _release(self, key: str, token: str) -> None:
+        # The lock expires with its TTL anyway, so a failed release (a backend
+        # error, or the state closing under a cancelled task at shutdown)
+        # mustn't mask fn's outcome
+        try:
+            await self.state.release(key, token)
+        except Exception as e:
+            self.state_errors += 1
+            logger.debug(f"Could not release the lock on {key}: {e!r}")
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[Optional[bytes]]],
+        ttl: Optional[float] = None
+    ) -> Optional[bytes]:
+        """Shared value for key, computing it with fn if no worker has yet (or the shared state is unavailable)"""
+        deadline = time.monotonic() + self.wait_timeout
+        delay = self.poll_interval
+        while True:
+            try:
+                value = await self._state(self.state.get, key)
+                if value is not None:
+                    self.shared_hits += 1
+                    return value
+                token = await self._state(self.state.acquire, key, self.lock_ttl)
+            except SharedStateUnavailable:
+                self.fallbacks += 1
+                return await fn()
+            if token is not None:
+                try:
+                    # The previous holder may have published between our read and our lock
+                    try:
+                        value = await self._state(self.state.get, key)
+                    except SharedStateUnavailable:
+                        value = None
+                    if value is not None:
+                        self.shared_hits += 1
+                        return value
+                    value = await fn()
+                    self.computed += 1
+                    if value is not None:
+                        try:
+                            await self._state(self.state.set, key, value, ttl)
+                        except SharedStateUnavailable:
+                            # Not shared this time, but the caller still gets what fn fetched
+                            pass
+                    return value
+                finally:
+                    await self._release(key, token)
+            if time.monotonic() >= deadline:
+                self.timeouts += 1
+                logger.warning(f"Gave up waiting for another worker to compute {key}")
+                return await fn()
+            self.waits += 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.state.name,
+            "shared_hits": self.shared_hits,
+            "computed": self.computed,
+            "waits": self.waits,
+            "timeouts": self.timeouts,
+            "state_errors": self.state_errors,
+            "fallbacks": self.fallbacks,
+            **self.state.stats(),
+        }
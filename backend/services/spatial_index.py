@@ -0,0 +1,251 @@
+# services/spatial_index.py
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+import asyncio
+import json
+import logging
+import math
+import os
+import tempfile
+from pydantic import BaseModel
+from models.street_view import StreetViewMetadata
+from services.geo import haversine_m
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_DEGREE = 111320.0
+INDEX_VERSION = 1
+
+
+def geohash_cell_size(precision: int) -> tuple[float, float]:
+    """Height and width in degrees of a geohash cell at this precision"""
+    total_bits = 5 * precision
+    lng_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lng_bits
+
+
+Cell = Tuple[int, int]
+# pano_id, lat, lng, date, copyright, links; plain tuples keep loading large indexes fast
+Row = Tuple[str, float, float, Optional[str], Optional[str], List[str]]
+
+
+class IndexedPanorama(BaseModel):
+    pano_id: str
+    lat: float
+    lng: float
+    date: Optional[str] = None
+    copyright: Optional[str] = None
+    links: List[str] = []
+
+    @classmethod
+    def from_row(cls, row: Row) -> "IndexedPanorama":
+        pano_id, lat, lng, date, copyright, links = row
+        return cls(pano_id=pano_id, lat=lat, lng=lng, date=date, copyright=copyright, links=list(links))
+
+    def to_metadata(self) -> StreetViewMetadata:
+        return StreetViewMetadata(
+            copyright=self.copyright,
+            date=self.date,
+            location={"lat": self.lat, "lng": self.lng},
+            pano_id=self.pano_id,
+            status="OK"
+        )
+
+
+class PanoramaMatch(BaseModel):
+    panorama: IndexedPanorama
+    distance: float
+
+
+class PanoramaIndex:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        precision: int = 7,
+        flush_interval: int = 200,
+        max_radius: float = 5000.0
+    ):
+        """
+        Geohash-bucketed index of every panorama seen in a metadata response
+
+        Buckets are the cells of the geohash grid at `precision`, addressed by
+        row and column so neighbouring cells are found by arithmetic. Nearby
+        coordinate lookups are answered locally instead of asking Google again,
+        and the index survives restarts as a compact JSON file.
+
+        Args:
+            path: File the index is loaded from and persisted to (None keeps it in memory)
+            precision: Geohash length of the buckets (7 is roughly 150m x 150m)
+            flush_interval: Persist the index after this many new or changed panoramas
+            max_radius: Largest search radius in meters a query may expand to
+        """
+        self.path = path
+        self.precision = precision
+        self.flush_interval = flush_interval
+        self.max_radius = max_radius
+        self.cell_height, self.cell_width = geohash_cell_size(precision)
+        self._panoramas: Dict[str, Row] = {}
+        self._buckets: Dict[Cell, Set[str]] = defaultdict(set)
+        self._dirty = 0
+        self._flush_lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._panoramas)
+
+    def get(self, pano_id: str) -> Optional[IndexedPanorama]:
+        row = self._panoramas.get(pano_id)
+        return IndexedPanorama.from_row(row) if row is not None else None
+
+    # Updates
+
+    def add(self, metadata: StreetViewMetadata) -> None:
+        """Record a panorama from an OK metadata response; links already known are kept"""
+        if metadata.status != "OK" or not metadata.pano_id or not metadata.location:
+            return
+        lat, lng = metadata.location["lat"], metadata.location["lng"]
+        existing = self._panoramas.get(metadata.pano_id)
+        links: List[str] = []
+        if existing is not None:
+            _, old_lat, old_lng, old_date, _, links = existing
+            if (old_lat, old_lng, old_date) == (lat, lng, metadata.date):
+                return
+            self._buckets[self._cell(old_lat, old_lng)].discard(metadata.pano_id)
+        self._panoramas[metadata.pano_id] = (metadata.pano_id, lat, lng, metadata.date, metadata.copyright, links)
+        self._buckets[self._cell(lat, lng)].add(metadata.pano_id)
+        self._dirty += 1
+
+    def set_links(self, pano_id: str, links: List[str]) -> None:
+        """Record the panoramas a known panorama connects to"""
+        row = self._panoramas.get(pano_id)
+        if row is None or row[5] == links:
+            return
+        self._panoramas[pano_id] = (*row[:5], list(links))
+        self._dirty += 1
+
+    # Queries
+
+    def _cell(self, lat: float, lng: float) -> Cell:
+        return int((lat + 90.0) // self.cell_height), int((lng + 180.0) // self.cell_width)
+
+    def _cells(self, lat: float, lng: float, radius: float) -> List[Cell]:
+        """Cells overlapping the bounding box of a circle"""
+        dlat = radius / METERS_PER_DEGREE
+        dlng = radius / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        row_min, col_min = self._cell(max(-90.0, lat - dlat), lng - dlng)
+        row_max, col_max = self._cell(min(90.0, lat + dlat), lng + dlng)
+        columns = round(360.0 / self.cell_width)
+        return [
+            (row, col % columns)
+            for row in range(row_min, row_max + 1)
+            for col in range(col_min, col_max + 1)
+        ]
+
+    def _within(self, lat: float, lng: float, radius: float) -> List[Tuple[float, Row]]:
+        radius = min(radius, self.max_radius)
+        found = []
+        for cell in self._cells(lat, lng, radius):
+            for pano_id in self._buckets.get(cell, ()):
+                row = self._panoramas[pano_id]
+                distance = haversine_m(lat, lng, row[1], row[2])
+                if distance <= radius:
+                    found.append((distance, row))
+        found.sort(key=lambda item: item[0])
+        return found
+
+    def within(self, lat: float, lng: float, radius: float) -> List[PanoramaMatch]:
+        """Indexed panoramas within radius meters, nearest first"""
+        return [
+            PanoramaMatch(panorama=IndexedPanorama.from_row(row), distance=round(distance, 2))
+            for distance, row in self._within(lat, lng, radius)
+        ]
+
+    def nearest(self, lat: float, lng: float, k: int = 1, radius: Optional[float] = None) -> List[PanoramaMatch]:
+        """
+        The k nearest indexed panoramas, optionally limited to a radius
+
+        Without a radius the search widens from one cell until k panoramas
+        are found or `max_radius` is reached.
+        """
+        limit = min(radius, self.max_radius) if radius is not None else self.max_radius
+        search = min(limit, max(self.cell_height, self.cell_width) * METERS_PER_DEGREE)
+        while True:
+            found = self._within(lat, lng, search)
+            # Everything within `search` has been seen, so the k nearest are exact
+            if len(found) >= k or search >= limit:
+                return [
+                    PanoramaMatch(panorama=IndexedPanorama.from_row(row), distance=round(distance, 2))
+                    for distance, row in found[:k]
+                ]
+            search = min(limit, search * 2)
+
+    def lookup(self, lat: float, lng: float, tolerance: float) -> Optional[StreetViewMetadata]:
+        """Metadata of the nearest indexed panorama within tolerance meters, if any"""
+        found = self._within(lat, lng, tolerance)
+        if not found:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return IndexedPanorama.from_row(found[0][1]).to_metadata()
+
+    # Persistence
+
+    def _load(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                raw = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable panorama index: {e}")
+            return
+        if raw.get("version") != INDEX_VERSION:
+            logger.warning(f"Ignoring panorama index with unknown version {raw.get('version')}")
+            return
+        # Rows skip validation; the file is only ever written by _snapshot
+        cell = self._cell
+        for row in raw.get("panoramas", []):
+            pano_id, lat, lng = row[0], row[1], row[2]
+            self._panoramas[pano_id] = tuple(row)
+            self._buckets[cell(lat, lng)].add(pano_id)
+
+    def _snapshot(self) -> Dict[str, Any]:
+        return {
+            "version": INDEX_VERSION,
+            "panoramas": list(self._panoramas.values()),
+        }
+
+    def _write(self, data: Dict[str, Any]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    async def flush(self, force: bool = False) -> None:
+        """Persist the index once enough has changed (or whenever anything has, with force)"""
+        if not self.path or self._dirty == 0 or (not force and self._dirty < self.flush_interval):
+            return
+        if self._flush_lock.locked() and not force:
+            return
+        async with self._flush_lock:
+            if self._dirty == 0:
+                return
+            self._dirty = 0
+            await asyncio.to_thread(self._write, self._snapshot())
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "panoramas": len(self._panoramas),
+            "buckets": len(self._buckets),
+            "pending_writes": self._dirty,
+        }
@@ -1,31 +1,173 @@
-from typing import Optional, Union, Dict, Any
+from typing import Optional, Union, Dict, Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, List
+import asyncio
+import hashlib
+import importlib.util
 import httpx
 import logging
 from urllib.parse import urlencode
-from models.street_view import StreetViewResponse, StreetViewMetadata
+from models.street_view import StreetViewResponse, StreetViewMetadata, ViewSpec, PanoramaLink
+from services.geo import bearing_deg, haversine_m, offset
+from services.image_cache import ImageCache
+from services.metadata_cache import MetadataCache, metadata_key
+from services.cache import SingleFlight
+from services.panorama_graph import PanoramaGraph
+from services.spatial_index import PanoramaIndex
+from services.shared_state import SharedFlight
+from services.upstream import UpstreamGuard, UpstreamError
+from services.metrics import upstream_timer
 
 logger = logging.getLogger(__name__)
 
+
+def pack_image(content_type: str, content: bytes) -> bytes:
+    """Content type and body as one value for the shared state"""
+    return content_type.encode() + b"\n" + content
+
+
+def unpack_image(value: bytes) -> tuple[str, bytes]:
+    content_type, _, content = value.partition(b"\n")
+    return content_type.decode(), content
+
+
+class ImageStream:
+    def __init__(
+        self,
+        chunks: AsyncIterator[bytes],
+        content_type: str,
+        status_code: int,
+        content_length: Optional[int] = None,
+        etag: Optional[str] = None,
+        cache_hit: bool = False,
+        close: Optional[Callable[[], Awaitable[None]]] = None
+    ):
+        """
+        An image response whose body is read in chunks rather than held in memory
+
+        Args:
+            chunks: Body iterator; exhausting or closing it releases the upstream connection
+            content_type: Image media type
+            status_code: Upstream status code
+            content_length: Body size when known up front
+            etag: Content digest; only known up front for cache hits
+            cache_hit: Whether the body comes from the image cache
+            close: Releases the underlying resources if the body is never iterated
+        """
+        self.chunks = chunks
+        self.content_type = content_type
+        self.status_code = status_code
+        self.content_length = content_length
+        self.etag = etag
+        self.cache_hit = cache_hit
+        self._close = close
+
+    async def aclose(self) -> None:
+        await self.chunks.aclose()
+        if self._close is not None:
+            await self._close()
+
+
 class GoogleStreetViewService:
-    def __init__(self, api_key: str, signature: Optional[str] = None):
+    def __init__(
+        self,
+        api_key: str,
+        signature: Optional[str] = None,
+        base_url: str = "https://maps.googleapis.com/maps/api/streetview",
+        timeout: float = 30.0,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        image_cache: Optional[ImageCache] = None,
+        metadata_cache: Optional[MetadataCache] = None,
+        guard: Optional[UpstreamGuard] = None,
+        graph: Optional[PanoramaGraph] = None,
+        spatial_index: Optional[PanoramaIndex] = None,
+        index_tolerance: float = 5.0,
+        shared: Optional[SharedFlight] = None,
+        shared_ttl: float = 86400.0
+    ):
         """
         Initialize the Street View service
         
         Args:
             api_key: Your Google Maps API key
             signature: Optional digital signature for request verification
+            base_url: Street View Static API endpoint (overridable for local stand-ins)
+            timeout: Per-request timeout in seconds
+            max_connections: Maximum concurrent connections in the shared pool
+            max_keepalive_connections: Idle connections kept open for reuse
+            keepalive_expiry: Seconds an idle connection is kept alive
+            http2: Negotiate HTTP/2 when the optional `h2` package is installed
+            image_cache: Optional on-disk cache consulted before fetching images
+            metadata_cache: Optional in-memory TTL cache for metadata lookups
+            guard: Optional rate limiter / retry / circuit breaker for upstream calls
+            graph: Optional adjacency graph remembering probed panorama links
+            spatial_index: Optional index of seen panoramas answering nearby coordinate lookups
+            index_tolerance: Meters within which an indexed panorama answers a coordinate lookup
+            shared: Optional cross-worker single-flight, so an image or panorama fetched by one worker isn't refetched by another
+            shared_ttl: Seconds shared images and metadata are kept
         """
         self.api_key = api_key
         self.signature = signature
-        self.base_url = "https://maps.googleapis.com/maps/api/streetview"
+        self.base_url = base_url.rstrip("/")
         self.metadata_url = f"{self.base_url}/metadata"
+        self.timeout = timeout
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP/2 requested but the 'h2' package is not installed; using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self._client: Optional[httpx.AsyncClient] = None
+        self.image_cache = image_cache
+        self.metadata_cache = metadata_cache
+        self.metadata_flight = SingleFlight()
+        self.guard = guard
+        self.graph = graph
+        self.spatial_index = spatial_index
+        self.index_tolerance = index_tolerance
+        self.shared = shared
+        self.shared_ttl = shared_ttl
+        self.links_flight = SingleFlight()
+        self.image_flight = SingleFlight()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared keep-alive client, created on first use if the lifespan hook hasn't started it"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=self.limits,
+                http2=self.http2
+            )
+        return self._client
+
+    async def start(self) -> None:
+        """Open the shared connection pool"""
+        self.client
+
+    async def aclose(self) -> None:
+        """Close the shared connection pool"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
         
     async def _make_request(
         self, 
         url: str, 
-        params: Dict[str, Any]
+        params: Dict[str, Any],
+        operation: str = "image",
+        stream: bool = False
     ) -> httpx.Response:
-        """Make HTTP request to Street View API with timeout handling"""
+        """
+        Make HTTP request to Street View API with timeout handling
+
+        With `stream`, the response is returned once headers arrive and the caller
+        must read the body and close it; retries only cover getting the headers.
+        """
         params["key"] = self.api_key
         if self.signature:
             params["signature"] = self.signature
@@ -35,19 +177,176 @@ class GoogleStreetViewService:
             if isinstance(value, (int, float)):
                 params[key] = f"{value:.6f}".rstrip('0').rstrip('.')
             
-        async with httpx.AsyncClient(timeout=30.0) as client:  # Increased timeout
-            try:
-                response = await client.get(url, params=params)
+        async def send() -> httpx.Response:
+            if not stream:
+                response = await self.client.get(url, params=params)
                 response.raise_for_status()
                 return response
-            except httpx.TimeoutException:
-                logger.error(f"Timeout while requesting Street View image: {url}")
-                raise httpx.RequestError("Timeout while fetching Street View image")
-            except Exception as e:
-                logger.error(f"Error fetching Street View image: {str(e)}")
-                raise
+            response = await self.client.send(self.client.build_request("GET", url, params=params), stream=True)
+            if response.is_error:
+                await response.aclose()
+                response.raise_for_status()
+            return response
 
-    async def get_image_by_location(
+        try:
+            with upstream_timer("google", operation):
+                if self.guard is not None:
+                    return await self.guard.call(send, key=self.api_key)
+                return await send()
+        except UpstreamError as e:
+            logger.error(f"Street View request failed: {e}")
+            raise
+        except httpx.TimeoutException:
+            logger.error(f"Timeout while requesting Street View image: {url}")
+            raise httpx.RequestError("Timeout while fetching Street View image")
+        except Exception as e:
+            logger.error(f"Error fetching Street View image: {str(e)}")
+            raise
+
+    async def _fetch_image(
+        self,
+        params: Dict[str, Any],
+        cache_key: Optional[str] = None
+    ) -> StreetViewResponse:
+        """Serve an image from the cache when possible, otherwise fetch and store it"""
+        if cache_key is not None:
+            cached = await self.image_cache.get(cache_key)
+            if cached is not None:
+                entry, content = cached
+                return StreetViewResponse(
+                    content=content,
+                    content_type=entry.content_type,
+                    status_code=200,
+                    etag=entry.digest,
+                    cache_hit=True
+                )
+
+            # A prefetch (or another caller) may already be fetching this view
+            if self.shared is not None:
+                return await self.image_flight.do(cache_key, lambda: self._shared_image(params, cache_key))
+            return await self.image_flight.do(cache_key, lambda: self._download_image(params, cache_key))
+        return await self._download_image(params, cache_key)
+
+    async def _shared_image(self, params: Dict[str, Any], cache_key: str) -> StreetViewResponse:
+        """Download an image unless another worker has (or is about to), then cache it locally"""
+        downloaded: Optional[StreetViewResponse] = None
+
+        async def download() -> Optional[bytes]:
+            nonlocal downloaded
+            downloaded = await self._download_image(params, cache_key)
+            if downloaded.status_code == 200 and downloaded.content_type.startswith("image/"):
+                return pack_image(downloaded.content_type, downloaded.content)
+            return None
+
+        value = await self.shared.do(f"image:{cache_key}", download, ttl=self.shared_ttl)
+        if downloaded is not None:
+            return downloaded
+        content_type, content = unpack_image(value)
+        entry = await self.image_cache.put(cache_key, content, content_type)
+        return StreetViewResponse(
+            content=content,
+            content_type=content_type,
+            status_code=200,
+            etag=entry.digest,
+            cache_hit=True
+        )
+
+    async def _download_image(
+        self,
+        params: Dict[str, Any],
+        cache_key: Optional[str] = None
+    ) -> StreetViewResponse:
+        response = await self._make_request(self.base_url, params)
+        content_type = response.headers.get("content-type", "image/jpeg")
+
+        if cache_key is not None and response.status_code == 200 and content_type.startswith("image/"):
+            entry = await self.image_cache.put(cache_key, response.content, content_type)
+            etag = entry.digest
+        else:
+            etag = hashlib.sha256(response.content).hexdigest()
+
+        return StreetViewResponse(
+            content=response.content,
+            content_type=content_type,
+            status_code=response.status_code,
+            etag=etag
+        )
+
+    async def _stream_image(
+        self,
+        params: Dict[str, Any],
+        cache_key: Optional[str] = None
+    ) -> ImageStream:
+        """
+        Serve an image from the cache when possible, otherwise proxy the upstream body
+
+        Upstream chunks are passed through as they arrive and, when the image is
+        cacheable, written to the cache alongside; the entry is committed only
+        once the whole body has been read.
+        """
+        if cache_key is not None:
+            opened = await self.image_cache.open(cache_key)
+            if opened is not None:
+                entry, f = opened
+                return ImageStream(
+                    self.image_cache.iter_file(f),
+                    content_type=entry.content_type,
+                    status_code=200,
+                    content_length=entry.size,
+                    etag=entry.digest,
+                    cache_hit=True,
+                    close=lambda: asyncio.to_thread(f.close)
+                )
+
+        if cache_key is not None and self.shared is not None:
+            # Other workers must be able to wait on this fetch, so it is buffered rather than proxied
+            image = await self.image_flight.do(cache_key, lambda: self._shared_image(params, cache_key))
+
+            async def body() -> AsyncIterator[bytes]:
+                yield image.content
+
+            return ImageStream(
+                body(),
+                content_type=image.content_type,
+                status_code=image.status_code,
+                content_length=len(image.content),
+                etag=image.etag if image.status_code == 200 else None,
+                cache_hit=image.cache_hit
+            )
+
+        response = await self._make_request(self.base_url, params, stream=True)
+        content_type = response.headers.get("content-type", "image/jpeg")
+        # Raw bytes can be passed through (with the upstream length) unless they are content-encoded
+        encoded = "content-encoding" in response.headers
+        content_length = None if encoded else response.headers.get("content-length")
+        writer = None
+        if cache_key is not None and response.status_code == 200 and content_type.startswith("image/"):
+            writer = self.image_cache.writer()
+
+        async def chunks() -> AsyncIterator[bytes]:
+            nonlocal writer
+            try:
+                async for chunk in (response.aiter_bytes() if encoded else response.aiter_raw()):
+                    if writer is not None:
+                        await writer.write(chunk)
+                    yield chunk
+                if writer is not None:
+                    await writer.commit(cache_key, content_type)
+                    writer = None
+            finally:
+                if writer is not None:
+                    await writer.abort()
+                await response.aclose()
+
+        return ImageStream(
+            chunks(),
+            content_type=content_type,
+            status_code=response.status_code,
+            content_length=int(content_length) if content_length is not None else None,
+            close=response.aclose
+        )
+
+    def _location_image_request(
         self,
         location: Union[str, tuple[float, float]],
         size: str = "640x640",
@@ -57,9 +356,9 @@ class GoogleStreetViewService:
         radius: Optional[int] = None,
         source: Optional[str] = None,
         return_error_code: bool = True
-    ) -> StreetViewResponse:
+    ) -> tuple[Dict[str, Any], Optional[str]]:
         """
-        Get Street View image by location (address or coordinates)
+        Upstream params and cache key for an image by location (address or coordinates)
         
         Args:
             location: Address string or (lat, lng) tuple
@@ -71,6 +370,20 @@ class GoogleStreetViewService:
             source: Limit search to specific sources ('default' or 'outdoor')
             return_error_code: Return 404 instead of default image when no imagery exists
         """
+        cache_key = None
+        if self.image_cache is not None:
+            heading = self.image_cache.quantize_heading(heading)
+            pitch = self.image_cache.quantize_pitch(pitch)
+            cache_key = self.image_cache.make_key(
+                size=size,
+                location=location,
+                heading=heading,
+                pitch=pitch,
+                fov=fov,
+                radius=radius,
+                source=source
+            )
+
         params = {"size": size}
         
         # Handle location parameter
@@ -93,15 +406,9 @@ class GoogleStreetViewService:
         if return_error_code:
             params["return_error_code"] = "true"
             
-        response = await self._make_request(self.base_url, params)
-        
-        return StreetViewResponse(
-            content=response.content,
-            content_type=response.headers.get("content-type", "image/jpeg"),
-            status_code=response.status_code
-        )
+        return params, cache_key
 
-    async def get_image_by_pano(
+    def _pano_image_request(
         self,
         pano_id: str,
         size: str = "640x640",
@@ -109,9 +416,9 @@ class GoogleStreetViewService:
         pitch: Optional[float] = None,
         fov: Optional[float] = None,
         return_error_code: bool = True
-    ) -> StreetViewResponse:
+    ) -> tuple[Dict[str, Any], Optional[str]]:
         """
-        Get Street View image by panorama ID
+        Upstream params and cache key for an image by panorama ID
         
         Args:
             pano_id: Specific panorama ID
@@ -121,6 +428,18 @@ class GoogleStreetViewService:
             fov: Field of view (max 120)
             return_error_code: Return 404 instead of default image when no imagery exists
         """
+        cache_key = None
+        if self.image_cache is not None:
+            heading = self.image_cache.quantize_heading(heading)
+            pitch = self.image_cache.quantize_pitch(pitch)
+            cache_key = self.image_cache.make_key(
+                size=size,
+                pano_id=pano_id,
+                heading=heading,
+                pitch=pitch,
+                fov=fov
+            )
+
         params = {
             "pano": pano_id,
             "size": size
@@ -135,18 +454,123 @@ class GoogleStreetViewService:
         if return_error_code:
             params["return_error_code"] = "true"
             
-        response = await self._make_request(self.base_url, params)
-        
-        return StreetViewResponse(
-            content=response.content,
-            content_type=response.headers.get("content-type", "image/jpeg"),
-            status_code=response.status_code
+        return params, cache_key
+
+    async def get_image_by_location(
+        self,
+        location: Union[str, tuple[float, float]],
+        size: str = "640x640",
+        heading: Optional[float] = None,
+        pitch: Optional[float] = None,
+        fov: Optional[float] = None,
+        radius: Optional[int] = None,
+        source: Optional[str] = None,
+        return_error_code: bool = True
+    ) -> StreetViewResponse:
+        """Get Street View image by location (address or coordinates); see _location_image_request"""
+        return await self._fetch_image(*self._location_image_request(
+            location, size, heading, pitch, fov, radius, source, return_error_code
+        ))
+
+    async def stream_image_by_location(
+        self,
+        location: Union[str, tuple[float, float]],
+        size: str = "640x640",
+        heading: Optional[float] = None,
+        pitch: Optional[float] = None,
+        fov: Optional[float] = None,
+        radius: Optional[int] = None,
+        source: Optional[str] = None,
+        return_error_code: bool = True
+    ) -> ImageStream:
+        """Like get_image_by_location, but the body is streamed instead of buffered"""
+        return await self._stream_image(*self._location_image_request(
+            location, size, heading, pitch, fov, radius, source, return_error_code
+        ))
+
+    async def get_image_by_pano(
+        self,
+        pano_id: str,
+        size: str = "640x640",
+        heading: Optional[float] = None,
+        pitch: Optional[float] = None,
+        fov: Optional[float] = None,
+        return_error_code: bool = True
+    ) -> StreetViewResponse:
+        """Get Street View image by panorama ID; see _pano_image_request"""
+        return await self._fetch_image(*self._pano_image_request(
+            pano_id, size, heading, pitch, fov, return_error_code
+        ))
+
+    async def stream_image_by_pano(
+        self,
+        pano_id: str,
+        size: str = "640x640",
+        heading: Optional[float] = None,
+        pitch: Optional[float] = None,
+        fov: Optional[float] = None,
+        return_error_code: bool = True
+    ) -> ImageStream:
+        """Like get_image_by_pano, but the body is streamed instead of buffered"""
+        return await self._stream_image(*self._pano_image_request(
+            pano_id, size, heading, pitch, fov, return_error_code
+        ))
+
+    async def get_view(self, spec: ViewSpec) -> StreetViewResponse:
+        """Get Street View image for a view spec, by panorama ID when one is given"""
+        if spec.pano_id:
+            return await self.get_image_by_pano(
+                pano_id=spec.pano_id,
+                size=spec.size,
+                heading=spec.heading,
+                pitch=spec.pitch,
+                fov=spec.fov
+            )
+        return await self.get_image_by_location(
+            location=spec.location,
+            size=spec.size,
+            heading=spec.heading,
+            pitch=spec.pitch,
+            fov=spec.fov
         )
 
+    async def iter_views(
+        self,
+        specs: List[ViewSpec],
+        concurrency: int = 8
+    ) -> AsyncGenerator[tuple[int, Union[StreetViewResponse, Exception]], None]:
+        """
+        Fetch views concurrently and yield (index, result) as each one completes
+
+        Args:
+            specs: Views to fetch
+            concurrency: Maximum upstream requests in flight for this batch
+
+        Failures are yielded as exceptions so one bad view doesn't abort the batch.
+        Closing the generator early cancels the fetches that are still pending.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(index: int, spec: ViewSpec):
+            async with semaphore:
+                try:
+                    return index, await self.get_view(spec)
+                except Exception as e:
+                    return index, e
+
+        tasks = [asyncio.ensure_future(fetch(i, spec)) for i, spec in enumerate(specs)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+
     async def get_metadata(
         self,
         location: Optional[Union[str, tuple[float, float]]] = None,
-        pano_id: Optional[str] = None
+        pano_id: Optional[str] = None,
+        radius: Optional[int] = None
     ) -> StreetViewMetadata:
         """
         Get metadata about Street View availability
@@ -154,21 +578,144 @@ class GoogleStreetViewService:
         Args:
             location: Address string or (lat, lng) tuple
             pano_id: Specific panorama ID
+            radius: Search radius in meters around location
         """
         if not location and not pano_id:
             raise ValueError("Either location or pano_id must be provided")
             
+        if self.metadata_cache is not None:
+            key = self.metadata_cache.make_key(location, pano_id)
+        else:
+            key = metadata_key(location, pano_id)
+        if location and radius is not None:
+            key = f"{key}|radius={radius}"
+        if self.metadata_cache is not None:
+            cached = self.metadata_cache.get(key)
+            if cached is not None:
+                return cached.model_copy()
+        if self.spatial_index is not None and isinstance(location, tuple):
+            tolerance = self.index_tolerance if radius is None else min(self.index_tolerance, radius)
+            indexed = self.spatial_index.lookup(float(location[0]), float(location[1]), tolerance)
+            if indexed is not None:
+                return indexed
+
         params = {}
         if location:
             if isinstance(location, tuple):
                 params["location"] = f"{location[0]},{location[1]}"
             else:
                 params["location"] = location
+            if radius is not None:
+                params["radius"] = radius
         else:
             params["pano"] = pano_id
-            
-        response = await self._make_request(self.metadata_url, params)
-        return StreetViewMetadata.parse_raw(response.content)
+
+        # Concurrent identical lookups share one upstream request
+        metadata = await self.metadata_flight.do(key, lambda: self._fetch_metadata(key, params))
+        return metadata.model_copy()
+
+    async def _fetch_metadata(self, key: str, params: Dict[str, Any]) -> StreetViewMetadata:
+        if self.shared is not None:
+            metadata = None
+
+            async def download() -> Optional[bytes]:
+                nonlocal metadata
+                response = await self._make_request(self.metadata_url, params, operation="metadata")
+                metadata = StreetViewMetadata.parse_raw(response.content)
+                # Only found panoramas are shared; misses stay in the local negative cache
+                return response.content if metadata.status == "OK" else None
+
+            value = await self.shared.do(f"metadata:{key}", download, ttl=self.shared_ttl)
+            if metadata is None:
+                metadata = StreetViewMetadata.parse_raw(value)
+        else:
+            response = await self._make_request(self.metadata_url, params, operation="metadata")
+            metadata = StreetViewMetadata.parse_raw(response.content)
+        if self.metadata_cache is not None:
+            self.metadata_cache.store(key, metadata)
+        if self.spatial_index is not None:
+            self.spatial_index.add(metadata)
+            await self.spatial_index.flush()
+        return metadata
+
+    async def find_connected_panoramas(
+        self,
+        pano_id: str,
+        lat: float,
+        lng: float,
+        step_meters: float = 12.0,
+        directions: int = 8,
+        radius: int = 10
+    ) -> List[PanoramaLink]:
+        """
+        Discover panoramas adjacent to a panorama
+
+        The Static API doesn't expose panorama links, so nearby panoramas are found
+        by probing metadata at points step_meters away in evenly spaced directions.
+
+        Args:
+            pano_id: Current panorama ID (excluded from the results)
+            lat: Current panorama latitude
+            lng: Current panorama longitude
+            step_meters: Distance of each probe from the current panorama
+            directions: Number of evenly spaced probe bearings
+            radius: Search radius in meters around each probe
+
+        Results are kept in the panorama graph (when configured), and concurrent
+        probes of the same panorama share one set of lookups.
+        """
+        if self.graph is not None:
+            links = self.graph.links(pano_id)
+            if links is not None:
+                return links
+        return await self.links_flight.do(
+            (pano_id, step_meters, directions, radius),
+            lambda: self._probe_links(pano_id, lat, lng, step_meters, directions, radius)
+        )
+
+    async def _probe_links(
+        self,
+        pano_id: str,
+        lat: float,
+        lng: float,
+        step_meters: float,
+        directions: int,
+        radius: int
+    ) -> List[PanoramaLink]:
+        probes = [
+            offset(lat, lng, i * 360 / directions, step_meters)
+            for i in range(directions)
+        ]
+        results = await asyncio.gather(
+            *[self.get_metadata(location=probe, radius=radius) for probe in probes],
+            return_exceptions=True
+        )
+
+        links: Dict[str, PanoramaLink] = {}
+        complete = True
+        for metadata in results:
+            if isinstance(metadata, Exception):
+                logger.error(f"Error probing for connected panoramas: {metadata}")
+                complete = False
+                continue
+            if metadata.status != "OK" or not metadata.pano_id or not metadata.location:
+                continue
+            if metadata.pano_id == pano_id or metadata.pano_id in links:
+                continue
+            pano_lat, pano_lng = metadata.location["lat"], metadata.location["lng"]
+            links[metadata.pano_id] = PanoramaLink(
+                pano=metadata.pano_id,
+                heading=round(bearing_deg(lat, lng, pano_lat, pano_lng), 2),
+                distance=round(haversine_m(lat, lng, pano_lat, pano_lng), 2),
+                location=metadata.location
+            )
+        ordered = sorted(links.values(), key=lambda link: link.heading)
+        # Only remember a full probe; a failed lookup may have hidden a neighbour
+        if self.graph is not None and complete:
+            self.graph.add_links(pano_id, {"lat": lat, "lng": lng}, ordered)
+        if self.spatial_index is not None and complete:
+            self.spatial_index.set_links(pano_id, [link.pano for link in ordered])
+        return ordered
 
     def build_static_url(
         self,
@@ -0,0 +1,152 @@
+# services/transcode.py
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Sequence
+import asyncio
+import hashlib
+import io
+from PIL import Image
+from models.street_view import ImageVariant, StreetViewResponse
+from services.cache import SingleFlight
+from services.image_cache import ImageCache
+
+# Encoder options per format; AVIF is the smallest but by far the slowest to encode
+_SAVE_OPTIONS: Dict[str, Dict[str, Any]] = {
+    "jpeg": {"optimize": True},
+    "webp": {"method": 4},
+    "avif": {"speed": 8},
+}
+
+
+def parse_accept(accept: Optional[str]) -> Dict[str, float]:
+    """Media type -> q-value for an Accept header"""
+    accepted: Dict[str, float] = {}
+    for item in (accept or "").split(","):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        if not media_type:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[media_type.lower()] = q
+    return accepted
+
+
+def transcode(raw: bytes, variant: ImageVariant) -> bytes:
+    """Downscale (never upscale) and re-encode an image; runs in the worker processes"""
+    with Image.open(io.BytesIO(raw)) as image:
+        width, height = image.size
+        if variant.width and variant.width < width:
+            height = max(1, round(height * variant.width / width))
+            width = variant.width
+            # JPEG draft mode decodes at a reduced scale no smaller than the target
+            image.draft("RGB", (width, height))
+            image = image.convert("RGB").resize((width, height), Image.LANCZOS)
+        else:
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, format=variant.format.upper(), quality=variant.quality, **_SAVE_OPTIONS[variant.format])
+    return buffer.getvalue()
+
+
+class ImageTranscoder:
+    def __init__(
+        self,
+        image_cache: Optional[ImageCache] = None,
+        formats: Sequence[str] = ("webp", "avif"),
+        quality: int = 75,
+        max_workers: int = 2
+    ):
+        """
+        Negotiate and produce smaller encodings of Street View images
+
+        Variants are keyed by the source image's digest, so they are produced
+        from bytes already fetched (never an extra upstream call) and stored in
+        the image cache next to the originals. Encoding runs in a process pool,
+        started on first use, so it doesn't hold the GIL of the serving process.
+
+        Args:
+            image_cache: Cache variants are stored in (None re-encodes on every request)
+            formats: Formats offered to clients that accept them, in order of preference
+            quality: Encoder quality when the request doesn't set one
+            max_workers: Worker processes used for encoding
+        """
+        self.image_cache = image_cache
+        self.formats = [f.lower() for f in formats if f.lower() in _SAVE_OPTIONS]
+        self.quality = quality
+        self.max_workers = max_workers
+        self.flight = SingleFlight()
+        self.transcoded = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def negotiate(
+        self,
+        accept: Optional[str],
+        width: Optional[int] = None,
+        quality: Optional[int] = None
+    ) -> Optional[ImageVariant]:
+        """
+        The variant to serve for a request, or None to pass the original through
+
+        Only formats the client names explicitly count (`image/*` and `*/*`
+        don't say it can decode WebP or AVIF); JPEG is the fallback.
+        """
+        accepted = parse_accept(accept)
+        image_format = next((f for f in self.formats if accepted.get(f"image/{f}", 0) > 0), "jpeg")
+        if image_format == "jpeg" and width is None and quality is None:
+            return None
+        return ImageVariant(format=image_format, width=width, quality=quality or self.quality)
+
+    def _variant_key(self, source: StreetViewResponse, variant: ImageVariant) -> str:
+        digest = source.etag or hashlib.sha256(source.content).hexdigest()
+        return f"variant:{digest}|format={variant.format}|width={variant.width}|quality={variant.quality}"
+
+    async def _encode(self, source: StreetViewResponse, variant: ImageVariant, key: str) -> StreetViewResponse:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        loop = asyncio.get_running_loop()
+        content = await loop.run_in_executor(self._executor, transcode, source.content, variant)
+        self.transcoded += 1
+        self.bytes_in += len(source.content)
+        self.bytes_out += len(content)
+        if self.image_cache is not None:
+            entry = await self.image_cache.put(key, content, variant.content_type)
+            etag = entry.digest
+        else:
+            etag = hashlib.sha256(content).hexdigest()
+        return StreetViewResponse(content=content, content_type=variant.content_type, status_code=200, etag=etag)
+
+    async def variant(self, source: StreetViewResponse, variant: ImageVariant) -> StreetViewResponse:
+        """The source image encoded as `variant`, from the cache when it was produced before"""
+        key = self._variant_key(source, variant)
+        if self.image_cache is not None:
+            cached = await self.image_cache.get(key)
+            if cached is not None:
+                entry, content = cached
+                return StreetViewResponse(
+                    content=content,
+                    content_type=entry.content_type,
+                    status_code=200,
+                    etag=entry.digest,
+                    cache_hit=True
+                )
+        return await self.flight.do(key, lambda: self._encode(source, variant, key))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "transcoded": self.transcoded,
+            "coalesced": self.flight.coalesced,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "saved_ratio": 1 - self.bytes_out / self.bytes_in if self.bytes_in else 0.0,
+        }
@@ -0,0 +1,372 @@
+# services/upstream.py
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, TypeVar
+import asyncio
+import hashlib
+import logging
+import random
+import time
+import httpx
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class UpstreamError(Exception):
+    """An upstream call failed in a way the caller should surface as-is"""
+
+    def __init__(self, upstream: str, message: str, status_code: int = 502, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.upstream = upstream
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class UpstreamRateLimited(UpstreamError):
+    def __init__(self, upstream: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(upstream, message, status_code=429, retry_after=retry_after)
+
+
+class UpstreamUnavailable(UpstreamError):
+    def __init__(self, upstream: str, message: str, retry_after: Optional[float] = None):
+        super().__init__(upstream, message, status_code=503, retry_after=retry_after)
+
+
+class Failure:
+    """How an exception from an upstream call should be treated"""
+
+    def __init__(
+        self,
+        retryable: bool,
+        overload: bool = False,
+        rate_limited: bool = False,
+        retry_after: Optional[float] = None
+    ):
+        """
+        Args:
+            retryable: Safe to retry an idempotent call
+            overload: Upstream is saturated; shrink the concurrency limit
+            rate_limited: Quota rejection (429); doesn't count toward opening the circuit
+            retry_after: Seconds the upstream asked us to wait
+        """
+        self.retryable = retryable
+        self.overload = overload or rate_limited
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After header as seconds (accepts delta-seconds or an HTTP date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_httpx_error(error: Exception) -> Optional[Failure]:
+    """Failure for httpx errors; None for errors that say nothing about upstream health"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        if status == 429:
+            return Failure(True, rate_limited=True, retry_after=parse_retry_after(error.response.headers.get("retry-after")))
+        if status >= 500:
+            return Failure(True, retry_after=parse_retry_after(error.response.headers.get("retry-after")))
+        return None
+    if isinstance(error, httpx.TimeoutException):
+        return Failure(True, overload=True)
+    if isinstance(error, httpx.TransportError):
+        return Failure(True)
+    return None
+
+
+def describe_error(error: Exception) -> str:
+    """Short error description that never includes request URLs (they carry API keys)"""
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        return f"HTTP {status}"
+    return type(error).__name__
+
+
+def error_detail(error: Exception) -> str:
+    """Client-facing message for an error; httpx errors are reduced to describe_error, as theirs embed the keyed URL"""
+    if isinstance(error, httpx.HTTPError):
+        return describe_error(error)
+    return str(error)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        """
+        Args:
+            rate: Tokens added per second
+            burst: Bucket capacity
+        """
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        """Wait for a token; callers are served in arrival order"""
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(
+        self,
+        initial: int = 16,
+        minimum: int = 1,
+        maximum: int = 128,
+        decrease_interval: float = 1.0
+    ):
+        """
+        AIMD concurrency limit: grows by one per window of successes, halves on overload
+
+        Args:
+            initial: Starting limit
+            minimum: Lowest the limit may shrink to
+            maximum: Highest the limit may grow to
+            decrease_interval: Minimum seconds between decreases, so one burst of
+                overload signals only halves the limit once
+        """
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease_interval = decrease_interval
+        self._last_decrease = 0.0
+        self._limit = float(initial)
+        self.in_flight = 0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    async def acquire(self) -> None:
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, overload: bool = False) -> None:
+        async with self._condition:
+            self.in_flight -= 1
+            if overload:
+                now = time.monotonic()
+                if now - self._last_decrease >= self.decrease_interval:
+                    self._last_decrease = now
+                    self._limit = max(self.minimum, self._limit / 2)
+            else:
+                self._limit = min(self.maximum, self._limit + 1 / max(self._limit, 1))
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Fail fast once an upstream keeps failing
+
+        Args:
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds to stay open before letting a trial call through
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.state = "closed"
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open" and self.retry_after() == 0:
+            self.state = "half_open"
+        if self.state == "half_open" and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.state = "closed"
+        self._trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """Let another trial through after one was abandoned without an outcome"""
+        self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                logger.warning(f"Circuit opened after {self.failures} consecutive failures")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+
+class UpstreamGuard:
+    def __init__(
+        self,
+        name: str,
+        classify: Callable[[Exception], Optional[Failure]],
+        rate: float = 50.0,
+        burst: float = 100.0,
+        initial_concurrency: int = 16,
+        max_concurrency: int = 128,
+        max_attempts: int = 3,
+        base_delay: float = 0.25,
+        max_delay: float = 8.0,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0
+    ):
+        """
+        Rate limiting, adaptive concurrency, retries and circuit breaking for one upstream
+
+        Args:
+            name: Upstream name used in errors and stats
+            classify: Maps an exception to a Failure, or None when it isn't an upstream fault
+            rate: Requests per second allowed per API key
+            burst: Token bucket capacity per API key
+            initial_concurrency: Starting concurrent request limit
+            max_concurrency: Ceiling for the adaptive concurrency limit
+            max_attempts: Attempts per idempotent call, including the first
+            base_delay: Backoff base in seconds (full jitter, doubling per attempt)
+            max_delay: Backoff cap in seconds
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds the circuit stays open
+        """
+        self.name = name
+        self.classify = classify
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.limiter = AdaptiveConcurrencyLimiter(initial_concurrency, maximum=max_concurrency)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.calls = 0
+        self.retries = 0
+        self.rejected = 0
+        self.rate_limited = 0
+
+    def _bucket(self, key: Optional[str]) -> TokenBucket:
+        bucket_key = hashlib.sha256((key or "").encode()).hexdigest()[:16]
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self._buckets[bucket_key] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def _to_error(self, error: Exception, failure: Failure) -> UpstreamError:
+        if failure.rate_limited:
+            return UpstreamRateLimited(self.name, f"{self.name} rate limit exceeded", failure.retry_after)
+        return UpstreamUnavailable(self.name, f"{self.name} request failed: {describe_error(error)}", failure.retry_after)
+
+    @asynccontextmanager
+    async def slot(self, key: Optional[str] = None) -> AsyncIterator[None]:
+        """
+        Admit one call (breaker, rate limit, concurrency) and record its outcome
+
+        Used directly for calls that can't be retried transparently, like streams.
+        """
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise UpstreamUnavailable(self.name, f"{self.name} circuit is open", self.breaker.retry_after())
+        try:
+            await self._bucket(key).acquire()
+            await self.limiter.acquire()
+        except BaseException:
+            # Cancelled while waiting for admission; a half-open trial taken by
+            # allow() above must be handed back or the circuit never closes
+            self.breaker.release_trial()
+            raise
+        self.calls += 1
+        overload = False
+        try:
+            yield
+        except Exception as e:
+            failure = self.classify(e)
+            if failure is None:
+                self.breaker.record_success()
+            else:
+                overload = failure.overload
+                if failure.rate_limited:
+                    self.rate_limited += 1
+                    self.breaker.record_success()
+                else:
+                    self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled or abandoned (e.g. a closed stream) without an outcome
+            self.breaker.release_trial()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            await self.limiter.release(overload)
+
+    async def call(
+        self,
+        fn: Callable[[], Awaitable[T]],
+        key: Optional[str] = None,
+        idempotent: bool = True
+    ) -> T:
+        """Run fn through the guard, retrying idempotent calls with jittered backoff"""
+        attempts = self.max_attempts if idempotent else 1
+        for attempt in range(attempts):
+            try:
+                async with self.slot(key):
+                    return await fn()
+            except UpstreamError:
+                raise
+            except Exception as e:
+                failure = self.classify(e)
+                if failure is None or not failure.retryable:
+                    raise
+                if attempt == attempts - 1:
+                    raise self._to_error(e, failure) from e
+                self.retries += 1
+                delay = self.backoff(attempt, failure.retry_after)
+                logger.warning(f"{self.name} call failed ({describe_error(e)}); retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+        raise AssertionError("unreachable")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "rejected": self.rejected,
+            "concurrency_limit": self.limiter.limit,
+            "in_flight": self.limiter.in_flight,
+            "circuit": self.breaker.state,
+        }
@@ -0,0 +1,109 @@
+# services/warm_start.py
+from typing import Any, Dict, Optional
+import asyncio
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+from services.street_view import GoogleStreetViewService
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+class WarmStartSnapshot:
+    def __init__(self, path: str, max_age: float = 604800.0):
+        """
+        The in-memory working set, saved at graceful shutdown and reloaded at startup
+
+        Covers the metadata cache (entries keep whatever TTL they had left,
+        less the downtime) and the panorama graph, so a restarted instance
+        answers repeat lookups and link probes without going to Google. The
+        image cache and spatial index already persist their own files and are
+        flushed alongside.
+
+        Args:
+            path: Snapshot file (gzip-compressed JSON)
+            max_age: Seconds after which a snapshot is too old to load
+        """
+        self.path = path
+        self.max_age = max_age
+        self.loaded: Dict[str, Any] = {}
+        self.saved: Dict[str, Any] = {}
+
+    def _snapshot(self, street_view: GoogleStreetViewService) -> Dict[str, Any]:
+        return {
+            "version": SNAPSHOT_VERSION,
+            "saved_at": time.time(),
+            "metadata": street_view.metadata_cache.dump() if street_view.metadata_cache is not None else [],
+            "graph": street_view.graph.dump() if street_view.graph is not None else [],
+        }
+
+    def _write(self, data: Dict[str, Any]) -> int:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(gzip.compress(json.dumps(data, separators=(",", ":")).encode(), compresslevel=6))
+        os.replace(tmp_path, self.path)
+        return os.path.getsize(self.path)
+
+    def _read(self) -> Optional[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "rb") as f:
+                raw = json.loads(gzip.decompress(f.read()))
+        except (OSError, ValueError, EOFError) as e:
+            logger.warning(f"Ignoring unreadable warm-start snapshot: {e}")
+            return None
+        if raw.get("version") != SNAPSHOT_VERSION:
+            logger.warning(f"Ignoring warm-start snapshot with unknown version {raw.get('version')}")
+            return None
+        return raw
+
+    async def save(self, street_view: GoogleStreetViewService) -> None:
+        """Write the working set; the file is replaced atomically, so a crash mid-write keeps the old one"""
+        started = time.perf_counter()
+        data = self._snapshot(street_view)
+        size = await asyncio.to_thread(self._write, data)
+        self.saved = {
+            "metadata": len(data["metadata"]),
+            "panoramas": len(data["graph"]),
+            "bytes": size,
+            "seconds": time.perf_counter() - started,
+        }
+        logger.info(f"Saved warm-start snapshot: {self.saved}")
+
+    async def load(self, street_view: GoogleStreetViewService) -> None:
+        """Restore the working set from the last snapshot, if there is a recent enough one"""
+        started = time.perf_counter()
+        raw = await asyncio.to_thread(self._read)
+        if raw is None:
+            return
+        elapsed = max(0.0, time.time() - raw.get("saved_at", 0.0))
+        if elapsed > self.max_age:
+            logger.info(f"Skipping warm-start snapshot saved {elapsed:.0f}s ago")
+            return
+        metadata = panoramas = 0
+        if street_view.metadata_cache is not None:
+            metadata = street_view.metadata_cache.restore(raw.get("metadata", []), elapsed=elapsed)
+        if street_view.graph is not None:
+            panoramas = street_view.graph.restore(raw.get("graph", []))
+        self.loaded = {
+            "metadata": metadata,
+            "panoramas": panoramas,
+            "images": street_view.image_cache.stats()["entries"] if street_view.image_cache is not None else 0,
+            "age_seconds": elapsed,
+            "seconds": time.perf_counter() - started,
+        }
+        logger.info(f"Loaded warm-start snapshot: {self.loaded}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **{f"loaded_{key}": value for key, value in self.loaded.items()},
+            **{f"saved_{key}": value for key, value in self.saved.items()},
+        }
@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# Modules import each other flat from the backend directory (as under uvicorn)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
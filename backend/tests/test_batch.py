@@ -0,0 +1,110 @@
+# tests/test_batch.py
+import argparse
+import asyncio
+import json
+import sqlite3
+import httpx
+import batch
+from services.job_queue import JobQueue
+
+API_KEY = "SECRETKEY"
+
+OUTPUT = {
+    "next_action": "complete",
+    "next_panorama": "",
+    "next_heading": 0,
+    "next_pitch": 0,
+    "next_zoom": 1,
+    "thoughts": "t",
+    "important_notes": [],
+    "goal_response": "found",
+}
+
+
+def job(pano_id: str) -> dict:
+    return {
+        "goal": "find a bakery", "pano_id": pano_id, "lat": None, "lng": None,
+        "heading": 0, "pitch": 0, "fov": 90, "metadata": {"status": "OK", "pano_id": pano_id},
+    }
+
+
+def batch_line(custom_id: str, message: dict) -> str:
+    return json.dumps({
+        "custom_id": custom_id,
+        "response": {"status_code": 200, "body": {"choices": [{"message": message}]}},
+        "error": None,
+    })
+
+
+def job_states(path: str) -> dict:
+    with sqlite3.connect(path) as conn:
+        return {key: (status, error) for key, status, error in conn.execute("SELECT key, status, error FROM jobs")}
+
+
+def test_failed_jobs_do_not_store_the_api_key(tmp_path):
+    path = str(tmp_path / "queue.db")
+
+    async def handle(key, payload):
+        request = httpx.Request("GET", f"https://maps.googleapis.com/maps/api/streetview?pano=P1&key={API_KEY}")
+        raise httpx.HTTPStatusError("Client error", request=request, response=httpx.Response(403, request=request))
+
+    async def main():
+        queue = JobQueue(path, max_attempts=1)
+        try:
+            await queue.enqueue([("job-1", {"pano_id": "P1"})])
+            return await batch.drain(queue, 1, handle)
+        finally:
+            queue.close()
+
+    assert asyncio.run(main())["failed"] == 1
+    assert job_states(path)["job-1"] == ("failed", "HTTP 403")
+
+
+def test_import_fails_refused_and_malformed_responses_individually(tmp_path):
+    path = str(tmp_path / "queue.db")
+    results = tmp_path / "batch_output.jsonl"
+    results.write_text("\n".join([
+        batch_line("refused", {"content": None, "refusal": "I can't help with that"}),
+        batch_line("malformed", {"content": "{\"next_action\": "}),
+        batch_line("good", {"content": json.dumps(OUTPUT)}),
+        batch_line("pending", {"content": json.dumps(OUTPUT)}),
+    ]) + "\n")
+
+    async def main():
+        queue = JobQueue(path)
+        try:
+            await queue.enqueue([(key, job(key)) for key in ("refused", "malformed", "good", "pending")])
+            for key in ("refused", "malformed", "good"):
+                await queue.mark_exported(key, job(key))
+        finally:
+            queue.close()
+        await batch.command_import(argparse.Namespace(
+            db=path, max_attempts=1, results=str(results), output=None, format=None
+        ))
+
+    asyncio.run(main())
+    states = job_states(path)
+    assert states["good"] == ("done", None)
+    assert states["refused"] == ("failed", "Model refused the analysis: I can't help with that")
+    assert states["malformed"][0] == "failed"
+    assert states["pending"] == ("pending", None)
+
+
+def test_exported_jobs_are_not_claimed_until_requeued(tmp_path):
+    async def main():
+        queue = JobQueue(str(tmp_path / "queue.db"))
+        try:
+            await queue.enqueue([("a", job("a")), ("b", job("b"))])
+            await queue.mark_exported("a", job("a"))
+            claimed = [key for key, _ in await queue.claim(10)]
+            pending = queue.payloads()
+            requeued = await queue.requeue_exported()
+            return claimed, pending, requeued, [key for key, _ in await queue.claim(10)]
+        finally:
+            queue.close()
+
+    claimed, pending, requeued, reclaimed = asyncio.run(main())
+    assert claimed == ["b"]
+    assert pending == []
+    assert requeued == 1
+    assert reclaimed == ["a"]
@@ -0,0 +1,48 @@
+# tests/test_novelty.py
+import asyncio
+import io
+import numpy as np
+from PIL import Image
+from models.openai import ActionTimeline, AnalysisOutput, ConnectedPanorama, ScreenshotAnalysis
+from services.model_cascade import validation_error
+from services.novelty import NoveltyTracker, view_signature
+
+
+def jpeg() -> bytes:
+    pixels = np.random.default_rng(0).integers(0, 255, (64, 64, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+
+def request_at(timeline) -> ScreenshotAnalysis:
+    return ScreenshotAnalysis(
+        goal="find cafes", latitude=40.0, longitude=-74.0, heading=0, pitch=0, zoom=1, images=[],
+        timeline=timeline, important_notes=[], panoramas=[ConnectedPanorama(pano="P2", heading=90)]
+    )
+
+
+def test_skips_only_when_the_earlier_analysis_is_still_valid():
+    raw = jpeg()
+    earlier = AnalysisOutput(
+        next_action="new_panorama", next_panorama="P2", next_heading=90, next_pitch=0, next_zoom=1,
+        thoughts="t", important_notes=[], goal_response=""
+    )
+    tracker = NoveltyTracker(threshold=0.5)
+    tracker.record("s", view_signature(raw), earlier)
+
+    fresh = request_at([])
+    report, _, merged = asyncio.run(tracker.assess(
+        "s", raw, usable=lambda output: validation_error(output, fresh) is None
+    ))
+    assert report.skipped and merged == earlier
+
+    # Once P2 has been visited, moving there again is a revisit, so the view is analyzed
+    visited = request_at([ActionTimeline(
+        action="new_panorama", panorama="P2", heading=90, pitch=0, zoom=1, timestamp="t"
+    )])
+    report, _, merged = asyncio.run(tracker.assess(
+        "s", raw, usable=lambda output: validation_error(output, visited) is None
+    ))
+    assert not report.skipped and merged is None
+    assert tracker.stats()["unusable"] == 1
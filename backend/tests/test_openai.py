@@ -0,0 +1,112 @@
+# tests/test_openai.py
+import asyncio
+from types import SimpleNamespace
+import pytest
+from fastapi import HTTPException
+from models.openai import AnalysisOutput, ScreenshotAnalysis
+from services.analysis_cache import AnalysisCache
+from services.model_cascade import ModelCascade
+from services.openai import OpenAIService
+from services.upstream import UpstreamGuard, UpstreamRateLimited, UpstreamUnavailable
+
+REFUSAL = "I can't help with that."
+
+
+class RefusingCompletions:
+    def __init__(self):
+        self.models = []
+
+    async def parse(self, model, messages, response_format, **kwargs):
+        self.models.append(model)
+        message = SimpleNamespace(parsed=None, refusal=REFUSAL)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, logprobs=None)], usage=None)
+
+
+class RateLimitedSmallModel:
+    """The cascade's small model is over quota; the requested model answers"""
+
+    def __init__(self):
+        self.models = []
+
+    async def parse(self, model, messages, response_format, **kwargs):
+        self.models.append(model)
+        if model == "gpt-4o-mini":
+            raise UpstreamRateLimited("openai", "openai rate limit exceeded")
+        output = AnalysisOutput(
+            next_action="complete", next_panorama="", next_heading=0, next_pitch=0, next_zoom=1,
+            thoughts="t", important_notes=[], goal_response="found"
+        )
+        message = SimpleNamespace(parsed=output, refusal=None)
+        return SimpleNamespace(choices=[SimpleNamespace(message=message, logprobs=None)], usage=None)
+
+
+def stub_service(completions, **kwargs) -> OpenAIService:
+    service = OpenAIService(api_key="sk-test", analysis_cache=AnalysisCache(), **kwargs)
+    service._client = SimpleNamespace(beta=SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    return service
+
+
+def refusing_service(**kwargs) -> tuple[OpenAIService, RefusingCompletions]:
+    completions = RefusingCompletions()
+    return stub_service(completions, **kwargs), completions
+
+
+def analysis_request(**overrides) -> ScreenshotAnalysis:
+    return ScreenshotAnalysis(
+        goal="find cafes", latitude=40.0, longitude=-74.0, heading=0, pitch=0, zoom=1,
+        images=[], timeline=[], important_notes=[], panoramas=[], **overrides
+    )
+
+
+def test_refusal_is_a_502_and_not_cached():
+    service, completions = refusing_service()
+    request = analysis_request(cascade=False)
+    for _ in range(2):
+        with pytest.raises(HTTPException) as raised:
+            asyncio.run(service.analyze(request))
+        assert raised.value.status_code == 502
+        assert REFUSAL in raised.value.detail
+    # Both requests reached the model: the refusal was never served from the cache
+    assert completions.models == ["gpt-4o", "gpt-4o"]
+    assert service.analysis_cache.stats()["hits"] == 0
+
+
+def test_escalated_refusal_is_a_502():
+    service, completions = refusing_service(cascade=ModelCascade(small_model="gpt-4o-mini"))
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(service.analyze(analysis_request()))
+    assert raised.value.status_code == 502
+    assert REFUSAL in raised.value.detail
+    # The small model's refusal escalated; the requested model's refusal is reported, not crashed on
+    assert completions.models == ["gpt-4o-mini", "gpt-4o"]
+    assert service.cascade.stats()["decisions"]["refusal"] == 1
+
+
+def test_small_model_upstream_error_escalates():
+    completions = RateLimitedSmallModel()
+    service = stub_service(completions, cascade=ModelCascade(small_model="gpt-4o-mini"))
+    result = asyncio.run(service.analyze(analysis_request()))
+    assert result.output.next_action == "complete"
+    assert (result.route.model, result.route.reason) == ("gpt-4o", "error")
+    assert completions.models == ["gpt-4o-mini", "gpt-4o"]
+
+
+def test_open_circuit_is_not_escalated():
+    guard = UpstreamGuard("openai", classify=lambda error: None, failure_threshold=1)
+    guard.breaker.record_failure()
+    completions = RateLimitedSmallModel()
+    service = stub_service(completions, cascade=ModelCascade(small_model="gpt-4o-mini"), guard=guard)
+    with pytest.raises(UpstreamUnavailable):
+        asyncio.run(service.analyze(analysis_request()))
+    assert completions.models == []
+
+
+def test_batch_request_uses_a_strict_schema():
+    service = OpenAIService(api_key="sk-test")
+    line = asyncio.run(service.batch_request("job-1", analysis_request()))
+    response_format = line["body"]["response_format"]
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["strict"] is True
+    schema = response_format["json_schema"]["schema"]
+    assert schema["additionalProperties"] is False
+    assert set(schema["required"]) == set(AnalysisOutput.model_fields)
@@ -0,0 +1,102 @@
+# tests/test_redis_shared_state.py
+import asyncio
+import pytest
+from benchmarks.fake_upstreams import FakeRedisServer
+from services.shared_state import RedisConnection, RedisError, RedisSharedState, SharedFlight
+
+
+def run_with_server(scenario, **kwargs):
+    async def main():
+        async with FakeRedisServer(**kwargs) as server:
+            await scenario(server)
+    asyncio.run(main())
+
+
+def test_encode_and_read_replies():
+    assert RedisConnection.encode(("SET", "k", b"v\r\n", 5)) == b"*4\r\n$3\r\nSET\r\n$1\r\nk\r\n$3\r\nv\r\n\r\n$1\r\n5\r\n"
+
+    async def replies():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"+OK\r\n:3\r\n$3\r\nabc\r\n$-1\r\n*2\r\n$1\r\na\r\n:1\r\n*-1\r\n-ERR boom\r\n")
+        connection = RedisConnection(reader, None)
+        values = [await connection._read() for _ in range(6)]
+        with pytest.raises(RedisError, match="ERR boom"):
+            await connection._read()
+        return values
+
+    assert asyncio.run(replies()) == ["OK", 3, b"abc", None, [b"a", 1], None]
+
+
+def test_lock_and_compare_and_delete_release():
+    async def scenario(server):
+        state = RedisSharedState(server.url)
+        token = await state.acquire("pano", ttl=5)
+        assert token is not None
+        assert await state.acquire("pano", ttl=5) is None
+        assert not await state.release("pano", "someone-else")
+        assert await state.release("pano", token)
+        assert await state.acquire("pano", ttl=5) is not None
+        await state.set("value", b"\x00bytes", ttl=0.05)
+        assert await state.get("value") == b"\x00bytes"
+        await asyncio.sleep(0.1)
+        assert await state.get("value") is None
+        await state.close()
+
+    run_with_server(scenario)
+
+
+def test_dropped_connection_is_discarded():
+    async def scenario(server):
+        state = RedisSharedState(server.url)
+        await state.set("k", b"v")
+        server.drop_next = True
+        with pytest.raises((asyncio.IncompleteReadError, ConnectionError)):
+            await state.get("k")
+        assert state.stats()["idle_connections"] == 0
+        # The next command opens a fresh connection
+        assert await state.get("k") == b"v"
+        assert state.stats()["errors"] == 1
+        await state.close()
+
+    run_with_server(scenario)
+
+
+def test_error_reply_keeps_the_connection():
+    async def scenario(server):
+        state = RedisSharedState(server.url)
+        server.error_next = "ERR boom"
+        with pytest.raises(RedisError, match="boom"):
+            await state.get("k")
+        assert state.stats()["idle_connections"] == 1
+        assert await state.get("k") is None
+        await state.close()
+
+    run_with_server(scenario)
+
+
+def test_rejected_auth_closes_the_connection():
+    async def scenario(server):
+        state = RedisSharedState(server.url.replace("secret", "wrong"))
+        for _ in range(3):
+            with pytest.raises(RedisError, match="WRONGPASS"):
+                await state.get("k")
+        await asyncio.sleep(0.05)
+        assert server.connections == 0
+        assert state.stats()["errors"] == 3
+
+    run_with_server(scenario, password="secret")
+
+
+def test_shared_flight_over_a_dropped_connection_fetches_locally():
+    async def scenario(server):
+        flight = SharedFlight(RedisSharedState(server.url))
+        server.drop_next = True
+
+        async def fetch() -> bytes:
+            return b"image"
+
+        assert await flight.do("k", fetch) == b"image"
+        assert flight.stats()["fallbacks"] == 1
+        await flight.state.close()
+
+    run_with_server(scenario)
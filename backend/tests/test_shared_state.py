@@ -0,0 +1,80 @@
+# tests/test_shared_state.py
+import asyncio
+from services.shared_state import MemorySharedState, SharedFlight, SQLiteSharedState
+
+
+class FlakySharedState(MemorySharedState):
+    """Memory state whose named operations fail as if the backend were down"""
+
+    def __init__(self, failing: set):
+        super().__init__()
+        self.failing = failing
+
+    async def get(self, key):
+        if "get" in self.failing:
+            raise ConnectionError("backend down")
+        return await super().get(key)
+
+    async def set(self, key, value, ttl=None):
+        if "set" in self.failing:
+            raise ConnectionError("backend down")
+        await super().set(key, value, ttl)
+
+    async def add(self, key, value, ttl=None):
+        if "add" in self.failing:
+            raise ConnectionError("backend down")
+        return await super().add(key, value, ttl)
+
+
+def counting_fetch(calls: list):
+    async def fetch() -> bytes:
+        calls.append(1)
+        return b"image"
+    return fetch
+
+
+def test_unavailable_state_falls_back_to_fetching_locally():
+    flight = SharedFlight(FlakySharedState({"get", "set", "add"}))
+    calls = []
+    assert asyncio.run(flight.do("k", counting_fetch(calls))) == b"image"
+    assert len(calls) == 1
+    assert flight.stats()["fallbacks"] == 1 and flight.stats()["state_errors"] == 1
+
+
+def test_failed_publish_keeps_the_fetched_value():
+    flight = SharedFlight(FlakySharedState({"set"}))
+    calls = []
+    assert asyncio.run(flight.do("k", counting_fetch(calls))) == b"image"
+    assert len(calls) == 1
+    assert flight.stats()["state_errors"] == 1
+    # The lock was still released, so the next caller isn't left waiting on it
+    assert asyncio.run(flight.do("k", counting_fetch(calls))) == b"image"
+    assert flight.stats()["waits"] == 0
+
+
+def test_fetch_errors_are_not_retried_as_state_errors():
+    flight = SharedFlight(MemorySharedState())
+    calls = []
+
+    async def failing() -> bytes:
+        calls.append(1)
+        raise RuntimeError("upstream failed")
+
+    try:
+        asyncio.run(flight.do("k", failing))
+    except RuntimeError:
+        pass
+    assert len(calls) == 1 and flight.stats()["state_errors"] == 0
+
+
+def test_sqlite_stats_do_not_query_the_database(tmp_path):
+    state = SQLiteSharedState(str(tmp_path / "state.db"), count_interval=0)
+
+    async def main():
+        await state.set("a", b"1")
+        await state.add("b", b"2")
+        await state.close()
+
+    asyncio.run(main())
+    # Served from the count kept by writes, so it works (and never blocks) with the connection closed
+    assert state.stats() == {"keys": 2}
@@ -0,0 +1,37 @@
+# tests/test_street_view_routes.py
+import json
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from config import Settings
+from routes import street_view
+from services.street_view import GoogleStreetViewService
+
+API_KEY = "SECRETKEY"
+
+
+def forbidding_app() -> FastAPI:
+    """The Street View router over a service whose upstream answers every request with 403"""
+    service = GoogleStreetViewService(api_key=API_KEY)
+    service._client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(403)))
+    app = FastAPI()
+    app.state.settings = Settings()
+    app.state.street_view = service
+    app.state.transcoder = None
+    app.include_router(street_view.router)
+    return app
+
+
+def test_batch_errors_do_not_leak_the_api_key():
+    with TestClient(forbidding_app()) as client:
+        response = client.post("/streetview/batch", json={"views": [{"pano_id": "P1"}, {"pano_id": "P2"}]})
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert [line["error"] for line in lines] == ["HTTP 403", "HTTP 403"]
+    assert API_KEY not in response.text
+
+
+def test_image_route_errors_do_not_leak_the_api_key():
+    with TestClient(forbidding_app()) as client:
+        response = client.get("/streetview/by-pano/P1")
+    assert response.status_code == 400
+    assert API_KEY not in response.text
@@ -0,0 +1,39 @@
+# tests/test_upstream.py
+import asyncio
+from services.upstream import Failure, UpstreamGuard
+
+
+def test_cancel_during_admission_releases_half_open_trial():
+    async def scenario():
+        guard = UpstreamGuard(
+            "test",
+            lambda e: Failure(True),
+            initial_concurrency=1,
+            max_concurrency=1,
+            failure_threshold=1,
+            reset_timeout=0.01
+        )
+        # Hold the only concurrency slot so the next caller waits in admission
+        holder = guard.slot()
+        await holder.__aenter__()
+        guard.breaker.record_failure()
+        await asyncio.sleep(0.02)
+
+        async def admitted():
+            async with guard.slot():
+                pass
+
+        waiter = asyncio.create_task(admitted())
+        await asyncio.sleep(0.01)
+        assert guard.breaker.state == "half_open" and guard.breaker._trial_in_flight
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+        assert not guard.breaker._trial_in_flight
+        await holder.__aexit__(None, None, None)
+        # The next call gets the trial instead of "circuit is open"
+        async with guard.slot():
+            pass
+        assert guard.breaker.state == "closed"
+
+    asyncio.run(scenario())